@@ -1,6 +1,9 @@
 from external_api import *
 from utils import *
 import slurm_api
+import work_watcher
+import work_queue
+import job_broker
 import external_api
 
 # Load configuration from JSON file
@@ -68,6 +71,33 @@ def buffer_monitoring():
         print("Number of layout generator running: " + str(NUM_LAYOUT_GENERATOR))
         print("Number of layout evaluator running: " + str(NUM_LAYOUT_EVALUATOR))
         print("Number of optimizer running: " + str(NUM_OPTIMIZER))
+        if job_broker.TRANSPORT == "broker":
+            print("Job broker queue depth: " + str(job_broker.get_client().depth()))
+        else:
+            # requeue the jobs held by layout generators and evaluators that died, e.g. on walltime or OOM
+            for stage in work_queue.STAGES:
+                requeued = work_queue.maybe_requeue_expired_leases(stage, log_event)
+                if requeued:
+                    log_event(
+                        "Requeued " + str(requeued) + " " + stage + " jobs of dead workers"
+                    )
+            print(
+                "Queue depth: "
+                + str(work_watcher.count_jobs(endswith=".params", stage="params"))
+                + " params, "
+                + str(work_watcher.count_jobs(endswith=".batch", stage="batch"))
+                + " batch, "
+                + str(
+                    work_watcher.count_jobs(
+                        endswith=".dot", not_startswith="to_check_", stage="dot"
+                    )
+                )
+                + " dot, "
+                + str(work_watcher.count_jobs(endswith=".layout", stage="layout"))
+                + " layout, "
+                + str(work_watcher.count_jobs(endswith=".staged", stage="staged"))
+                + " staged"
+            )
 
         email_instruction_list = retrieve_file_list(
             startswith="",
@@ -212,6 +242,14 @@ def call_GraphOptima_jobs(
                         + " left"
                     )
                     JOB_SUBMISSION_COUNTER += 1
+                if CONFIG["optimizer"]["LAYOUT_GENERATOR"] == "numba":
+                    os.system("sbatch sbatch_script_layout_generator_fa2.sh")
+                    log_event(
+                        "Called a numba ForceAtlas2 layout_generator job, "
+                        + str(num_generator_to_call)
+                        + " left"
+                    )
+                    JOB_SUBMISSION_COUNTER += 1
             if num_evaluator_to_call > 0:
                 num_evaluator_to_call -= 1
                 os.system("sbatch sbatch_script_layout_evaluator.sh")
@@ -0,0 +1,225 @@
+"""
+This module lets one .batch manifest carry up to BATCH_SIZE parameter sets instead of one .params file per candidate,
+so that the queue overhead of a DE or NSGA2 generation grows with the number of batches rather than the number of
+candidates.
+
+On the optimizer side, BatchMap evaluates a whole population concurrently (it is passed as the DE `workers` and as the
+NSGA2 elementwise runner), and utils.make_params_file hands every param set to the BatchCollector of the process. The
+collector writes a manifest as soon as BATCH_SIZE param sets are pending, or LINGER seconds after the first pending
+one, which also covers the candidates resubmitted after a core dump.
+On the generator side, a claimed manifest is processed item by item, or all at once by a generator that can simulate
+several param sets together (see force_atlas2.force_atlas2_batch); each layout is published as usual, and a
+<batch id>.batch_result file records the status of every item. Failed items get a penalty result right away.
+"""
+
+import json
+import os
+import threading
+import traceback
+import uuid as uuid_lib
+from concurrent.futures import ThreadPoolExecutor
+import work_queue
+import work_shards
+import dispatch_scheduler
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for batch_manifest
+CONFIG = CONFIG["batch_manifest"]
+
+BATCH_SIZE = CONFIG["BATCH_SIZE"]
+LINGER = CONFIG["LINGER"]
+
+
+def write_manifest(batch_id: str, items: list):
+    # same as the .params files: write under a hidden name first, then publish with an atomic rename
+    directory = work_shards.get_job_directory("batch", batch_id)
+    temporary_file = os.path.join(directory, "." + batch_id + ".batch_temp")
+    with open(temporary_file, "w") as f:
+        json.dump({"batch_id": batch_id, "items": items}, f)
+    os.rename(temporary_file, os.path.join(directory, batch_id + ".batch"))
+
+
+def read_manifest(batch_file: str) -> dict:
+    with open(batch_file) as f:
+        return json.load(f)
+
+
+def get_batch_result_path(batch_id: str) -> str:
+    return os.path.join(
+        work_shards.get_result_directory(batch_id, work_queue.RESULT_DIRECTORY),
+        batch_id + ".batch_result",
+    )
+
+
+def write_batch_result(batch_id: str, statuses: list):
+    temporary_file = os.path.join(
+        work_shards.get_result_directory(batch_id, work_queue.RESULT_DIRECTORY),
+        "." + batch_id + ".batch_result_temp",
+    )
+    with open(temporary_file, "w") as f:
+        json.dump({"batch_id": batch_id, "items": statuses}, f)
+    os.rename(temporary_file, get_batch_result_path(batch_id))
+
+
+def read_and_remove_batch_result(batch_id: str):
+    """
+    Return the per-item statuses of a processed batch and remove its result file, or None if it isn't there (yet).
+    """
+    try:
+        with open(get_batch_result_path(batch_id)) as f:
+            statuses = json.load(f)["items"]
+        os.remove(get_batch_result_path(batch_id))
+    except FileNotFoundError:
+        return None
+    return statuses
+
+
+def process_batch_file(
+    batch_file: str, process_params, debug_print=print, process_params_batch=None
+) -> bool:
+    """
+    Generate the layout of every item of a claimed manifest with process_params(layout_id, params), or of all of them
+    with process_params_batch(layout_ids, params_list, published) if given, then publish the per-item statuses.
+    process_params_batch adds the id of every layout it has handed on to the published set, so that if it fails
+    halfway, only the other items are generated once more, one by one.
+    """
+    manifest = read_manifest(batch_file)
+    debug_print(
+        f"Processing batch {manifest['batch_id']} of {len(manifest['items'])} param sets"
+    )
+    published = set()
+    if process_params_batch is not None:
+        try:
+            process_params_batch(
+                [item["uuid"] for item in manifest["items"]],
+                [item["params"] for item in manifest["items"]],
+                published,
+            )
+            write_batch_result(
+                manifest["batch_id"],
+                [{"uuid": item["uuid"], "status": "ok"} for item in manifest["items"]],
+            )
+            return True
+        except Exception:
+            traceback.print_exc()
+            debug_print(
+                f"Batch {manifest['batch_id']} failed after {len(published)} layouts, generating the other "
+                f"{len(manifest['items']) - len(published)} one by one"
+            )
+    statuses = []
+    for item in manifest["items"]:
+        if item["uuid"] in published:
+            # already handed on by the batch, publishing it again would only make a duplicate
+            statuses.append({"uuid": item["uuid"], "status": "ok"})
+            continue
+        try:
+            process_params(item["uuid"], item["params"])
+            statuses.append({"uuid": item["uuid"], "status": "ok"})
+        except Exception as e:
+            traceback.print_exc()
+            # don't let the optimizer wait for a layout that will never come
+            work_queue.publish_penalty_result(
+                item["uuid"], "layout generation failed: " + str(e)
+            )
+            statuses.append({"uuid": item["uuid"], "status": "failed", "message": str(e)})
+    write_batch_result(manifest["batch_id"], statuses)
+    return True
+
+
+class BatchCollector:
+    def __init__(self, batch_size: int = BATCH_SIZE, linger: float = LINGER):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.lock = threading.Lock()
+        self.pending = []
+        self.priority = None
+        self.timer = None
+        # ids of the manifests written so far, for BatchMap to collect their results
+        self.batch_ids = []
+        # ids of the manifests whose result file wasn't there yet when their BatchMap call ended
+        self.unread_batch_ids = []
+
+    def add(self, uuid: str, params: list, priority: str = None):
+        with self.lock:
+            self.pending.append({"uuid": uuid, "params": params})
+            # a manifest goes with the most urgent of its param sets
+            if priority is not None and (self.priority is None or priority < self.priority):
+                self.priority = priority
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.linger, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch_id = dispatch_scheduler.make_job_name(str(uuid_lib.uuid4()), self.priority)
+        write_manifest(batch_id, self.pending)
+        self.batch_ids.append(batch_id)
+        self.pending = []
+        self.priority = None
+
+
+_COLLECTORS = {}
+
+
+def get_collector() -> BatchCollector:
+    # a collector's timer thread doesn't survive a fork, so every process has its own
+    collector = _COLLECTORS.get(os.getpid())
+    if collector is None:
+        collector = BatchCollector()
+        _COLLECTORS[os.getpid()] = collector
+    return collector
+
+
+class BatchMap:
+    """
+    Map-like callable evaluating all the candidates of a population concurrently with threads, so that their param sets
+    end up in the same manifests. It is used as the DE `workers` and as the NSGA2 elementwise runner.
+    At most max_workers candidates are evaluated at a time, at least a manifest's worth.
+    """
+
+    def __init__(self, max_workers: int = BATCH_SIZE):
+        self.max_workers = max(max_workers, BATCH_SIZE)
+
+    def __call__(self, func, iterable):
+        candidates = list(iterable)
+        if not candidates:
+            return []
+        collector = get_collector()
+        first_batch = len(collector.batch_ids)
+        with ThreadPoolExecutor(max_workers=min(len(candidates), self.max_workers)) as executor:
+            results = list(executor.map(func, candidates))
+
+        # every layout of the population has a result now, so the batches of this call are done, and the result files
+        # that were still missing at the end of an earlier call have most likely been written meanwhile
+        with collector.lock:
+            batch_ids = collector.unread_batch_ids + collector.batch_ids[first_batch:]
+            del collector.batch_ids[first_batch:]
+            collector.unread_batch_ids = []
+        for batch_id in batch_ids:
+            statuses = read_and_remove_batch_result(batch_id)
+            if statuses is None:
+                # a row can be decided before its batch completes, e.g. by a timeout, a straggler penalty or the
+                # deferred completion of the layout writer, so look again in the next call
+                with collector.lock:
+                    collector.unread_batch_ids.append(batch_id)
+                continue
+            for status in statuses:
+                if status["status"] != "ok":
+                    print(
+                        f"Layout {status['uuid']} of batch {batch_id} failed: {status.get('message')}"
+                    )
+        return results
@@ -9,7 +9,14 @@ import json
 import external_api
 import pos_to_readability_score
 import traceback
+import threading
 import time
+import dispatch_scheduler
+import runtime_model
+import straggler_monitor
+import warm_start
+import early_abort
+import multilevel
 
 # Load configuration from JSON file
 with open("config.json") as f:
@@ -38,7 +45,9 @@ READABILITY_CALCULATION_METHOD = OPTIMIZATION_METADATA["readability_calculation_
 SINGLE_OBJECTIVE_FUNC = CONFIG["optimizer"]["SINGLE_OBJECTIVE_FUNC"]
 
 EVAL_COUNTER = 0
-CORE_DUMP = 0
+
+# the in-memory pipeline evaluates a population with threads that share the database connections and the counters
+DATABASE_LOCK = threading.RLock()
 
 DATABASE = optimization_database.read_database_file_to_object(conn=CONN)
 GLOBAL_DATABASE = optimization_database.read_database_file_to_object(conn=GLOBAL_CONN)
@@ -76,23 +85,31 @@ NUM_OF_DESIGN_PARAMS = CONFIG["optimizer"]["NUM_OF_DESIGN_PARAMS"]
 NUM_OF_OBJECTIVE_PARAMS = CONFIG["optimizer"]["NUM_OF_OBJECTIVE_PARAMS"]
 
 
-def combined_objective_func(params: list):
+def combined_objective_func(params: list, level: int = 0, core_dump: int = 0):
+    """
+    Return the readability of the params, evaluated on the input graph, or on a coarse level of it, see multilevel.py
+    core_dump is the depth of the retries after a core dump, an argument rather than a global, as the threads of a
+    population evaluate params concurrently
+    """
     global EVAL_COUNTER
     global DATABASE
     global GLOBAL_DATABASE
 
     layout_id = generate_layout_id()
 
-    global CORE_DUMP
-
     readability = None
     multi_objective_results = None
+    straggler_decision = None
+    aborted = False
+    generated_layout_id = layout_id
 
-    if not CORE_DUMP:
+    if not core_dump:
         print("\n\n\n")
         print("eval " + str(EVAL_COUNTER))
         print("Params: " + str(params))
         print("layout id:" + layout_id)
+        if level:
+            print("Fidelity level: " + str(level))
         print(
             "Weights: "
             + str(
@@ -114,15 +131,25 @@ def combined_objective_func(params: list):
                 DATABASE_CACHING_INTERVAL == 0
                 or EVAL_COUNTER % DATABASE_CACHING_INTERVAL == 0
             ):
-                DATABASE = optimization_database.read_database_file_to_object(conn=CONN)
-                GLOBAL_DATABASE = optimization_database.read_database_file_to_object(
-                    conn=GLOBAL_CONN
-                )
+                with DATABASE_LOCK:
+                    DATABASE = optimization_database.read_database_file_to_object(
+                        conn=CONN
+                    )
+                    GLOBAL_DATABASE = (
+                        optimization_database.read_database_file_to_object(
+                            conn=GLOBAL_CONN
+                        )
+                    )
             query_end_time = time.time()
             cosine_start_time = time.time()
+            # the projected metrics of an aborted layout can't stand in for other params
+            global_database_object = early_abort.select_evaluated(GLOBAL_DATABASE)
+            if multilevel.ENABLED:
+                # only the results of the same graph can stand in for the params
+                global_database_object = multilevel.select_level(global_database_object, level)
             closest_params, closest_glam_results, cosine_similarity = (
                 optimization_database.find_the_closest_param_using_cosine_similarity(
-                    params=params, global_database_object=GLOBAL_DATABASE
+                    params=params, global_database_object=global_database_object
                 )
             )
             cosine_end_time = time.time()
@@ -145,7 +172,8 @@ def combined_objective_func(params: list):
                         "Cosine similarity calculation time: "
                         + str(cosine_end_time - cosine_start_time)
                     )
-                EVAL_COUNTER += 1
+                with DATABASE_LOCK:
+                    EVAL_COUNTER += 1
 
                 print("GLAM results: " + str(closest_glam_results))
 
@@ -189,42 +217,59 @@ def combined_objective_func(params: list):
     for the same layout, retry MAX_ALLOWED times
     if still error, returning the -inf reward 
     """
-    error_counter = 0
-    while error_counter <= MAX_ALLOWABLE_ERROR_RETRY:
-        try:
-            if error_counter:
-                print("# error encounter for this layout: " + str(error_counter))
-
-            make_params_file(params=params, uuid=layout_id)
-            break
-        except Exception as e:
-            print(str(e))
-
-            error_counter += 1
-
-    if error_counter > MAX_ALLOWABLE_ERROR_RETRY:
-        external_api.write_instruction(
-            subject="Error encountered too many times!",
-            message="Using "
-            + str(params)
-            + "has raise too many times ( "
-            + str(MAX_ALLOWABLE_ERROR_RETRY)
-            + " times ) of error, returning maximum penalty.",
-            instruction_type="email_instruction",
-        )
-        print(
-            str(params)
-            + "has raise too many times of error, returning maximum penalty."
-        )
+    # the evaluation holds a slot of the in-flight window from the params file until its result is read
+    expected_runtime = runtime_model.predict(params) if runtime_model.ENABLED else None
+    # the layout generators lay out the coarse level given as the 4th param
+    job_params = multilevel.with_level(params, level)
+    with dispatch_scheduler.dispatch(expected_runtime) as priority:
+        error_counter = 0
+        while error_counter <= MAX_ALLOWABLE_ERROR_RETRY:
+            try:
+                if error_counter:
+                    print("# error encounter for this layout: " + str(error_counter))
+
+                make_params_file(params=job_params, uuid=layout_id, priority=priority)
+                break
+            except Exception as e:
+                print(str(e))
+
+                error_counter += 1
+
+        if error_counter > MAX_ALLOWABLE_ERROR_RETRY:
+            external_api.write_instruction(
+                subject="Error encountered too many times!",
+                message="Using "
+                + str(params)
+                + "has raise too many times ( "
+                + str(MAX_ALLOWABLE_ERROR_RETRY)
+                + " times ) of error, returning maximum penalty.",
+                instruction_type="email_instruction",
+            )
+            print(
+                str(params)
+                + "has raise too many times of error, returning maximum penalty."
+            )
 
-        # returning maximum penalty as the params raise too many times of error
-        results = [MAX_VAL, MAX_VAL, MAX_VAL, MAX_VAL, MAX_VAL, MAX_VAL]
+            # returning maximum penalty as the params raise too many times of error
+            results = list(reward.PENALTY_GLAM_RESULTS)
 
-    else:
-        print("Layout generation order is send, gathering the readability result...")
-        results = pos_to_readability_score.retrieve_readability_score_and_cleanup(
-            uuid=layout_id, cleanup=True, echo=True
-        )
+        else:
+            print("Layout generation order is send, gathering the readability result...")
+            try:
+                results, straggler_decision = straggler_monitor.retrieve(
+                    layout_id=layout_id, params=job_params, priority=priority
+                )
+            except TimeoutError as e:
+                # the result never showed up within RESULT_TIMEOUT, e.g. its worker died, so the params get the
+                # penalty instead of failing the whole population
+                print(str(e) + ", returning maximum penalty.")
+                straggler_monitor.discard_later([layout_id])
+                results = list(reward.PENALTY_GLAM_RESULTS)
+                straggler_decision = {"action": "timeout"}
+            # the layout that was generated is the duplicate if the duplicate of a straggler won
+            if straggler_decision is not None and straggler_decision.get("winner") == "duplicate":
+                generated_layout_id = straggler_decision["duplicate"]
+            aborted = pos_to_readability_score.pop_aborted(generated_layout_id)
     try:
         if SINGLE_OBJECTIVE_FUNC:
             readability = reward.minimized_total_readability_reward(
@@ -250,60 +295,78 @@ def combined_objective_func(params: list):
 
     except Exception as e:
         traceback.print_exc()
-        EVAL_COUNTER = EVAL_COUNTER - 1
-        CORE_DUMP += 1
+        with DATABASE_LOCK:
+            EVAL_COUNTER = EVAL_COUNTER - 1
         print("Core Dumped, recursively recalculate the readability ...")
         if SINGLE_OBJECTIVE_FUNC:
-            readability = combined_objective_func(params)
+            readability = combined_objective_func(params, level, core_dump + 1)
         else:
-            multi_objective_results = combined_objective_func(params)
-        CORE_DUMP -= 1
-
-    if not CORE_DUMP:
-        EVAL_COUNTER += 1
+            multi_objective_results = combined_objective_func(params, level, core_dump + 1)
+
+    if not core_dump:
+        # a straggler's row records whether it was speculated on or penalized
+        metadata = METADATA
+        if straggler_decision is not None:
+            metadata = dict(METADATA, straggler=straggler_decision)
+        # the graph it was evaluated on, see multilevel.py
+        if multilevel.ENABLED:
+            metadata = dict(metadata, fidelity=multilevel.get_fidelity(level))
+        # and whether its layout was warm-started from an archived one, see warm_start.py
+        if warm_start.ENABLED and not level:
+            metadata = dict(
+                metadata, warm_start=warm_start.get_status(generated_layout_id)
+            )
+        # and whether its metrics were projected from a snapshot of an aborted layout, see early_abort.py
+        if aborted:
+            metadata = dict(metadata, early_abort="aborted")
         try:
-            if SINGLE_OBJECTIVE_FUNC:
-                optimization_database.log_and_save(
-                    iteration=EVAL_COUNTER,
-                    params=params,
-                    glam_results=results,
-                    readability=readability,
-                    metadata=METADATA,
-                    conn=CONN,
-                    echo=True,
-                )
-                optimization_database.log_and_save(
-                    iteration=EVAL_COUNTER,
-                    params=params,
-                    glam_results=results,
-                    readability=readability,
-                    metadata=METADATA,
-                    conn=GLOBAL_CONN,
-                    echo=True,
-                )
-            else:
-                optimization_database.log_and_save(
-                    iteration=EVAL_COUNTER,
-                    params=params,
-                    glam_results=results,
-                    readability=multi_objective_results,
-                    metadata=METADATA,
-                    conn=CONN,
-                    echo=True,
-                )
-                optimization_database.log_and_save(
-                    iteration=EVAL_COUNTER,
-                    params=params,
-                    glam_results=results,
-                    readability=multi_objective_results,
-                    metadata=METADATA,
-                    conn=GLOBAL_CONN,
-                    echo=True,
-                )
+            with DATABASE_LOCK:
+                EVAL_COUNTER += 1
+                if SINGLE_OBJECTIVE_FUNC:
+                    optimization_database.log_and_save(
+                        iteration=EVAL_COUNTER,
+                        params=params,
+                        glam_results=results,
+                        readability=readability,
+                        metadata=metadata,
+                        conn=CONN,
+                        echo=True,
+                    )
+                    optimization_database.log_and_save(
+                        iteration=EVAL_COUNTER,
+                        params=params,
+                        glam_results=results,
+                        readability=readability,
+                        metadata=metadata,
+                        conn=GLOBAL_CONN,
+                        echo=True,
+                    )
+                else:
+                    optimization_database.log_and_save(
+                        iteration=EVAL_COUNTER,
+                        params=params,
+                        glam_results=results,
+                        readability=multi_objective_results,
+                        metadata=metadata,
+                        conn=CONN,
+                        echo=True,
+                    )
+                    optimization_database.log_and_save(
+                        iteration=EVAL_COUNTER,
+                        params=params,
+                        glam_results=results,
+                        readability=multi_objective_results,
+                        metadata=metadata,
+                        conn=GLOBAL_CONN,
+                        echo=True,
+                    )
         except Exception as e:
             # display the error
             print("Error when saving to the database: " + str(e))
             time.sleep(5)
+        # the generators abort the layouts that can't beat the best readability so far, see early_abort.py
+        if early_abort.ENABLED and SINGLE_OBJECTIVE_FUNC and not level and not aborted:
+            early_abort.update_incumbent(readability)
 
     # try to remove any core.* file exist under the current directory
     try:
@@ -320,3 +383,37 @@ def combined_objective_func(params: list):
         else:
             print("multi_objective_results: " + str(multi_objective_results))
             return multi_objective_results
+
+
+def multilevel_objective_func(params: list):
+    """
+    Screen the params on the coarse levels of the graph, from the coarsest one, and return the readability of the
+    input graph if they are promoted all the way, or else the one projected from the level they stopped at
+    """
+    global DATABASE
+
+    for level in multilevel.get_screening_levels():
+        # the cached database of the current weights, refreshed as often as for the substitution
+        with DATABASE_LOCK:
+            if (
+                DATABASE_CACHING_INTERVAL == 0
+                or EVAL_COUNTER % DATABASE_CACHING_INTERVAL == 0
+            ):
+                DATABASE = optimization_database.read_database_file_to_object(
+                    conn=CONN
+                )
+            database = DATABASE
+        level_readabilities = multilevel.get_level_readabilities(database, level)
+        readability = combined_objective_func(params, level=level)
+        if not multilevel.should_promote(level_readabilities, readability):
+            projected_readability = multilevel.project(
+                readability,
+                level_readabilities,
+                multilevel.get_level_readabilities(database, 0),
+            )
+            print(
+                f"Params not promoted from level {level}, projected readability: {projected_readability}"
+            )
+            return projected_readability
+        print(f"Params promoted from level {level}")
+    return combined_objective_func(params)
@@ -5,19 +5,34 @@ script will lock the file and process the .param file. The layout generator will
 a .dot file. The .dot file will then be processed by the pos_to_readability_score.py to calculate the readability score
 """
 
+import re
 import time
 
 import cudf
 import cugraph
 import graph_tool.all as gt
 import pos_to_readability_score
+import work_queue
+import work_shards
+import batch_manifest
+import runtime_model
+import warm_start
+import iteration_checkpoint
+import early_abort
+import layout_writer
+import shared_positions
+import layout_artifact
+import graph_snapshot
+import multilevel
 from filelock import FileLock, Timeout
 import json
+import job_broker
 import utils
 import input_graphs.csv2tsv
 import os
 import subprocess
 from utils import *
+from work_watcher import DirectoryWatcher
 
 # Load configuration from JSON file
 with open("config.json") as f:
@@ -36,59 +51,73 @@ GRAPH_FILE_PATH, GRAPH_FILE_NAME = os.path.split(GRAPH_FILE_NAME)
 # Construct the CSV_FILE path correctly
 CSV_FILE = GRAPH_FILE_PATH + '/fixed_' + GRAPH_FILE_NAME + "-edges.csv"
 
-while True:
-    # Check if the CSV version of the graph exists under the input_graphs folder
-    if not os.path.exists(CSV_FILE):
-        # Try to acquire lock for the GraphML file
-        lock = FileLock(GRAPHML_FILE + ".lock")
-        try:
-            acquired = lock.acquire(timeout=0)
-            if acquired:
-                try:
-                    # Convert the GraphML file to a CSV file
-                    subprocess.run(["python", "input_graphs/graphml2csv.py", "-i", GRAPHML_FILE], check=True)
-                    print("Conversion successful.")
-                except Exception as e:
-                    print(f"\n\nAn error occurred: {e}")
-                    print("Falling back to graph-tool backend to retry...")
+# the snapshot replaces the CSV/TSV conversion and the GraphML parsing, see graph_snapshot.py
+if not graph_snapshot.ENABLED:
+    while True:
+        # Check if the CSV version of the graph exists under the input_graphs folder
+        if not os.path.exists(CSV_FILE):
+            # Try to acquire lock for the GraphML file
+            lock = FileLock(GRAPHML_FILE + ".lock")
+            try:
+                acquired = lock.acquire(timeout=0)
+                if acquired:
                     try:
-                        # Retry by first loading the GraphML using graph-tool
-                        g = gt.load_graph(GRAPHML_FILE)
-                        print("Graph loaded by graph-tool. Saving it as a GraphML file...")
-                        g.save(GRAPHML_FILE)
-                        print("Graph saved as a GraphML file. Converting it to a CSV file...")
-                        # Retry the conversion
+                        # Convert the GraphML file to a CSV file
                         subprocess.run(["python", "input_graphs/graphml2csv.py", "-i", GRAPHML_FILE], check=True)
                         print("Conversion successful.")
-                    except Exception as retry_e:
-                        print(f"Retry failed: {retry_e}")
-                finally:
-                    # Assuming the module and function for CSV to TSV conversion is correct
-                    input_graphs.csv2tsv.csv2tsv(file_name=f"{GRAPH_FILE_PATH}/{GRAPH_FILE_NAME}-edges.csv",
-                                                 directory="")
-
-                    # Release the lock
-                    lock.release()
-                    break
-        except Timeout:
-            print("GraphML file is being converted to a CSV file, waiting for it to finish...")
-            time.sleep(5)
-    else:
-        print("CSV file already exists, skipping conversion.")
-        break
+                    except Exception as e:
+                        print(f"\n\nAn error occurred: {e}")
+                        print("Falling back to graph-tool backend to retry...")
+                        try:
+                            # Retry by first loading the GraphML using graph-tool
+                            g = gt.load_graph(GRAPHML_FILE)
+                            print("Graph loaded by graph-tool. Saving it as a GraphML file...")
+                            g.save(GRAPHML_FILE)
+                            print("Graph saved as a GraphML file. Converting it to a CSV file...")
+                            # Retry the conversion
+                            subprocess.run(["python", "input_graphs/graphml2csv.py", "-i", GRAPHML_FILE], check=True)
+                            print("Conversion successful.")
+                        except Exception as retry_e:
+                            print(f"Retry failed: {retry_e}")
+                    finally:
+                        # Assuming the module and function for CSV to TSV conversion is correct
+                        input_graphs.csv2tsv.csv2tsv(file_name=f"{GRAPH_FILE_PATH}/{GRAPH_FILE_NAME}-edges.csv",
+                                                     directory="")
+
+                        # Release the lock
+                        lock.release()
+                        break
+            except Timeout:
+                print("GraphML file is being converted to a CSV file, waiting for it to finish...")
+                time.sleep(5)
+        else:
+            print("CSV file already exists, skipping conversion.")
+            break
 
 DEBUG = CONFIG["DEBUG"]
 
 # Apply configurations
-CUDF_EDGELIST = cudf.read_csv(
-    CSV_FILE, names=["source", "target"], dtype=["string", "string"], sep="\t"
-)
+if graph_snapshot.ENABLED:
+    # the vertices are named by their graph-tool index, same as the fixed_ CSV names them
+    SNAPSHOT_EDGES = graph_snapshot.load_edges(GRAPHML_FILE)
+    CUDF_EDGELIST = cudf.DataFrame(
+        {"source": SNAPSHOT_EDGES[:, 0], "target": SNAPSHOT_EDGES[:, 1]}
+    )
+else:
+    CUDF_EDGELIST = cudf.read_csv(
+        CSV_FILE, names=["source", "target"], dtype=["string", "string"], sep="\t"
+    )
 
-CUDF_EDGELIST = CUDF_EDGELIST[0:-1]
+    CUDF_EDGELIST = CUDF_EDGELIST[0:-1]
 
 CUGRAPH_GRAPH = cugraph.Graph()
 CUGRAPH_GRAPH.from_cudf_edgelist(CUDF_EDGELIST, source="source", destination="target")
-GRAPH_TOOL_GRAPH = gt.load_graph(GRAPHML_FILE)
+GRAPH_TOOL_GRAPH = graph_snapshot.load_graph_tool_graph(GRAPHML_FILE)
+LAYOUT_MONITOR = (
+    early_abort.LayoutMonitor(GRAPH_TOOL_GRAPH.get_edges(), GRAPH_TOOL_GRAPH.num_vertices())
+    if early_abort.ENABLED
+    else None
+)
 
 
 def debug_print(*args, **kwargs):
@@ -97,8 +126,28 @@ def debug_print(*args, **kwargs):
         print(*args, **kwargs)
 
 
+def timestamped_debug_print(message):
+    debug_print(f"{utils.get_timestamp()}: {message}")
+
+
+def positions_to_pos_list(cuGraph_Graph: cugraph.Graph, positions) -> cudf.DataFrame:
+    """
+    Turn an (n, 2) array indexed by vertex into the pos_list of cugraph.force_atlas2, keyed by the vertex names
+    """
+    names = cuGraph_Graph.nodes().to_pandas()
+    # the vertex name n1234 is the vertex 1234, same as pos2dot
+    vertices = names.apply(lambda x: int(re.sub("[^0-9]", "", str(x)))).to_numpy()
+    return cudf.DataFrame(
+        {
+            "vertex": names.to_numpy(),
+            "x": positions[vertices, 0],
+            "y": positions[vertices, 1],
+        }
+    )
+
+
 def cuGraph_to_pos_df(
-        cuGraph_Graph: cugraph.Graph, param0, param1, param2
+        cuGraph_Graph: cugraph.Graph, param0, param1, param2, positions=None
 ) -> cudf.DataFrame:
     # if param2 < 0.5:
     #     param2 = False
@@ -109,8 +158,15 @@ def cuGraph_to_pos_df(
     if type(param2) is not int:
         param2 = int(param2)
 
+    pos_list = None
+    if positions is not None:
+        pos_list = positions_to_pos_list(cuGraph_Graph, positions)
     position_dff = cugraph.force_atlas2(
-        cuGraph_Graph, scaling_ratio=param0, gravity=param1, max_iter=param2
+        cuGraph_Graph,
+        scaling_ratio=param0,
+        gravity=param1,
+        max_iter=param2,
+        pos_list=pos_list,
     )
     return position_dff.to_pandas()
 
@@ -118,7 +174,7 @@ def cuGraph_to_pos_df(
 def process_params_file(param_file: str) -> bool:
     debug_print(f"{utils.get_timestamp()}: Processing the params file: " + param_file)
     # separate the file name from the extension
-    layout_id = param_file[:-7]
+    layout_id = os.path.basename(param_file)[:-7]
     # read the file
     with open(param_file, "r") as f:
         params = f.readlines()
@@ -139,104 +195,166 @@ def process_params_file(param_file: str) -> bool:
                 debug_print(f"{utils.get_timestamp()}: Content of the file: {params}")
                 return False
 
-        debug_print(f"{utils.get_timestamp()}: params_to_test: {params}")
-        pos_df = cuGraph_to_pos_df(
+        return process_params(layout_id, params)
+
+
+# level -> the cuGraph graph of a coarse level of the multilevel optimization
+LEVEL_CUGRAPH_GRAPHS = {}
+
+
+def get_level_cuGraph_graph(level: int) -> cugraph.Graph:
+    if level not in LEVEL_CUGRAPH_GRAPHS:
+        edges = multilevel.load_level_graph(level).get_edges()[:, :2]
+        graph = cugraph.Graph()
+        graph.from_cudf_edgelist(
+            cudf.DataFrame({"source": edges[:, 0], "target": edges[:, 1]}),
+            source="source",
+            destination="target",
+        )
+        LEVEL_CUGRAPH_GRAPHS[level] = graph
+    return LEVEL_CUGRAPH_GRAPHS[level]
+
+
+def process_level_params(layout_id: str, params: list, level: int) -> bool:
+    # a coarse level of the multilevel optimization is laid out from scratch, see multilevel.py
+    pos_df = cuGraph_to_pos_df(
+        cuGraph_Graph=get_level_cuGraph_graph(level),
+        param0=params[0],
+        param1=params[1],
+        param2=params[2],
+    )
+    layout_writer.submit_layout(
+        pos_df=pos_df,
+        graph_tool_graph=multilevel.load_level_graph(level),
+        layout_id=layout_id,
+        graph_file=multilevel.get_level_graph_file(level),
+    )
+    return True
+
+
+def process_params(layout_id: str, params: list) -> bool:
+    debug_print(f"{utils.get_timestamp()}: params_to_test: {params}")
+    level = multilevel.get_level(params)
+    if level:
+        return process_level_params(layout_id, params, level)
+    start_time = time.time()
+    num_vertices = GRAPH_TOOL_GRAPH.num_vertices()
+    # cuGraph can't return a layout without running, so a checkpoint at max_iter itself is of no use
+    start = iteration_checkpoint.get_start(params, num_vertices, inclusive=False)
+    pos_df, aborted = iteration_checkpoint.run_in_segments(
+        params,
+        start,
+        run=lambda positions, iterations: cuGraph_to_pos_df(
             cuGraph_Graph=CUGRAPH_GRAPH,
             param0=params[0],
             param1=params[1],
-            param2=params[2],
-        )
-        debug_print(
-            f"{utils.get_timestamp()}: Layout is generated, now converting to dot file..."
-        )
-        pos_to_readability_score.pos2dot(
-            pos_df=pos_df,
-            graph_tool_graph=GRAPH_TOOL_GRAPH,
-            output_name=layout_id + ".dot",
-            echo=False,
+            param2=iterations,
+            positions=positions,
+        ),
+        to_positions=lambda pos_df: layout_artifact.pos_df_to_positions(pos_df, num_vertices),
+        check_iterations=early_abort.get_check_iterations(start.start_iter, start.max_iter),
+        check=lambda iteration, positions: LAYOUT_MONITOR.check(positions, layout_id, iteration),
+    )
+    runtime_model.record_timing("layout", layout_id, time.time() - start_time, params)
+    if aborted is not None:
+        # a hopeless layout goes straight back to the optimizer, see early_abort.py
+        pos_to_readability_score.publish_record(layout_id, aborted)
+        return True
+    if warm_start.ENABLED:
+        warm_start.archive(
+            layout_id,
+            params,
+            layout_artifact.pos_df_to_positions(pos_df, num_vertices),
+            start.warm_start_from,
+            start.distance,
+            start.max_iter - start.start_iter,
         )
+    debug_print(
+        f"{utils.get_timestamp()}: Layout is generated, now converting to dot file..."
+    )
+    layout_writer.submit_layout(
+        pos_df=pos_df,
+        graph_tool_graph=GRAPH_TOOL_GRAPH,
+        layout_id=layout_id,
+    )
+    debug_print(f"{utils.get_timestamp()}: Dot file generated: {layout_id + '.dot'}")
+
+    return True
+
+
+def broker_main():
+    client = job_broker.get_client()
+    debug_print(
+        f"{utils.get_timestamp()}: Claiming params from the job broker at {job_broker.BROKER_ADDRESS}"
+    )
+    while True:
+        job = client.claim("params")
+        if job is None:
+            continue
+        layout_id, params = job
         debug_print(
-            f"{utils.get_timestamp()}: Dot file generated: {layout_id + '.dot'}"
+            f"{utils.get_timestamp()}: Processing the params of layout: {layout_id}"
         )
-
-        return True
+        process_params(layout_id, params)
+        # the layout is published, the broker can forget the claim
+        client.ack("params", layout_id)
 
 
 def main():
+    if job_broker.TRANSPORT == "broker":
+        return broker_main()
+
+    own_shards, other_shards = work_shards.get_scan_directories(("params", "batch"))
+    watcher = DirectoryWatcher(
+        endswith=(".params", ".batch"),
+        directories=own_shards,
+        fallback_directories=other_shards,
+    )
+    debug_print(f"{utils.get_timestamp()}: Watching for params files in {watcher.mode} mode")
     while True:
-        params_list = retrieve_file_list(
-            startswith="", not_startswith=".", endswith=".params"
+        params_list = watcher.list_jobs()
+
+        debug_print(
+            f"{utils.get_timestamp()}: Retrieved file list: {params_list} (queue depth: {len(params_list)})"
         )
 
-        debug_print(f"{utils.get_timestamp()}: Retrieved file list: {params_list}")
-
-        # two ways to go into wait: 1. no file in the list, 2. all files in the list are locked
-
-        if params_list:
-            for param_file in sorted(params_list):
-                if not os.path.exists(param_file):
-                    debug_print(
-                        f"{utils.get_timestamp()}: File "
-                        + str(param_file)
-                        + " does not exist, skipping..."
-                    )
-                    time.sleep(1)
-                    continue
-                lock = FileLock(param_file + ".lock")
-                try:
-                    lock.acquire(timeout=0)  # try to lock the file
-                    debug_print(
-                        f"{utils.get_timestamp()}: Trying to open and lock: {param_file}"
-                    )
-                    # Call process_dot_file function here
-                    # process_params_file only returns true if the file is processed successfully
-                    if not process_params_file(param_file):
-                        debug_print(
-                            f"{utils.get_timestamp()}: Failed to process params file: {param_file}"
-                        )
-
-                    debug_print(
-                        f"{utils.get_timestamp()}: Finished processing file: {param_file}"
-                    )
-                    # unlock and remove the dot file workflow starts:
-                    debug_print(
-                        f"{utils.get_timestamp()}: Releasing lock for: {param_file}"
-                    )
-
-                    # Temporarily rename the file to a .dot_processed extension through atomic operation
-                    os.rename(param_file, param_file + ".params_processed")
-
-                    # Now we can safely release the lock
-                    lock.release()
-
-                    # And finally delete the .dot_processed file
-                    os.remove(param_file + ".params_processed")
-                    debug_print(
-                        f"{utils.get_timestamp()}: Removed file: {param_file + '.params_processed'}"
-                    )
-
-                    # Remove the lock file
-                    os.remove(param_file + ".lock")
-
-                except Timeout:
-                    # If the file is locked and cannot be opened immediately, we skip it for this round
-                    debug_print(
-                        f"{utils.get_timestamp()}: File {param_file} is locked, skipping for this file..."
-                    )
-                    time.sleep(1)
-                    continue
-                except FileNotFoundError:
-                    debug_print(
-                        f"{utils.get_timestamp()}: File {param_file} not found, skipping for this file..."
-                    )
-                    time.sleep(1)
-                    continue
-        else:
+        # two ways to go into wait: 1. no file in the list, 2. all files in the list are claimed by other workers
+        # in both cases the worker blocks on the watcher until a new params file lands, instead of sleeping
+        claimed = False
+        for param_file in params_list:
+            # a .batch manifest carries a whole chunk of a population
+            if param_file.endswith(".batch"):
+                if work_queue.claim_and_process(
+                    param_file,
+                    "batch",
+                    lambda batch_file: batch_manifest.process_batch_file(
+                        batch_file, process_params, timestamped_debug_print
+                    ),
+                    timestamped_debug_print,
+                ):
+                    claimed = True
+                continue
+            # process_params_file only returns true if the file is processed successfully
+            if work_queue.claim_and_process(
+                param_file, "params", process_params_file, timestamped_debug_print
+            ):
+                claimed = True
+
+        if not claimed:
+            # an idle worker looks after the jobs of dead workers before waiting
+            if work_queue.maybe_requeue_expired_leases(
+                "params", timestamped_debug_print
+            ) + work_queue.maybe_requeue_expired_leases(
+                "batch", timestamped_debug_print
+            ):
+                continue
+            # and after the shared layouts of this node that no evaluator is left to take, see shared_positions.py
+            if shared_positions.ENABLED and shared_positions.republish_orphans(timestamped_debug_print):
+                continue
             debug_print(
-                f"{utils.get_timestamp()}: No params files found after scanning through the entire list, sleeping for "
-                f"a second..."
+                f"{utils.get_timestamp()}: No params files could be claimed, waiting for new ones..."
             )
-            time.sleep(1)
+            watcher.wait()
 
 
 if __name__ == "__main__":
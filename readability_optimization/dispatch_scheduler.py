@@ -0,0 +1,179 @@
+"""
+This module schedules the evaluations the optimizer dispatches to the layout generators and evaluators.
+
+1. An in-flight window: at most IN_FLIGHT_WINDOW evaluations of the optimizer are queued or running at the same time.
+combined_objective_func takes a slot before writing the params and gives it back once the result is read, and the
+waiting evaluations of a process get the free slots in priority order rather than first come first served. The slots
+are a semaphore shared with the pool processes the optimizer evaluates its populations with (see share_window), so
+that the window holds for all of them together rather than per process.
+2. Explicit priorities: verification runs first, then the older generation, then the longer expected runtime (see
+runtime_model.py), then the earlier submission. The priority is written at the front of the job file names
+(p<priority key>_<uuid>.params, and the .dot etc. files that follow from it), so that the workers, which take the jobs
+of a directory in sorted order, take them in priority order. The results are still published under the plain uuid, see
+get_layout_uuid.
+
+The generation of an evaluation is the number of the population map call it belongs to. PriorityMap wraps the map the DE
+and NSGA2 populations are evaluated with, and passes the generation along to the pool processes or threads.
+With the broker and memory transports the priorities are not used, but the window still applies.
+"""
+
+import contextlib
+import functools
+import heapq
+import itertools
+import json
+import multiprocessing
+import threading
+import time
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for dispatch_scheduler
+CONFIG = CONFIG["dispatch_scheduler"]
+
+ENABLED = CONFIG["ENABLED"]
+IN_FLIGHT_WINDOW = CONFIG["IN_FLIGHT_WINDOW"]
+
+# the generation and priority class of the evaluations of the current thread
+_LOCAL = threading.local()
+_GENERATIONS = itertools.count(1)
+
+
+def get_generation() -> int:
+    return getattr(_LOCAL, "generation", 0)
+
+
+def set_generation(generation: int):
+    _LOCAL.generation = generation
+
+
+@contextlib.contextmanager
+def verification():
+    """
+    Run the evaluations of the with block, in the current thread, ahead of the optimization ones.
+    """
+    previous = getattr(_LOCAL, "verification", False)
+    _LOCAL.verification = True
+    try:
+        yield
+    finally:
+        _LOCAL.verification = previous
+
+
+# upper bound of the runtime part of the priority key, in milliseconds
+MAX_EXPECTED_RUNTIME = 10**10 - 1
+
+
+def make_priority(expected_runtime: float = None) -> str:
+    """
+    Return the priority key of an evaluation submitted now by the current thread. A smaller key goes first, and the
+    keys sort the same as strings and as numbers. Within a generation, the longest expected runtime goes first.
+    """
+    priority_class = 0 if getattr(_LOCAL, "verification", False) else 1
+    runtime = 0 if expected_runtime is None else int(expected_runtime * 1000)
+    runtime = MAX_EXPECTED_RUNTIME - min(max(runtime, 0), MAX_EXPECTED_RUNTIME)
+    return (
+        f"{priority_class}{get_generation():08d}{runtime:010d}{int(time.time() * 1000):014d}"
+    )
+
+
+def make_job_name(uuid: str, priority: str = None) -> str:
+    if priority is None:
+        return uuid
+    return "p" + priority + "_" + uuid
+
+
+def get_layout_uuid(job_name: str) -> str:
+    # a uuid has no underscore, and never starts with a p
+    if job_name.startswith("p") and "_" in job_name:
+        return job_name.split("_", 1)[1]
+    return job_name
+
+
+class InFlightWindow:
+    """
+    Counting semaphore, shared across processes, whose free slots go to the waiting thread of this process with the
+    smallest priority key.
+    """
+
+    def __init__(self, size: int = IN_FLIGHT_WINDOW):
+        self.size = size
+        self.slots = multiprocessing.BoundedSemaphore(size) if size > 0 else None
+        self.waiting = []
+        self.condition = threading.Condition()
+
+    def acquire(self, priority: str):
+        if self.size <= 0:
+            return
+        entry = (priority, threading.get_ident())
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            self.condition.wait_for(lambda: self.waiting[0] == entry)
+        # only the first waiter of this process competes for a slot with the other processes
+        self.slots.acquire()
+        with self.condition:
+            # another thread may have become the head meanwhile, so remove this one's own entry rather than the head
+            self.waiting.remove(entry)
+            heapq.heapify(self.waiting)
+            self.condition.notify_all()
+
+    def release(self):
+        if self.size <= 0:
+            return
+        self.slots.release()
+
+
+WINDOW = InFlightWindow()
+
+
+def share_window(slots):
+    """
+    Initializer of the pool processes of the optimizer: take the slots of its window, so that the window holds for the
+    optimizer and its pool processes together, whatever the start method of the pool.
+    """
+    WINDOW.slots = slots
+
+
+@contextlib.contextmanager
+def dispatch(expected_runtime: float = None):
+    """
+    Hold a slot of the in-flight window for the duration of the with block, and yield the priority key of the
+    evaluation, or None if the scheduler is disabled.
+    """
+    if not ENABLED:
+        yield None
+        return
+    priority = make_priority(expected_runtime)
+    WINDOW.acquire(priority)
+    try:
+        yield priority
+    finally:
+        WINDOW.release()
+
+
+def _call_in_generation(generation: int, func, x):
+    set_generation(generation)
+    return func(x)
+
+
+def _starcall_in_generation(generation: int, func, args):
+    set_generation(generation)
+    return func(*args)
+
+
+class PriorityMap:
+    """
+    Map-like callable numbering the populations it evaluates with the given map function, e.g. Pool.map, BatchMap or
+    the built-in map. With starmap set, it wraps a starmap function instead, as StarmapParallelization of pymoo uses.
+    """
+
+    def __init__(self, map_function=map, starmap: bool = False):
+        self.map_function = map_function
+        self.starmap = starmap
+
+    def __call__(self, func, iterable):
+        generation = next(_GENERATIONS)
+        call = _starcall_in_generation if self.starmap else _call_in_generation
+        return list(self.map_function(functools.partial(call, generation, func), iterable))
@@ -2,15 +2,26 @@
 This script hosts the main layout evaluator of the GraphOptima
 The main function of the script will constantly scan for new .dot files produced by the cuGraph_to_pos_df.py.
 Once detected, the script will lock the file and process the .dot file. The layout evaluator will then generate the
-layout and save it as a readability score txt file that can be processed by the optimizer.py
+layout and save its readability metrics as a binary result record (see evaluation_record.py) that can be processed by the
+optimizer.py
 """
 
 import time
-from filelock import FileLock, Timeout
+import work_queue
 import subprocess
 import tempfile
 import utils
+import job_broker
+import work_shards
+import layout_artifact
+import layout_staging
+import shared_positions
+import dispatch_scheduler
+import runtime_model
+import evaluation_record
+import numpy as np
 from utils import *
+from work_watcher import DirectoryWatcher
 
 # Load configuration from JSON file
 with open("config.json") as f:
@@ -28,11 +39,15 @@ def debug_print(*args, **kwargs):
         print(*args, **kwargs)
 
 
-def process_dot_file(dot_file_name: str, echo: bool = False):
-    print(f"{utils.get_timestamp()}: Processing file in subprocess: " + dot_file_name)
+def timestamped_debug_print(message):
+    debug_print(f"{utils.get_timestamp()}: {message}")
 
-    uuid = dot_file_name[:-4]
 
+def run_glam(dot_file_name: str, echo: bool = False) -> evaluation_record.EvaluationRecord:
+    """
+    Run GLAM on a DOT file and parse its output into an evaluation record, once, on the evaluator.
+    """
+    start_time = time.time()
     r = subprocess.getoutput(
         GLAM_PATH
         + " "
@@ -41,92 +56,218 @@ def process_dot_file(dot_file_name: str, echo: bool = False):
         + "crosslessness edge_length_cv min_angle shape_gabriel shape_delaunay"
     )
 
+    seconds = time.time() - start_time
+
+    # the DOT file is always named after its layout id
+    runtime_model.record_timing("glam", os.path.basename(dot_file_name)[:-4], seconds)
+
     if echo:
         print(f"{utils.get_timestamp()}: echoing result directly from GLAM: " + r)
+    record = evaluation_record.parse_glam_output(r, seconds)
+    if record.status != evaluation_record.STATUS_OK:
+        print(f"{utils.get_timestamp()}: can't parse the GLAM output of {dot_file_name}: " + r)
+    return record
+
+
+def process_dot_file(dot_file_name: str, echo: bool = False):
+    print(f"{utils.get_timestamp()}: Processing file in subprocess: " + dot_file_name)
+
+    uuid = os.path.basename(dot_file_name)[:-4]
+
+    r = run_glam(dot_file_name, echo=echo)
+
+    publish_result(uuid, r)
+
+
+def process_layout_file(layout_file_name: str, echo: bool = False):
+    print(f"{utils.get_timestamp()}: Processing layout in subprocess: " + layout_file_name)
+
+    uuid = os.path.basename(layout_file_name)[: -len(".layout")]
+
+    # GLAM only reads DOT files, so the binary layout is converted into a private temporary one for the run
+    with tempfile.TemporaryDirectory() as directory:
+        dot_file_name = os.path.join(directory, uuid + ".dot")
+        layout_artifact.layout_to_dot(layout_file_name, dot_file_name)
+        r = run_glam(dot_file_name, echo=echo)
+
+    publish_result(uuid, r)
+    layout_artifact.remove_layout(layout_file_name)
+
+
+def process_staged_file(staged_file_name: str, echo: bool = False):
+    record = layout_staging.read_record(staged_file_name)
+    uuid = record["layout_id"]
+    print(f"{utils.get_timestamp()}: Processing staged layout from {record['host']}: " + uuid)
+
+    try:
+        with tempfile.TemporaryDirectory(dir=layout_staging.get_scratch_directory()) as directory:
+            try:
+                # a layout from another node is downloaded to the scratch directory of this one
+                path = layout_staging.fetch(record, directory)
+            except OSError as e:
+                # the generator of the layout is gone or unreachable, the layout gets the penalty
+                work_queue.publish_penalty_result(
+                    uuid, "staged layout can't be fetched: " + str(e)
+                )
+                return
+            if record["format"] == "binary":
+                dot_file_name = os.path.join(directory, uuid + ".dot")
+                layout_artifact.positions_to_dot(
+                    np.load(path, mmap_mode="r"),
+                    np.load(record["topology"], mmap_mode="r"),
+                    dot_file_name,
+                )
+            else:
+                dot_file_name = path
+            r = run_glam(dot_file_name, echo=echo)
+
+        publish_result(uuid, r)
+    finally:
+        # the staged layout is of no use once it is evaluated or penalized, whichever way it went
+        layout_staging.release(record)
+
+
+def process_shared_layout(record_file_name: str, echo: bool = False):
+    record = shared_positions.read_record(record_file_name)
+    uuid = record["layout_id"]
+    print(f"{utils.get_timestamp()}: Processing layout from shared memory: " + uuid)
+
+    with tempfile.TemporaryDirectory() as directory:
+        dot_file_name = os.path.join(directory, uuid + ".dot")
+        try:
+            with shared_positions.attach(record) as positions:
+                layout_artifact.positions_to_dot(
+                    positions, np.load(record["topology"], mmap_mode="r"), dot_file_name
+                )
+        except FileNotFoundError:
+            # the segment is gone, e.g. the node was cleaned up, the layout can't be evaluated anymore
+            work_queue.publish_penalty_result(uuid, "shared memory segment not found")
+            return
+        r = run_glam(dot_file_name, echo=echo)
+
+    publish_result(uuid, r)
+
+
+def publish_result(uuid: str, r: evaluation_record.EvaluationRecord):
+    # the optimizer waits on the plain uuid, without the priority of the job name
+    uuid = dispatch_scheduler.get_layout_uuid(uuid)
 
     # Create and write to a temporary file first
-    destination_path = os.getcwd() + "/readability_score_results/"
+    destination_path = work_shards.get_result_directory(
+        uuid, os.getcwd() + "/readability_score_results/"
+    )
     with tempfile.NamedTemporaryFile(
-        "w", delete=False, dir=destination_path
+        "wb", delete=False, dir=destination_path
     ) as tmpfile:
-        tmpfile.write(r)
+        tmpfile.write(evaluation_record.pack(r))
 
     # Rename the temporary file to the final destination (atomic operation)
-    os.rename(tmpfile.name, os.path.join(destination_path, uuid + ".txt"))
+    os.rename(
+        tmpfile.name,
+        os.path.join(destination_path, uuid + evaluation_record.RESULT_EXTENSION),
+    )
+
+
+def broker_main():
+    client = job_broker.get_client()
+    debug_print(
+        f"{utils.get_timestamp()}: Claiming layouts from the job broker at {job_broker.BROKER_ADDRESS}"
+    )
+    while True:
+        job = client.claim("layouts")
+        if job is None:
+            continue
+        uuid, dot_content = job
+        print(f"{utils.get_timestamp()}: Processing layout from the broker: " + uuid)
+        # GLAM only reads files, so the layout is written to a private temporary folder for the run
+        with tempfile.TemporaryDirectory() as directory:
+            dot_file_name = os.path.join(directory, uuid + ".dot")
+            with open(dot_file_name, "w") as f:
+                f.write(dot_content)
+            r = run_glam(dot_file_name, echo=True)
+        client.put_result(uuid, evaluation_record.to_payload(r))
+        client.ack("layouts", uuid)
 
 
 def main():
+    if job_broker.TRANSPORT == "broker":
+        return broker_main()
+
+    own_shards, other_shards = work_shards.get_scan_directories(
+        ("dot", "layout", "staged")
+    )
+    if shared_positions.ENABLED:
+        # the layouts of the generators of this node come through shared memory, their records are watched as well
+        shared_positions.register_evaluator()
+        own_shards = [shared_positions.get_handoff_directory()] + own_shards
+    watcher = DirectoryWatcher(
+        not_startswith="to_check_",
+        endswith=(".dot", ".layout", ".staged", ".shm"),
+        directories=own_shards,
+        fallback_directories=other_shards,
+    )
+    debug_print(f"{utils.get_timestamp()}: Watching for dot files in {watcher.mode} mode")
     while True:
-        dot_list = retrieve_file_list(
-            startswith="", not_startswith="to_check_", endswith=".dot"
+        dot_list = watcher.list_jobs()
+        debug_print(
+            f"{utils.get_timestamp()}: Retrieved file list: {dot_list} (queue depth: {len(dot_list)})"
         )
-        debug_print(f"{utils.get_timestamp()}: Retrieved file list: {dot_list}")
-        if dot_list:
-            for dot_file in sorted(dot_list):
-                if not os.path.exists(dot_file):
-                    print(
-                        f"{utils.get_timestamp()}: File "
-                        + str(dot_file)
-                        + " does not exist, skipping..."
-                    )
-                    time.sleep(1)
-                    continue
-                else:
-                    lock = FileLock(dot_file + ".lock")
-                    try:
-                        lock.acquire(timeout=0)  # try to lock the file
-                        debug_print(
-                            f"{utils.get_timestamp()}: Trying to open and lock: {dot_file}"
-                        )
-                        debug_print(
-                            f"{utils.get_timestamp()}: Processing file: {dot_file}"
-                        )
-
-                        # Call process_dot_file function here
-                        process_dot_file(dot_file, echo=True)
-
-                        debug_print(
-                            f"{utils.get_timestamp()}: Finished processing file: {dot_file}"
-                        )
-                        # unlock and remove the dot file
-                        debug_print(
-                            f"{utils.get_timestamp()}: Releasing lock for: {dot_file}"
-                        )
-
-                        # Temporarily rename the file to a .dot_processed extension
-                        os.rename(dot_file, dot_file + ".dot_processed")
-
-                        # Now we can safely release the lock
-                        lock.release()
-
-                        # And finally delete the .dot_processed file
-                        os.remove(dot_file + ".dot_processed")
-                        debug_print(
-                            f"{utils.get_timestamp()}: Removed file: {dot_file + '.dot_processed'}"
-                        )
-
-                        # Remove the lock file
-                        os.remove(dot_file + ".lock")
-
-                    except Timeout:
-                        # If the file is locked and cannot be opened immediately, we skip it for this round
-                        debug_print(
-                            f"{utils.get_timestamp()}: File {dot_file} is locked, skipping for this file..."
-                        )
-                        time.sleep(1)
-                        continue
-                    except FileNotFoundError:
-                        debug_print(
-                            f"{utils.get_timestamp()}: File {dot_file} not found, skipping for this file..."
-                        )
-                        time.sleep(1)
-                        continue
-        else:
+        # only wait for new files when nothing could be claimed in this pass
+        claimed = False
+        for dot_file in dot_list:
+            if dot_file.endswith(".shm"):
+                # node-local records are claimed in place, they can't be renamed into the shared inboxes
+                if shared_positions.claim_and_process(
+                    dot_file,
+                    lambda claimed_file: process_shared_layout(claimed_file, echo=True),
+                    timestamped_debug_print,
+                ):
+                    claimed = True
+                continue
+            if dot_file.endswith(".staged"):
+                if work_queue.claim_and_process(
+                    dot_file,
+                    "staged",
+                    lambda claimed_file: process_staged_file(claimed_file, echo=True),
+                    timestamped_debug_print,
+                ):
+                    claimed = True
+                continue
+            if dot_file.endswith(".layout"):
+                if work_queue.claim_and_process(
+                    dot_file,
+                    "layout",
+                    lambda claimed_file: process_layout_file(claimed_file, echo=True),
+                    timestamped_debug_print,
+                ):
+                    claimed = True
+                continue
+            if work_queue.claim_and_process(
+                dot_file,
+                "dot",
+                lambda claimed_file: process_dot_file(claimed_file, echo=True),
+                timestamped_debug_print,
+            ):
+                claimed = True
+
+        if not claimed:
+            # an idle worker looks after the jobs of dead workers before waiting
+            if work_queue.maybe_requeue_expired_leases(
+                "dot", timestamped_debug_print
+            ) + work_queue.maybe_requeue_expired_leases(
+                "layout", timestamped_debug_print
+            ) + work_queue.maybe_requeue_expired_leases(
+                "staged", timestamped_debug_print
+            ):
+                continue
+            if shared_positions.ENABLED and shared_positions.requeue_dead_claims(
+                timestamped_debug_print
+            ):
+                continue
             debug_print(
-                f"{utils.get_timestamp()}: No dot files found after scanning through the entire list, sleeping for a "
-                f"second..."
+                f"{utils.get_timestamp()}: No dot files could be claimed, waiting for new ones..."
             )
-            time.sleep(1)
+            watcher.wait()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+"""
+This module stops the generation of a layout that is already hopeless, before it costs the rest of its iterations and
+a full GLAM run. At the CHECK_FRACTIONS of its max_iter, a layout generator takes a snapshot of the positions and
+computes cheap proxies of the GLAM metrics on it:
+1. crosslessness and num_edge_crossings, estimated from a fixed random sample of SAMPLE_SIZE pairs of edges without a
+common vertex, which are the pairs that can cross at all
+2. edge_length_cv and normalized_cv, computed exactly over all the edges
+The metrics that have no cheap proxy (min_angle and the shape metrics) are taken at their best values, and the
+crossings at the low end of their sampling error, which leans the projected readability towards the optimistic side.
+It is an estimate, not a bound: the edge length CV of a snapshot isn't that of the finished layout, which MARGIN leaves
+room for. If the projection is worse than MARGIN above the incumbent, i.e. the best readability the optimizer has seen
+so far, the layout is aborted, and its result is published right away with status STATUS_ABORTED: the projected
+metrics, or the penalty with ABORT_RESULT "penalty". The optimizer records the abort in the metadata of the row, and
+never substitutes an aborted row for other params, see select_evaluated.
+
+The optimizer publishes its incumbent along with the weights it was computed with to INCUMBENT_FILE, named after the
+graph, and the generators read it from there. The optimizer removes it when a run starts, so that an incumbent of an
+earlier run never aborts the layouts of a new one, and the processes of its DE pool replace it under a file lock, only
+with a better readability. Only the single-objective optimization (DE) has an incumbent.
+"""
+
+import json
+import math
+import os
+import threading
+import numpy as np
+from filelock import FileLock
+import evaluation_record
+import reward
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
+
+# Extract configurations for early_abort
+CONFIG = CONFIG["early_abort"]
+
+ENABLED = CONFIG["ENABLED"]
+CHECK_FRACTIONS = CONFIG["CHECK_FRACTIONS"]
+SAMPLE_SIZE = CONFIG["SAMPLE_SIZE"]
+MARGIN = CONFIG["MARGIN"]
+ABORT_RESULT = CONFIG["ABORT_RESULT"]
+INCUMBENT_FILE = CONFIG["INCUMBENT_FILE"]
+
+# the crossing fraction is taken this many standard errors below its estimate
+CONFIDENCE_Z = 2.0
+
+
+def get_weights() -> list:
+    # the weights minimized_total_readability_reward uses
+    return [
+        reward.CROSSLESSNESS_WEIGHT,
+        reward.NORMALIZED_CV_WEIGHT,
+        reward.MIN_ANGLE_WEIGHT,
+    ]
+
+
+def projected_readability(metrics: list, weights: list) -> float:
+    crosslessness_weight, normalized_cv_weight, min_angle_weight = weights
+    return (
+        crosslessness_weight * (1 - metrics[0])
+        + normalized_cv_weight * metrics[3]
+        + min_angle_weight * (1 - metrics[4])
+    )
+
+
+def get_incumbent_file(graph_file: str = GRAPHML_FILE) -> str:
+    # one incumbent per graph, e.g. early_abort_incumbent_<graph name>.json
+    graph_name = os.path.splitext(os.path.basename(graph_file))[0]
+    stem, extension = os.path.splitext(INCUMBENT_FILE)
+    return f"{stem}_{graph_name}{extension}"
+
+
+def read_incumbent(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# the threads of a process take turns, the file lock only works between processes
+_INCUMBENT_LOCK = threading.Lock()
+
+
+def update_incumbent(readability: float):
+    """
+    Publish the readability of an evaluated layout as the incumbent if it is the best one under the current weights.
+    """
+    if readability is None or not math.isfinite(readability):
+        return
+    weights = get_weights()
+    path = get_incumbent_file()
+    with _INCUMBENT_LOCK, FileLock(path + ".lock"):
+        # compared against the file, which another process of the pool may have improved meanwhile
+        incumbent = read_incumbent(path)
+        if (
+            incumbent is not None
+            and incumbent.get("weights") == weights
+            and incumbent["readability"] <= readability
+        ):
+            return
+        # hidden name first, then an atomic rename, so that a generator never reads half of it
+        directory = os.path.dirname(os.path.abspath(path))
+        temporary_file = os.path.join(
+            directory, "." + os.path.basename(path) + "." + str(os.getpid())
+        )
+        with open(temporary_file, "w") as f:
+            json.dump({"readability": float(readability), "weights": weights}, f)
+        os.rename(temporary_file, path)
+
+
+def remove_incumbent():
+    """
+    Forget the incumbent of an earlier run, called when the optimization starts.
+    """
+    path = get_incumbent_file()
+    with FileLock(path + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class IncumbentReader:
+    """
+    The incumbent of the optimizer as the generators see it, read again whenever the file changes.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or get_incumbent_file()
+        self.mtime = None
+        self.incumbent = None
+
+    def get(self) -> dict:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            # removed when the optimizer started a new run
+            self.mtime = None
+            self.incumbent = None
+            return None
+        if mtime != self.mtime:
+            try:
+                with open(self.path) as f:
+                    self.incumbent = json.load(f)
+                self.mtime = mtime
+            except (OSError, ValueError):
+                return self.incumbent
+        return self.incumbent
+
+
+def select_evaluated(database_object):
+    """
+    Return the rows of the database whose metrics GLAM measured, i.e. without the aborted layouts.
+    """
+    if database_object.empty:
+        return database_object
+    aborted = database_object["metadata"].apply(
+        lambda metadata: isinstance(metadata, dict) and bool(metadata.get("early_abort"))
+    )
+    return database_object[~aborted]
+
+
+def get_check_iterations(start_iter: int, max_iter: int) -> list:
+    """
+    Return the iterations a layout running from start_iter to max_iter is checked at, if any.
+    """
+    if not ENABLED:
+        return []
+    iterations = {int(round(fraction * max_iter)) for fraction in CHECK_FRACTIONS}
+    return sorted(iteration for iteration in iterations if start_iter < iteration < max_iter)
+
+
+class LayoutMonitor:
+    """
+    Projects the GLAM metrics of the snapshots of layouts of one graph, given as an (E, 2) edge array.
+    """
+
+    def __init__(self, edges: np.ndarray, num_vertices: int, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+        edges = np.asarray(edges, dtype=np.int64)[:, :2]
+        self.edges = edges[edges[:, 0] != edges[:, 1]]
+        num_edges = self.edges.shape[0]
+        degrees = np.bincount(self.edges.ravel(), minlength=num_vertices)
+        # the pairs of edges that don't share a vertex, the only ones that can cross
+        self.max_crossings = num_edges * (num_edges - 1) / 2 - float(
+            (degrees * (degrees - 1) / 2).sum()
+        )
+        self.incumbent = IncumbentReader()
+
+        rng = np.random.default_rng(seed)
+        # twice the sample size, since the pairs with a common vertex are dropped
+        first = rng.integers(0, max(num_edges, 1), size=sample_size * 2 if num_edges else 0)
+        second = rng.integers(0, max(num_edges, 1), size=first.shape[0])
+        a, b = self.edges[first], self.edges[second]
+        disjoint = (
+            (a[:, 0] != b[:, 0])
+            & (a[:, 0] != b[:, 1])
+            & (a[:, 1] != b[:, 0])
+            & (a[:, 1] != b[:, 1])
+        )
+        self.pairs = (first[disjoint][:sample_size], second[disjoint][:sample_size])
+
+    def project(self, positions: np.ndarray) -> list:
+        """
+        Return the 7 projected GLAM metrics of the (n, 2) positions of a snapshot.
+        """
+        source = positions[self.edges[:, 0]]
+        target = positions[self.edges[:, 1]]
+        lengths = np.hypot(*(target - source).T)
+        num_edges = lengths.shape[0]
+        mean = lengths.mean() if num_edges else 0.0
+        edge_length_cv = float(lengths.std() / mean) if mean > 0 else 0.0
+        # the CV of m lengths is at most sqrt(m - 1)
+        normalized_cv = edge_length_cv / math.sqrt(num_edges - 1) if num_edges > 1 else 0.0
+
+        crossing_fraction = 0.0
+        sample_size = self.pairs[0].shape[0]
+        if sample_size and self.max_crossings > 0:
+            p1, p2 = source[self.pairs[0]], target[self.pairs[0]]
+            q1, q2 = source[self.pairs[1]], target[self.pairs[1]]
+            crossing = (_orientation(p1, p2, q1) * _orientation(p1, p2, q2) < 0) & (
+                _orientation(q1, q2, p1) * _orientation(q1, q2, p2) < 0
+            )
+            fraction = crossing.mean()
+            error = math.sqrt(fraction * (1 - fraction) / sample_size)
+            crossing_fraction = max(0.0, fraction - CONFIDENCE_Z * error)
+
+        return [
+            1 - crossing_fraction,
+            crossing_fraction * self.max_crossings,
+            edge_length_cv,
+            normalized_cv,
+            1.0,
+            float("nan"),
+            float("nan"),
+        ]
+
+    def check(self, positions: np.ndarray, layout_id: str, iteration: int) -> evaluation_record.EvaluationRecord:
+        """
+        Return the record to publish instead of the layout if the snapshot can't beat the incumbent, or None.
+        """
+        incumbent = self.incumbent.get()
+        if incumbent is None:
+            return None
+        metrics = self.project(positions)
+        readability = projected_readability(metrics, incumbent["weights"])
+        if readability <= incumbent["readability"] * (1 + MARGIN):
+            return None
+        print(
+            f"Aborting layout {layout_id} at iteration {iteration}: projected readability {readability} can't beat "
+            f"the incumbent {incumbent['readability']}"
+        )
+        if ABORT_RESULT == "penalty":
+            metrics = evaluation_record.penalty_record().metrics
+        return evaluation_record.EvaluationRecord(
+            evaluation_record.STATUS_ABORTED, tuple(metrics), 0.0
+        )
+
+
+def _orientation(a, b, c) -> np.ndarray:
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
@@ -0,0 +1,125 @@
+"""
+This module defines the result a layout evaluator hands back to the optimizer: a fixed-width binary record with the 7
+GLAM readability metrics as float64, a status code and the runtime of GLAM. The evaluator parses the GLAM output once,
+strictly, and the optimizer only unpacks the record, without any regex or Decimal work.
+
+Record layout (little endian, RECORD.size bytes):
+    magic (4 bytes) | version (uint16) | status (uint16) | 7 metrics (float64) | glam seconds (float64)
+The metrics are in the order of METRIC_NAMES, which is the order of the GLAM results everywhere else.
+"""
+
+import base64
+import collections
+import re
+import struct
+import reward
+
+MAGIC = b"GOER"
+VERSION = 1
+
+# the result file of a layout, readability_score_results/[<shard>/]<uuid>.result
+RESULT_EXTENSION = ".result"
+
+METRIC_NAMES = (
+    "crosslessness",
+    "num_edge_crossings",
+    "edge_length_cv",
+    "normalized_cv",
+    "min_angle",
+    "shape_delaunay",
+    "shape_gabriel",
+)
+
+# the layout is evaluated
+STATUS_OK = 0
+# the layout can't be evaluated, the optimizer gives it the maximum penalty
+STATUS_PENALTY = 1
+# GLAM failed (e.g. a core dump) or its output can't be parsed, the optimizer evaluates the params again
+STATUS_FAILED = 2
+# the generator stopped the layout as it can't beat the incumbent, the metrics are projected from a snapshot, see
+# early_abort.py
+STATUS_ABORTED = 3
+
+RECORD = struct.Struct("<4sHH" + "d" * len(METRIC_NAMES) + "d")
+
+EvaluationRecord = collections.namedtuple(
+    "EvaluationRecord", ["status", "metrics", "seconds"]
+)
+
+# a number as GLAM prints it, including the exponent of the scientific notation
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+# the first words of the GLAM output are a header, not metrics
+_HEADER_TOKENS = 5
+
+
+def parse_glam_output(output: str, seconds: float = 0.0) -> EvaluationRecord:
+    """
+    Parse the stdout of GLAM into a record. Anything but exactly one value per metric is a failed run.
+    """
+    values = []
+    for token in output.split()[_HEADER_TOKENS:]:
+        values.extend(float(number) for number in _NUMBER.findall(token))
+    if len(values) != len(METRIC_NAMES):
+        return failed_record(seconds)
+    return EvaluationRecord(STATUS_OK, tuple(values), seconds)
+
+
+def penalty_record(seconds: float = 0.0) -> EvaluationRecord:
+    return EvaluationRecord(
+        STATUS_PENALTY, tuple(float(metric) for metric in reward.PENALTY_GLAM_RESULTS), seconds
+    )
+
+
+def failed_record(seconds: float = 0.0) -> EvaluationRecord:
+    return EvaluationRecord(STATUS_FAILED, (float("nan"),) * len(METRIC_NAMES), seconds)
+
+
+def pack(record: EvaluationRecord) -> bytes:
+    return RECORD.pack(MAGIC, VERSION, record.status, *record.metrics, record.seconds)
+
+
+def unpack(data: bytes) -> EvaluationRecord:
+    """
+    Raise ValueError if the data isn't a complete record of this version, e.g. a result file of an older GraphOptima.
+    """
+    if len(data) != RECORD.size:
+        raise ValueError(f"Evaluation record of {len(data)} bytes, expected {RECORD.size}")
+    fields = RECORD.unpack(data)
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        raise ValueError(f"Not a version {VERSION} evaluation record")
+    return EvaluationRecord(fields[2], fields[3:-1], fields[-1])
+
+
+def to_payload(record: EvaluationRecord) -> str:
+    # the job broker speaks JSON, so the record travels as base64 text there
+    return base64.b64encode(pack(record)).decode()
+
+
+def from_payload(payload) -> EvaluationRecord:
+    """
+    Return the record of a result payload of the job broker (base64 text) or of the in-memory pipeline (bytes).
+    """
+    if isinstance(payload, str):
+        payload = base64.b64decode(payload)
+    return unpack(payload)
+
+
+def to_glam_results(record: EvaluationRecord) -> list:
+    """
+    Return the list of GLAM results combined_objective_func works with: the metrics, the penalty metrics for a layout
+    that can't be evaluated, or an empty list for a failed run, which makes the optimizer evaluate the params again.
+    """
+    if record.status == STATUS_FAILED:
+        return []
+    return list(record.metrics)
+
+
+def write_result_file(path: str, record: EvaluationRecord):
+    with open(path, "wb") as f:
+        f.write(pack(record))
+
+
+def read_result_file(path: str) -> EvaluationRecord:
+    with open(path, "rb") as f:
+        return unpack(f.read())
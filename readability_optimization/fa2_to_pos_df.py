@@ -0,0 +1,294 @@
+"""
+This script hosts the CPU layout generator of the GraphOptima. It runs the same ForceAtlas2 as cuGraph_to_pos_df.py,
+with the same params, but with the Numba implementation of force_atlas2.py, so that the CPU-only nodes of the cluster
+can generate layouts too. The graph is read once, and its CSR adjacency is reused by every layout.
+The param sets of a .batch manifest are simulated together, MAX_BATCH_LAYOUTS at a time, see process_params_batch.
+"""
+
+import graph_tool.all as gt
+import force_atlas2
+import pos_to_readability_score
+import work_queue
+import work_shards
+import batch_manifest
+import runtime_model
+import warm_start
+import iteration_checkpoint
+import early_abort
+import layout_writer
+import shared_positions
+import multilevel
+import graph_snapshot
+from utils import *
+from work_watcher import DirectoryWatcher
+import os
+import time
+import json
+import job_broker
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for fa2_to_pos_df
+CONFIG = CONFIG["layout_generator"]
+
+# Extract individual configurations
+GRAPHML_FILE = CONFIG["GRAPHML_FILE"]
+DEBUG = CONFIG["DEBUG"]
+MAX_BATCH_LAYOUTS = force_atlas2.MAX_BATCH_LAYOUTS
+
+GRAPH_TOOL_GRAPH = graph_snapshot.load_graph_tool_graph(GRAPHML_FILE)
+INDPTR, INDICES = force_atlas2.edges_to_csr(
+    GRAPH_TOOL_GRAPH.get_edges(), GRAPH_TOOL_GRAPH.num_vertices()
+)
+LAYOUT_MONITOR = (
+    early_abort.LayoutMonitor(GRAPH_TOOL_GRAPH.get_edges(), GRAPH_TOOL_GRAPH.num_vertices())
+    if early_abort.ENABLED
+    else None
+)
+
+
+def debug_print(*args, **kwargs):
+    global DEBUG
+    if DEBUG:
+        print(*args, **kwargs)
+
+
+def positions_to_pos_df(positions: np.ndarray) -> pd.DataFrame:
+    # the vertices of the graph-tool graph are numbered from 0, like the rows of the positions
+    return pd.DataFrame(
+        {
+            "vertex": np.arange(positions.shape[0]),
+            "x": positions[:, 0],
+            "y": positions[:, 1],
+        }
+    )
+
+
+def fa2_to_pos_df(param0, param1, param2, positions: np.ndarray = None) -> pd.DataFrame:
+    if type(param2) is not int:
+        param2 = int(param2)
+
+    positions = force_atlas2.force_atlas2(
+        INDPTR,
+        INDICES,
+        scaling_ratio=param0,
+        gravity=param1,
+        max_iter=param2,
+        positions=positions,
+    )
+    return positions_to_pos_df(positions)
+
+
+# level -> the (INDPTR, INDICES) of a coarse level of the multilevel optimization
+LEVEL_CSR = {}
+
+
+def process_level_params(layout_id: str, params: list, level: int):
+    # a coarse level of the multilevel optimization is laid out from scratch, see multilevel.py
+    graph = multilevel.load_level_graph(level)
+    if level not in LEVEL_CSR:
+        LEVEL_CSR[level] = force_atlas2.edges_to_csr(graph.get_edges(), graph.num_vertices())
+    indptr, indices = LEVEL_CSR[level]
+    positions = force_atlas2.force_atlas2(
+        indptr,
+        indices,
+        scaling_ratio=params[0],
+        gravity=params[1],
+        max_iter=int(params[2]),
+    )
+    layout_writer.submit_layout(
+        pos_df=positions_to_pos_df(positions),
+        graph_tool_graph=graph,
+        layout_id=layout_id,
+        graph_file=multilevel.get_level_graph_file(level),
+    )
+
+
+def process_params_file(param_file: str):
+    debug_print("Processing the params file: " + param_file)
+    layout_id = os.path.basename(param_file)[:-7]
+    with open(param_file, "r") as f:
+        params = f.readlines()
+        if not params:
+            debug_print(f"The file {param_file} is empty or could not be read.")
+        else:
+            try:
+                params = [float(x) for x in params[0].split(",")]
+            except Exception as e:
+                debug_print(f"An unexpected error occurred: {e}")
+                debug_print(f"Content of the file: {params}")
+                return False
+
+        return process_params(layout_id, params)
+
+
+def process_params(layout_id: str, params: list):
+    debug_print(f"params_to_test: {params}")
+    # a batch of one comes out the same as a single layout, see force_atlas2_batch
+    process_params_batch([layout_id], [params])
+
+    return True
+
+
+def process_params_batch(layout_ids: list, params_list: list, published: set = None):
+    """
+    Generate the layouts of several param sets with one batched simulation per MAX_BATCH_LAYOUTS of them, then
+    publish each of them. The id of every published layout is added to published, see batch_manifest.process_batch_file.
+    """
+    if published is None:
+        published = set()
+    # the params of the coarse levels run on their own graphs
+    input_params = [
+        (layout_id, params)
+        for layout_id, params in zip(layout_ids, params_list)
+        if not multilevel.get_level(params)
+    ]
+    for layout_id, params in zip(layout_ids, params_list):
+        if multilevel.get_level(params):
+            process_level_params(layout_id, params, multilevel.get_level(params))
+            published.add(layout_id)
+    layout_ids = [layout_id for layout_id, _ in input_params]
+    params_list = [params for _, params in input_params]
+
+    num_vertices = GRAPH_TOOL_GRAPH.num_vertices()
+    for start in range(0, len(layout_ids), MAX_BATCH_LAYOUTS):
+        chunk_ids = layout_ids[start : start + MAX_BATCH_LAYOUTS]
+        chunk_params = params_list[start : start + MAX_BATCH_LAYOUTS]
+        debug_print(f"Simulating {len(chunk_ids)} layouts together: {chunk_params}")
+        start_time = time.time()
+        # every layout resumes from its checkpoint, or else from a warm start or random positions
+        starts = [
+            iteration_checkpoint.get_start(params, num_vertices) for params in chunk_params
+        ]
+        initial_positions = np.stack(
+            [
+                force_atlas2.random_positions(num_vertices)
+                if layout_start.positions is None
+                else layout_start.positions
+                for layout_start in starts
+            ]
+        )
+        milestones = [iteration_checkpoint.get_milestones(layout_start) for layout_start in starts]
+        check_iterations = [
+            early_abort.get_check_iterations(layout_start.start_iter, layout_start.max_iter)
+            for layout_start in starts
+        ]
+        aborted = [None] * len(chunk_ids)
+
+        def checkpoint(k, iteration, positions, state):
+            if iteration in milestones[k]:
+                iteration_checkpoint.save(
+                    chunk_params[k][0], chunk_params[k][1], iteration, positions, state
+                )
+            if iteration in check_iterations[k]:
+                # a hopeless layout stops here, the others of the batch go on
+                aborted[k] = LAYOUT_MONITOR.check(positions, chunk_ids[k], iteration)
+                return aborted[k] is not None
+            return False
+
+        positions = force_atlas2.force_atlas2_batch(
+            INDPTR,
+            INDICES,
+            scaling_ratios=[params[0] for params in chunk_params],
+            gravities=[params[1] for params in chunk_params],
+            max_iters=[layout_start.max_iter for layout_start in starts],
+            positions=initial_positions,
+            start_iters=[layout_start.start_iter for layout_start in starts],
+            states=[layout_start.state for layout_start in starts],
+            milestones=sorted(set().union(*milestones, *check_iterations)),
+            checkpoint=checkpoint,
+        )
+        # the runtime model learns the cost of a layout, which is its share of the batch here
+        seconds = (time.time() - start_time) / len(chunk_ids)
+        for layout_id, params, layout_positions, layout_start, abort_record in zip(
+            chunk_ids, chunk_params, positions, starts, aborted
+        ):
+            runtime_model.record_timing("layout", layout_id, seconds, params)
+            if abort_record is not None:
+                # a hopeless layout goes straight back to the optimizer, see early_abort.py
+                pos_to_readability_score.publish_record(layout_id, abort_record)
+                published.add(layout_id)
+                continue
+            warm_start.archive(
+                layout_id,
+                params,
+                layout_positions,
+                layout_start.warm_start_from,
+                layout_start.distance,
+                layout_start.max_iter - layout_start.start_iter,
+            )
+            layout_writer.submit_layout(
+                pos_df=positions_to_pos_df(layout_positions),
+                graph_tool_graph=GRAPH_TOOL_GRAPH,
+                layout_id=layout_id,
+            )
+            published.add(layout_id)
+
+
+def broker_main():
+    client = job_broker.get_client()
+    debug_print("Claiming params from the job broker at " + job_broker.BROKER_ADDRESS)
+    while True:
+        job = client.claim("params")
+        if job is None:
+            continue
+        layout_id, params = job
+        debug_print("Processing the params of layout: " + layout_id)
+        process_params(layout_id, params)
+        client.ack("params", layout_id)
+
+
+def main():
+    if job_broker.TRANSPORT == "broker":
+        return broker_main()
+
+    own_shards, other_shards = work_shards.get_scan_directories(("params", "batch"))
+    watcher = DirectoryWatcher(
+        endswith=(".params", ".batch"),
+        directories=own_shards,
+        fallback_directories=other_shards,
+    )
+    debug_print(f"Watching for params files in {watcher.mode} mode")
+    while True:
+        params_list = watcher.list_jobs()
+        debug_print(
+            f"Retrieved file list: {params_list} (queue depth: {len(params_list)})"
+        )
+
+        # only wait for new files when nothing could be claimed in this pass, so that a free worker never sleeps
+        # while there is still work it can take
+        claimed = False
+        for param_file in params_list:
+            if param_file.endswith(".batch"):
+                if work_queue.claim_and_process(
+                    param_file,
+                    "batch",
+                    lambda batch_file: batch_manifest.process_batch_file(
+                        batch_file, process_params, debug_print, process_params_batch
+                    ),
+                    debug_print,
+                ):
+                    claimed = True
+                continue
+            if work_queue.claim_and_process(
+                param_file, "params", process_params_file, debug_print
+            ):
+                claimed = True
+
+        if not claimed:
+            # an idle worker looks after the jobs of dead workers before waiting
+            if work_queue.maybe_requeue_expired_leases(
+                "params", debug_print
+            ) + work_queue.maybe_requeue_expired_leases("batch", debug_print):
+                continue
+            # and after the shared layouts of this node that no evaluator is left to take, see shared_positions.py
+            if shared_positions.ENABLED and shared_positions.republish_orphans(debug_print):
+                continue
+            debug_print("No params files could be claimed, waiting for new ones...")
+            watcher.wait()
+
+
+if __name__ == "__main__":
+    main()
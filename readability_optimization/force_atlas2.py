@@ -0,0 +1,537 @@
+"""
+This module is a CPU implementation of ForceAtlas2 (Jacomy et al., 2014) compiled with Numba, for the layout generators
+that run on nodes without a GPU. It follows the model of cugraph.force_atlas2, with the same scaling_ratio, gravity and
+max_iter parameters and the same defaults:
+1. repulsion kr * m_i * m_j / d between every pair of vertices, approximated with a Barnes-Hut quadtree
+2. linear attraction along the edges, divided by the mass of the vertex with outbound attraction distribution
+3. gravity towards the origin, kg * m_i, or kg * m_i * d in strong gravity mode
+4. the adaptive global and local speeds of ForceAtlas2, which keep the vertices from swinging
+where the mass of a vertex is its degree plus one.
+
+The forces of every vertex are computed in parallel over NUM_THREADS threads. The graph is given as a symmetric CSR
+adjacency (see edges_to_csr), which is built once per graph and reused by every layout. The compiled functions release
+the GIL, so that the layout writer thread (see layout_writer.py) publishes the previous layout in the meantime.
+
+force_atlas2_batch simulates the K param sets of a batch manifest together, as a [K, n, 2] position array over the one
+adjacency: every iteration traverses the adjacency once for all K layouts, and the Barnes-Hut pass of all K quadtrees is
+a single parallel loop. force_atlas2 is the batch of one.
+A run can be checkpointed at given iterations and resumed from a checkpoint later, see force_atlas2_batch.
+"""
+
+import json
+import os
+import numba
+import numpy as np
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for force_atlas2
+CONFIG = CONFIG["force_atlas2"]
+
+NUM_THREADS = CONFIG["NUM_THREADS"]
+BARNES_HUT_THETA = CONFIG["BARNES_HUT_THETA"]
+OUTBOUND_ATTRACTION_DISTRIBUTION = CONFIG["OUTBOUND_ATTRACTION_DISTRIBUTION"]
+STRONG_GRAVITY_MODE = CONFIG["STRONG_GRAVITY_MODE"]
+JITTER_TOLERANCE = CONFIG["JITTER_TOLERANCE"]
+SEED = CONFIG["SEED"]
+MAX_BATCH_LAYOUTS = CONFIG["MAX_BATCH_LAYOUTS"]
+
+# a Slurm job only owns the cores it asked for, even if Numba sees every core of the node
+if NUM_THREADS is None and os.environ.get("SLURM_CPUS_PER_TASK"):
+    NUM_THREADS = int(os.environ["SLURM_CPUS_PER_TASK"])
+
+# a leaf at this depth keeps all its vertices, so that vertices at the same position don't split the tree forever
+MAX_TREE_DEPTH = 48
+# the vertices of a parallel chunk share one traversal stack
+CHUNK_SIZE = 256
+
+
+def edges_to_csr(edges: np.ndarray, num_vertices: int) -> tuple:
+    """
+    Return the symmetric CSR adjacency (indptr, indices) of an undirected (E, 2) edge array, without self-loops.
+    A parallel edge counts once per copy, as in cuGraph.
+    """
+    edges = np.asarray(edges, dtype=np.int64)[:, :2]
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_vertices), out=indptr[1:])
+    return indptr, targets[order]
+
+
+def random_positions(num_vertices: int, seed: int = SEED) -> np.ndarray:
+    # cuGraph also starts from uniformly random positions
+    return np.random.default_rng(seed).uniform(-100.0, 100.0, size=(num_vertices, 2))
+
+
+@numba.njit(cache=True, nogil=True)
+def _grow(capacity, children, internal, body_head, center_x, center_y, half, depth):
+    new_capacity = capacity * 2
+    new_children = np.full((new_capacity, 4), -1, dtype=np.int64)
+    new_children[:capacity] = children
+    new_internal = np.zeros(new_capacity, dtype=np.bool_)
+    new_internal[:capacity] = internal
+    new_body_head = np.full(new_capacity, -1, dtype=np.int64)
+    new_body_head[:capacity] = body_head
+    new_center_x = np.empty(new_capacity)
+    new_center_x[:capacity] = center_x
+    new_center_y = np.empty(new_capacity)
+    new_center_y[:capacity] = center_y
+    new_half = np.empty(new_capacity)
+    new_half[:capacity] = half
+    new_depth = np.empty(new_capacity, dtype=np.int64)
+    new_depth[:capacity] = depth
+    return (
+        new_capacity,
+        new_children,
+        new_internal,
+        new_body_head,
+        new_center_x,
+        new_center_y,
+        new_half,
+        new_depth,
+    )
+
+
+@numba.njit(cache=True, nogil=True)
+def _build_quadtree(x, y, mass):
+    """
+    Build the Barnes-Hut quadtree of the positions. A child always has a larger index than its parent. A leaf holds a
+    linked list of vertices (body_head, next_body), which only has more than one vertex at MAX_TREE_DEPTH.
+    Return the children, internal, body_head, next_body, half size, mass and center of mass of every node.
+    """
+    n = x.shape[0]
+    capacity = 4 * n + 16
+    children = np.full((capacity, 4), -1, dtype=np.int64)
+    internal = np.zeros(capacity, dtype=np.bool_)
+    body_head = np.full(capacity, -1, dtype=np.int64)
+    next_body = np.full(n, -1, dtype=np.int64)
+    center_x = np.empty(capacity)
+    center_y = np.empty(capacity)
+    half = np.empty(capacity)
+    depth = np.empty(capacity, dtype=np.int64)
+
+    min_x, max_x, min_y, max_y = x.min(), x.max(), y.min(), y.max()
+    center_x[0] = (min_x + max_x) / 2
+    center_y[0] = (min_y + max_y) / 2
+    half[0] = max(max_x - min_x, max_y - min_y) / 2 + 1e-9
+    depth[0] = 0
+    count = 1
+
+    for b in range(n):
+        node = 0
+        while True:
+            if count + 2 > capacity:
+                capacity, children, internal, body_head, center_x, center_y, half, depth = _grow(
+                    capacity, children, internal, body_head, center_x, center_y, half, depth
+                )
+            if not internal[node]:
+                if body_head[node] == -1:
+                    body_head[node] = b
+                    break
+                if depth[node] >= MAX_TREE_DEPTH:
+                    next_body[b] = body_head[node]
+                    body_head[node] = b
+                    break
+                # split the leaf: its single vertex moves down one level
+                old = body_head[node]
+                body_head[node] = -1
+                internal[node] = True
+                quadrant = (x[old] >= center_x[node]) + 2 * (y[old] >= center_y[node])
+                child = count
+                count += 1
+                children[node, quadrant] = child
+                half[child] = half[node] / 2
+                center_x[child] = center_x[node] + (half[child] if x[old] >= center_x[node] else -half[child])
+                center_y[child] = center_y[node] + (half[child] if y[old] >= center_y[node] else -half[child])
+                depth[child] = depth[node] + 1
+                body_head[child] = old
+            quadrant = (x[b] >= center_x[node]) + 2 * (y[b] >= center_y[node])
+            child = children[node, quadrant]
+            if child == -1:
+                child = count
+                count += 1
+                children[node, quadrant] = child
+                half[child] = half[node] / 2
+                center_x[child] = center_x[node] + (half[child] if x[b] >= center_x[node] else -half[child])
+                center_y[child] = center_y[node] + (half[child] if y[b] >= center_y[node] else -half[child])
+                depth[child] = depth[node] + 1
+                body_head[child] = b
+                break
+            node = child
+
+    # the children come after their parent, so one backward pass aggregates the masses bottom-up
+    node_mass = np.zeros(count)
+    mass_x = np.zeros(count)
+    mass_y = np.zeros(count)
+    for node in range(count - 1, -1, -1):
+        if internal[node]:
+            for quadrant in range(4):
+                child = children[node, quadrant]
+                if child != -1:
+                    node_mass[node] += node_mass[child]
+                    mass_x[node] += mass_x[child]
+                    mass_y[node] += mass_y[child]
+        else:
+            b = body_head[node]
+            while b != -1:
+                node_mass[node] += mass[b]
+                mass_x[node] += mass[b] * x[b]
+                mass_y[node] += mass[b] * y[b]
+                b = next_body[b]
+    com_x = mass_x / node_mass
+    com_y = mass_y / node_mass
+    return (
+        children[:count],
+        internal[:count],
+        body_head[:count],
+        next_body,
+        half[:count],
+        node_mass,
+        com_x,
+        com_y,
+    )
+
+
+@numba.njit(cache=True, nogil=True)
+def _adapt_speed(
+    n, swinging, traction, speed, speed_efficiency, jitter_tolerance
+):
+    # the global speed of ForceAtlas2, with the constants of Gephi and cuGraph
+    estimated_jitter_tolerance = 0.05 * np.sqrt(n)
+    min_jitter_tolerance = np.sqrt(estimated_jitter_tolerance)
+    max_jitter_tolerance = 10.0
+    jt = jitter_tolerance * max(
+        min_jitter_tolerance,
+        min(max_jitter_tolerance, estimated_jitter_tolerance * traction / (n * n)),
+    )
+    min_speed_efficiency = 0.05
+    if traction > 0 and swinging / traction > 2.0:
+        if speed_efficiency > min_speed_efficiency:
+            speed_efficiency *= 0.5
+        jt = max(jt, jitter_tolerance)
+    if swinging == 0:
+        target_speed = np.inf
+    else:
+        target_speed = jt * speed_efficiency * traction / swinging
+    if swinging > jt * traction:
+        if speed_efficiency > min_speed_efficiency:
+            speed_efficiency *= 0.7
+    elif speed < 1000:
+        speed_efficiency *= 1.3
+    max_rise = 0.5
+    speed = speed + min(target_speed - speed, max_rise * speed)
+    return speed, speed_efficiency
+
+
+@numba.njit(parallel=True, cache=True, nogil=True)
+def _repulsion_and_gravity(
+    x,
+    y,
+    mass,
+    slots,
+    roots,
+    children,
+    internal,
+    body_head,
+    next_body,
+    half,
+    node_mass,
+    com_x,
+    com_y,
+    scaling_ratio,
+    gravity,
+    strong_gravity,
+    theta,
+    fx,
+    fy,
+):
+    """
+    Set the repulsion and gravity of every vertex of the layouts in slots, each with its own quadtree of the forest.
+    The (layout, chunk of vertices) pairs are spread over the threads, so that small graphs keep them all busy too.
+    x and y are layout-major here, as the tree walk of one vertex reads the positions of a single layout.
+    """
+    n = x.shape[1]
+    num_chunks = (n + CHUNK_SIZE - 1) // CHUNK_SIZE
+    for task in numba.prange(slots.shape[0] * num_chunks):
+        slot = task // num_chunks
+        k = slots[slot]
+        stack = np.empty(4 * MAX_TREE_DEPTH + 8, dtype=np.int64)
+        for i in range((task % num_chunks) * CHUNK_SIZE, min((task % num_chunks + 1) * CHUNK_SIZE, n)):
+            force_x = 0.0
+            force_y = 0.0
+
+            # repulsion, Barnes-Hut approximated
+            top = 1
+            stack[0] = roots[slot]
+            while top > 0:
+                top -= 1
+                node = stack[top]
+                if internal[node]:
+                    dx = x[k, i] - com_x[node]
+                    dy = y[k, i] - com_y[node]
+                    distance_squared = dx * dx + dy * dy
+                    width = 2 * half[node]
+                    if width * width < theta * theta * distance_squared:
+                        factor = scaling_ratio[k] * mass[i] * node_mass[node] / distance_squared
+                        force_x += dx * factor
+                        force_y += dy * factor
+                    else:
+                        for quadrant in range(4):
+                            if children[node, quadrant] != -1:
+                                stack[top] = children[node, quadrant]
+                                top += 1
+                else:
+                    b = body_head[node]
+                    while b != -1:
+                        if b != i:
+                            dx = x[k, i] - x[k, b]
+                            dy = y[k, i] - y[k, b]
+                            distance_squared = dx * dx + dy * dy
+                            if distance_squared > 0:
+                                factor = scaling_ratio[k] * mass[i] * mass[b] / distance_squared
+                                force_x += dx * factor
+                                force_y += dy * factor
+                        b = next_body[slot * n + b]
+
+            # gravity towards the origin
+            distance = np.sqrt(x[k, i] * x[k, i] + y[k, i] * y[k, i])
+            if distance > 0:
+                if strong_gravity:
+                    factor = scaling_ratio[k] * gravity[k] * mass[i]
+                else:
+                    factor = gravity[k] * mass[i] / distance
+                force_x -= x[k, i] * factor
+                force_y -= y[k, i] * factor
+
+            fx[i, k] = force_x
+            fy[i, k] = force_y
+
+
+@numba.njit(parallel=True, cache=True, nogil=True)
+def _attraction(
+    x, y, mass, indptr, indices, coefficient, outbound_attraction_distribution, active, fx, fy
+):
+    """
+    Add the linear attraction along the edges. The adjacency is symmetric, so every vertex sums its own, and it is
+    traversed once for all the layouts: the positions of a vertex in every layout sit next to each other.
+    """
+    n, num_layouts = x.shape
+    for i in numba.prange(n):
+        factor = coefficient
+        if outbound_attraction_distribution:
+            factor /= mass[i]
+        for e in range(indptr[i], indptr[i + 1]):
+            j = indices[e]
+            for k in range(num_layouts):
+                if active[k]:
+                    fx[i, k] -= factor * (x[i, k] - x[j, k])
+                    fy[i, k] -= factor * (y[i, k] - y[j, k])
+
+
+@numba.njit(cache=True, nogil=True)
+def _swinging_and_traction(mass, fx, fy, old_fx, old_fy, active):
+    # summed in vertex order for every layout, so a layout comes out the same in a batch of any size
+    n, num_layouts = fx.shape
+    swinging = np.zeros(num_layouts)
+    traction = np.zeros(num_layouts)
+    for i in range(n):
+        for k in range(num_layouts):
+            if active[k]:
+                swinging[k] += mass[i] * np.sqrt((old_fx[i, k] - fx[i, k]) ** 2 + (old_fy[i, k] - fy[i, k]) ** 2)
+                traction[k] += mass[i] * np.sqrt((old_fx[i, k] + fx[i, k]) ** 2 + (old_fy[i, k] + fy[i, k]) ** 2) / 2
+    return swinging, traction
+
+
+@numba.njit(parallel=True, cache=True, nogil=True)
+def _move(x, y, mass, fx, fy, old_fx, old_fy, speed, active):
+    n, num_layouts = x.shape
+    for i in numba.prange(n):
+        for k in range(num_layouts):
+            if active[k]:
+                swinging = mass[i] * np.sqrt((old_fx[i, k] - fx[i, k]) ** 2 + (old_fy[i, k] - fy[i, k]) ** 2)
+                factor = speed[k] / (1.0 + np.sqrt(speed[k] * swinging))
+                x[i, k] += fx[i, k] * factor
+                y[i, k] += fy[i, k] * factor
+
+
+def _build_forest(x, y, mass, slots) -> tuple:
+    """
+    Build the quadtree of every layout in slots, and concatenate them into one forest with the root of each.
+    """
+    n = x.shape[0]
+    trees = [
+        _build_quadtree(np.ascontiguousarray(x[:, k]), np.ascontiguousarray(y[:, k]), mass)
+        for k in slots
+    ]
+    sizes = np.array([tree[0].shape[0] for tree in trees], dtype=np.int64)
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    # the child indices of every tree are shifted by the offset of its root, -1 stays -1
+    children = np.concatenate(
+        [np.where(tree[0] == -1, -1, tree[0] + root) for tree, root in zip(trees, roots)]
+    )
+    internal, body_head, half, node_mass, com_x, com_y = (
+        np.concatenate([tree[field] for tree in trees]) for field in (1, 2, 4, 5, 6, 7)
+    )
+    next_body = np.concatenate([tree[3] for tree in trees]) if trees else np.empty(0, dtype=np.int64)
+    return roots, children, internal, body_head, next_body, half, node_mass, com_x, com_y
+
+
+def force_atlas2_batch(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    scaling_ratios,
+    gravities,
+    max_iters,
+    positions: np.ndarray = None,
+    seed: int = SEED,
+    start_iters=None,
+    states: list = None,
+    milestones=(),
+    checkpoint=None,
+) -> np.ndarray:
+    """
+    Run ForceAtlas2 for K param sets at once on the graph of the CSR adjacency, from the given [K, n, 2] positions or
+    from random ones, and return the [K, n, 2] float64 positions. Layout k runs max_iters[k] iterations; the adjacency
+    is traversed once per iteration for all of them, and their forces are computed by the same parallel loops.
+
+    A layout can resume a run: its positions are those after start_iters[k] iterations, and states[k] is the rest of
+    the state at that point (see get_state), so that it only runs the remaining iterations and comes out exactly as
+    the uninterrupted run. Whenever a layout completes a number of iterations in milestones,
+    checkpoint(k, iteration, positions, state) is called with its (n, 2) positions and state, and a true return value
+    stops the layout there.
+    """
+    if NUM_THREADS:
+        # set here rather than at import, so that no thread is started before a fork (see generator_host.py), and
+        # Numba keeps the setting per calling thread anyway
+        numba.set_num_threads(min(NUM_THREADS, numba.config.NUMBA_NUM_THREADS))
+    scaling_ratios = np.asarray(scaling_ratios, dtype=np.float64)
+    gravities = np.asarray(gravities, dtype=np.float64)
+    max_iters = np.asarray(max_iters, dtype=np.int64)
+    num_layouts = scaling_ratios.shape[0]
+    start_iters = (
+        np.zeros(num_layouts, dtype=np.int64)
+        if start_iters is None
+        else np.asarray(start_iters, dtype=np.int64)
+    )
+    n = indptr.shape[0] - 1
+    if n == 0 or num_layouts == 0:
+        return np.empty((num_layouts, n, 2))
+    if positions is None:
+        positions = np.stack([random_positions(n, seed) for _ in range(num_layouts)])
+    # vertex-major, so that the layouts of a vertex are contiguous for the adjacency traversal
+    x = np.ascontiguousarray(positions[:, :, 0].T, dtype=np.float64)
+    y = np.ascontiguousarray(positions[:, :, 1].T, dtype=np.float64)
+    mass = (np.diff(indptr) + 1).astype(np.float64)
+    # with outbound attraction distribution, the attraction is scaled back up by the mean mass, as in Gephi
+    attraction_coefficient = mass.mean() if OUTBOUND_ATTRACTION_DISTRIBUTION else 1.0
+    milestones = set(milestones) if checkpoint is not None else set()
+
+    fx = np.zeros((n, num_layouts))
+    fy = np.zeros((n, num_layouts))
+    old_fx = np.zeros((n, num_layouts))
+    old_fy = np.zeros((n, num_layouts))
+    speed = np.ones(num_layouts)
+    speed_efficiency = np.ones(num_layouts)
+    for k, state in enumerate(states or []):
+        if state is not None:
+            # the forces of the last iteration run are the old forces of the next one
+            fx[:, k] = state["forces"][:, 0]
+            fy[:, k] = state["forces"][:, 1]
+            speed[k] = state["speed"]
+            speed_efficiency[k] = state["speed_efficiency"]
+    remaining_iters = max_iters - start_iters
+    for iteration in range(int(max(remaining_iters.max(), 0))):
+        active = iteration < remaining_iters
+        slots = np.flatnonzero(active)
+        fx, old_fx = old_fx, fx
+        fy, old_fy = old_fy, fy
+        _repulsion_and_gravity(
+            np.ascontiguousarray(x.T),
+            np.ascontiguousarray(y.T),
+            mass,
+            slots,
+            *_build_forest(x, y, mass, slots),
+            scaling_ratios,
+            gravities,
+            STRONG_GRAVITY_MODE,
+            BARNES_HUT_THETA,
+            fx,
+            fy,
+        )
+        _attraction(
+            x,
+            y,
+            mass,
+            indptr,
+            indices,
+            attraction_coefficient,
+            OUTBOUND_ATTRACTION_DISTRIBUTION,
+            active,
+            fx,
+            fy,
+        )
+        swinging, traction = _swinging_and_traction(mass, fx, fy, old_fx, old_fy, active)
+        for k in slots:
+            speed[k], speed_efficiency[k] = _adapt_speed(
+                n, swinging[k], traction[k], speed[k], speed_efficiency[k], JITTER_TOLERANCE
+            )
+        _move(x, y, mass, fx, fy, old_fx, old_fy, speed, active)
+        for k in slots:
+            if start_iters[k] + iteration + 1 in milestones and checkpoint(
+                k,
+                int(start_iters[k] + iteration + 1),
+                np.stack([x[:, k], y[:, k]], axis=1),
+                get_state(fx, fy, speed, speed_efficiency, k),
+            ):
+                remaining_iters[k] = iteration + 1
+    return np.stack([x.T, y.T], axis=2)
+
+
+def get_state(fx, fy, speed, speed_efficiency, k: int) -> dict:
+    """
+    Return what, besides its positions, a layout needs to resume the run: the forces of its last iteration, which
+    the swinging of the next one is measured against, and its global speed.
+    """
+    return {
+        "forces": np.stack([fx[:, k], fy[:, k]], axis=1),
+        "speed": float(speed[k]),
+        "speed_efficiency": float(speed_efficiency[k]),
+    }
+
+
+def force_atlas2(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    scaling_ratio: float = 2.0,
+    gravity: float = 1.0,
+    max_iter: int = 500,
+    positions: np.ndarray = None,
+    seed: int = SEED,
+    start_iter: int = 0,
+    state: dict = None,
+    milestones=(),
+    checkpoint=None,
+) -> np.ndarray:
+    """
+    Run max_iter iterations of ForceAtlas2 on the graph of the CSR adjacency, from the given (n, 2) positions or from
+    random ones, and return the (n, 2) float64 positions. The run resumes at start_iter with the given state, and
+    calls checkpoint(iteration, positions, state) at the milestones, as in force_atlas2_batch.
+    """
+    return force_atlas2_batch(
+        indptr,
+        indices,
+        [scaling_ratio],
+        [gravity],
+        [max_iter],
+        positions=None if positions is None else positions[None],
+        seed=seed,
+        start_iters=[start_iter],
+        states=[state],
+        milestones=milestones,
+        checkpoint=None if checkpoint is None else (lambda _, *args: checkpoint(*args)),
+    )[0]
@@ -0,0 +1,128 @@
+"""
+This script hosts several layout generator workers on one node, with one copy of the graph between them. Every
+gt_to_pos_df.py or fa2_to_pos_df.py process loads the GraphML and builds its own adjacency, so running one process per
+layout multiplies the memory and the startup time of the graph by the number of processes.
+
+The host imports the generator of optimizer.LAYOUT_GENERATOR once, which loads the graph, and then forks NUM_WORKERS
+workers that each run the main loop of the generator. The workers share the pages of the graph copy-on-write, and only
+the pages they write to are copied. Every worker runs its layouts on THREADS_PER_WORKER threads (the OpenMP threads of
+sfdp, or the Numba threads of ForceAtlas2), so that NUM_WORKERS * THREADS_PER_WORKER fills the cores of the allocation.
+A worker that dies is replaced after RESTART_DELAY seconds, its claimed jobs go back to the queue with the leases of
+work_queue.py.
+
+cuGraph isn't supported: the CUDA context of the parent doesn't survive a fork, and a GPU already runs one layout at a
+time.
+"""
+
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+import memory_pipeline
+import utils
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+LAYOUT_GENERATOR = CONFIG["optimizer"]["LAYOUT_GENERATOR"]
+
+# Extract configurations for generator_host
+CONFIG = CONFIG["generator_host"]
+
+ENABLED = CONFIG["ENABLED"]
+NUM_WORKERS = CONFIG["NUM_WORKERS"]
+THREADS_PER_WORKER = CONFIG["THREADS_PER_WORKER"]
+RESTART_DELAY = CONFIG["RESTART_DELAY"]
+
+
+def get_num_workers() -> int:
+    if NUM_WORKERS:
+        return NUM_WORKERS
+    # one worker per THREADS_PER_WORKER cores of the allocation
+    if os.environ.get("SLURM_CPUS_PER_TASK"):
+        num_cpus = int(os.environ["SLURM_CPUS_PER_TASK"])
+    else:
+        num_cpus = len(os.sched_getaffinity(0))
+    return max(1, num_cpus // (THREADS_PER_WORKER or 1))
+
+
+def set_num_threads(num_threads: int):
+    if LAYOUT_GENERATOR == "graph-tool":
+        import graph_tool.all as gt
+
+        gt.openmp_set_num_threads(num_threads)
+    elif LAYOUT_GENERATOR == "numba":
+        import force_atlas2
+
+        force_atlas2.NUM_THREADS = num_threads
+
+
+def start_worker(layout_generator) -> int:
+    # the buffered output of the host would be printed by every worker otherwise
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if THREADS_PER_WORKER:
+            set_num_threads(THREADS_PER_WORKER)
+        layout_generator.main()
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        # never return into the loop of the host
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def main():
+    if LAYOUT_GENERATOR == "cuGraph":
+        raise ValueError(
+            "The generator host can't fork cuGraph workers, run cuGraph_to_pos_df.py once per GPU instead"
+        )
+    # loads the graph, once for all the workers
+    layout_generator = memory_pipeline.import_layout_generator()
+
+    num_workers = get_num_workers()
+    print(
+        f"{utils.get_timestamp()}: Hosting {num_workers} {LAYOUT_GENERATOR} workers with "
+        f"{THREADS_PER_WORKER or 'the default number of'} threads each"
+    )
+    workers = {start_worker(layout_generator) for _ in range(num_workers)}
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while True:
+        pid, status = os.wait()
+        if pid not in workers:
+            continue
+        workers.remove(pid)
+        print(
+            f"{utils.get_timestamp()}: Worker {pid} exited with status {status}, "
+            f"starting a new one in {RESTART_DELAY} seconds"
+        )
+        time.sleep(RESTART_DELAY)
+        workers.add(start_worker(layout_generator))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+This module compiles the GraphML of the input graph once into a binary snapshot, so that the workers start in seconds
+instead of parsing the GraphML (and, for cuGraph, converting it to a CSV/TSV edge list) every time Slurm starts one.
+
+The snapshot of a graph lives under SNAPSHOT_DIRECTORY/<graph name>/:
+1. graph.gt: the graph in the binary format of graph-tool, which loads much faster than GraphML
+2. edges.npy: the int64 edge array of shape (number of edges, 2), by graph-tool vertex index, which can be memory-mapped
+3. vertex_ids.npy: the GraphML id of every vertex, by graph-tool vertex index
+4. snapshot.json: the number of vertices and edges, and the size and mtime of the GraphML it was compiled from. It is
+written last, so a snapshot without it is incomplete, and a snapshot of an older GraphML is compiled again.
+The first worker to need the snapshot compiles it under a file lock, the others wait for it.
+
+Run as a script to compile the snapshot ahead of the optimization: python graph_snapshot.py [-i <graphml file>]
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import graph_tool.all as gt
+from filelock import FileLock
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
+
+# Extract configurations for graph_snapshot
+CONFIG = CONFIG["graph_snapshot"]
+
+ENABLED = CONFIG["ENABLED"]
+SNAPSHOT_DIRECTORY = CONFIG["SNAPSHOT_DIRECTORY"]
+
+VERSION = 1
+
+
+def get_snapshot_directory(graph_file: str = GRAPHML_FILE) -> str:
+    graph_name = os.path.splitext(os.path.basename(graph_file))[0]
+    return os.path.join(SNAPSHOT_DIRECTORY, graph_name)
+
+
+def get_source_stamp(graph_file: str) -> dict:
+    stat = os.stat(graph_file)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def read_metadata(graph_file: str = GRAPHML_FILE) -> dict:
+    """
+    Return the metadata of the snapshot of the graph, or None if it is missing, incomplete or out of date.
+    """
+    try:
+        with open(os.path.join(get_snapshot_directory(graph_file), "snapshot.json")) as f:
+            metadata = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if metadata.get("version") != VERSION:
+        return None
+    stamp = get_source_stamp(graph_file)
+    if any(metadata.get(key) != value for key, value in stamp.items()):
+        return None
+    return metadata
+
+
+def compile_snapshot(graph_file: str = GRAPHML_FILE) -> dict:
+    directory = get_snapshot_directory(graph_file)
+    os.makedirs(directory, exist_ok=True)
+    print(f"Compiling the snapshot of {graph_file} to {directory} ...")
+    stamp = get_source_stamp(graph_file)
+    graph = gt.load_graph(graph_file)
+
+    graph.save(os.path.join(directory, "graph.gt"))
+    edges = graph.get_edges()[:, :2].astype(np.int64)
+    np.save(os.path.join(directory, "edges.npy"), edges)
+    if "_graphml_vertex_id" in graph.vertex_properties:
+        vertex_ids = np.array(list(graph.vertex_properties["_graphml_vertex_id"]), dtype=str)
+    else:
+        # graph-tool only keeps the GraphML ids that aren't its own vertex indices
+        vertex_ids = np.array(["n" + str(i) for i in range(graph.num_vertices())])
+    np.save(os.path.join(directory, "vertex_ids.npy"), vertex_ids)
+
+    metadata = dict(
+        stamp,
+        version=VERSION,
+        source=graph_file,
+        num_vertices=graph.num_vertices(),
+        num_edges=graph.num_edges(),
+        directed=graph.is_directed(),
+    )
+    # hidden name first, then an atomic rename, so that the snapshot is complete once snapshot.json is there
+    temporary_file = os.path.join(directory, ".snapshot.json." + str(os.getpid()))
+    with open(temporary_file, "w") as f:
+        json.dump(metadata, f)
+    os.rename(temporary_file, os.path.join(directory, "snapshot.json"))
+    print(f"Snapshot of {graph_file} compiled")
+    return metadata
+
+
+def ensure_snapshot(graph_file: str = GRAPHML_FILE) -> str:
+    """
+    Compile the snapshot of the graph unless an up-to-date one exists, and return its directory.
+    """
+    directory = get_snapshot_directory(graph_file)
+    if read_metadata(graph_file) is not None:
+        return directory
+    os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+    with FileLock(directory + ".lock"):
+        # another worker may have compiled it while this one waited for the lock
+        if read_metadata(graph_file) is None:
+            compile_snapshot(graph_file)
+    return directory
+
+
+def load_graph_tool_graph(graph_file: str = GRAPHML_FILE):
+    """
+    Return the graph-tool graph of the graph, from its snapshot if enabled, otherwise from the GraphML.
+    """
+    if not ENABLED:
+        return gt.load_graph(graph_file)
+    return gt.load_graph(os.path.join(ensure_snapshot(graph_file), "graph.gt"))
+
+
+def load_edges(graph_file: str = GRAPHML_FILE) -> np.ndarray:
+    """
+    Return the memory-mapped (number of edges, 2) edge array of the snapshot of the graph.
+    """
+    return np.load(os.path.join(ensure_snapshot(graph_file), "edges.npy"), mmap_mode="r")
+
+
+def load_vertex_ids(graph_file: str = GRAPHML_FILE) -> np.ndarray:
+    return np.load(os.path.join(ensure_snapshot(graph_file), "vertex_ids.npy"), mmap_mode="r")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the binary snapshot of a GraphML graph")
+    parser.add_argument("-i", "--input", default=GRAPHML_FILE, help="GraphML file of the graph")
+    args = parser.parse_args()
+    ensure_snapshot(args.input)
@@ -1,10 +1,23 @@
 import graph_tool.all as gt
 import pos_to_readability_score
-from filelock import FileLock, Timeout
+import work_queue
+import work_shards
+import batch_manifest
+import runtime_model
+import warm_start
+import iteration_checkpoint
+import early_abort
+import layout_writer
+import shared_positions
+import layout_artifact
+import graph_snapshot
+import multilevel
 from utils import *
+from work_watcher import DirectoryWatcher
 import os
 import time
 import json
+import job_broker
 
 # Load configuration from JSON file
 with open("config.json") as f:
@@ -17,7 +30,12 @@ CONFIG = CONFIG["layout_generator"]
 GRAPHML_FILE = CONFIG["GRAPHML_FILE"]
 DEBUG = CONFIG["DEBUG"]
 
-GRAPH_TOOL_GRAPH = gt.load_graph(GRAPHML_FILE)
+GRAPH_TOOL_GRAPH = graph_snapshot.load_graph_tool_graph(GRAPHML_FILE)
+LAYOUT_MONITOR = (
+    early_abort.LayoutMonitor(GRAPH_TOOL_GRAPH.get_edges(), GRAPH_TOOL_GRAPH.num_vertices())
+    if early_abort.ENABLED
+    else None
+)
 
 
 def debug_print(*args, **kwargs):
@@ -26,11 +44,16 @@ def debug_print(*args, **kwargs):
         print(*args, **kwargs)
 
 
-def gt_to_pos_df(gt_Graph, param0, param1, param2) -> pd.DataFrame:
+def gt_to_pos_df(gt_Graph, param0, param1, param2, positions: np.ndarray = None) -> pd.DataFrame:
     if type(param2) is not int:
         param2 = int(param2)
 
-    pos = gt.sfdp_layout(gt_Graph, r=param0, C=param1, max_iter=param2)
+    initial_pos = None
+    if positions is not None:
+        # sfdp starts from the given positions instead of random ones
+        initial_pos = gt_Graph.new_vertex_property("vector<double>")
+        initial_pos.set_2d_array(np.ascontiguousarray(positions.T))
+    pos = gt.sfdp_layout(gt_Graph, r=param0, C=param1, max_iter=param2, pos=initial_pos)
     gt_Graph.vertex_properties["pos"] = pos
 
     pos_array = [[v, *pos[v]] for v in gt_Graph.vertices()]
@@ -40,7 +63,7 @@ def gt_to_pos_df(gt_Graph, param0, param1, param2) -> pd.DataFrame:
 
 def process_params_file(param_file: str):
     debug_print("Processing the params file: " + param_file)
-    layout_id = param_file[:-7]
+    layout_id = os.path.basename(param_file)[:-7]
     with open(param_file, "r") as f:
         params = f.readlines()
         if not params:
@@ -53,64 +76,126 @@ def process_params_file(param_file: str):
                 debug_print(f"Content of the file: {params}")
                 return False
 
-        debug_print(f"params_to_test: {params}")
-        pos_df = gt_to_pos_df(GRAPH_TOOL_GRAPH, params[0], params[1], params[2])
-        debug_print("Layout is generated, now converting to dot file...")
-        pos_to_readability_score.pos2dot(
-            pos_df=pos_df,
-            graph_tool_graph=GRAPH_TOOL_GRAPH,
-            output_name=layout_id + ".dot",
-            echo=False,
+        return process_params(layout_id, params)
+
+
+def process_level_params(layout_id: str, params: list, level: int):
+    # a coarse level of the multilevel optimization is laid out from scratch, see multilevel.py
+    graph = multilevel.load_level_graph(level)
+    pos_df = gt_to_pos_df(graph, params[0], params[1], params[2])
+    layout_writer.submit_layout(
+        pos_df=pos_df,
+        graph_tool_graph=graph,
+        layout_id=layout_id,
+        graph_file=multilevel.get_level_graph_file(level),
+    )
+    return True
+
+
+def process_params(layout_id: str, params: list):
+    debug_print(f"params_to_test: {params}")
+    level = multilevel.get_level(params)
+    if level:
+        return process_level_params(layout_id, params, level)
+    start_time = time.time()
+    num_vertices = GRAPH_TOOL_GRAPH.num_vertices()
+    # sfdp can't return a layout without running, so a checkpoint at max_iter itself is of no use
+    start = iteration_checkpoint.get_start(params, num_vertices, inclusive=False)
+    pos_df, aborted = iteration_checkpoint.run_in_segments(
+        params,
+        start,
+        run=lambda positions, iterations: gt_to_pos_df(
+            GRAPH_TOOL_GRAPH, params[0], params[1], iterations, positions=positions
+        ),
+        to_positions=lambda pos_df: layout_artifact.pos_df_to_positions(pos_df, num_vertices),
+        check_iterations=early_abort.get_check_iterations(start.start_iter, start.max_iter),
+        check=lambda iteration, positions: LAYOUT_MONITOR.check(positions, layout_id, iteration),
+    )
+    runtime_model.record_timing("layout", layout_id, time.time() - start_time, params)
+    if aborted is not None:
+        # a hopeless layout goes straight back to the optimizer, see early_abort.py
+        pos_to_readability_score.publish_record(layout_id, aborted)
+        return True
+    if warm_start.ENABLED:
+        warm_start.archive(
+            layout_id,
+            params,
+            layout_artifact.pos_df_to_positions(pos_df, num_vertices),
+            start.warm_start_from,
+            start.distance,
+            start.max_iter - start.start_iter,
         )
+    debug_print("Layout is generated, now converting to dot file...")
+    layout_writer.submit_layout(
+        pos_df=pos_df,
+        graph_tool_graph=GRAPH_TOOL_GRAPH,
+        layout_id=layout_id,
+    )
 
-        return True
+    return True
+
+
+def broker_main():
+    client = job_broker.get_client()
+    debug_print("Claiming params from the job broker at " + job_broker.BROKER_ADDRESS)
+    while True:
+        job = client.claim("params")
+        if job is None:
+            continue
+        layout_id, params = job
+        debug_print("Processing the params of layout: " + layout_id)
+        process_params(layout_id, params)
+        client.ack("params", layout_id)
 
 
 def main():
+    if job_broker.TRANSPORT == "broker":
+        return broker_main()
+
+    own_shards, other_shards = work_shards.get_scan_directories(("params", "batch"))
+    watcher = DirectoryWatcher(
+        endswith=(".params", ".batch"),
+        directories=own_shards,
+        fallback_directories=other_shards,
+    )
+    debug_print(f"Watching for params files in {watcher.mode} mode")
     while True:
-        params_list = retrieve_file_list(
-            retrieve_directory=".", endswith="params", startswith="", not_startswith="."
+        params_list = watcher.list_jobs()
+        debug_print(
+            f"Retrieved file list: {params_list} (queue depth: {len(params_list)})"
         )
-        debug_print(f"Retrieved file list: {params_list}")
-
-        if params_list:
-            for param_file in sorted(params_list):
-                if not os.path.exists(param_file):
-                    debug_print(
-                        "File " + str(param_file) + "does not exist, skipping..."
-                    )
-                    continue
-                lock = FileLock(param_file + ".lock")
-                try:
-                    lock.acquire(timeout=0)
-                    debug_print(f"Trying to open and lock: {param_file}")
-                    if not process_params_file(param_file):
-                        debug_print(f"Failed to process params file: {param_file}")
-
-                    debug_print(f"Finished processing file: {param_file}")
-                    debug_print(f"Releasing lock for: {param_file}")
-                    os.rename(param_file, param_file + ".params_processed")
-                    lock.release()
-                    os.remove(param_file + ".params_processed")
-                    debug_print(f"Removed file: {param_file + '.params_processed'}")
-                    os.remove(param_file + ".lock")
-                except Timeout:
-                    debug_print(
-                        f"File {param_file} is locked, skipping for this file..."
-                    )
-                    time.sleep(1)
-                    continue
-                except FileNotFoundError:
-                    debug_print(
-                        f"File {param_file} not found, skipping for this file..."
-                    )
-                    time.sleep(1)
-                    continue
-        else:
-            debug_print(
-                "No params files found after scanning through the entire list, sleeping for a second..."
-            )
-            time.sleep(1)
+
+        # only wait for new files when nothing could be claimed in this pass, so that a free worker never sleeps
+        # while there is still work it can take
+        claimed = False
+        for param_file in params_list:
+            if param_file.endswith(".batch"):
+                if work_queue.claim_and_process(
+                    param_file,
+                    "batch",
+                    lambda batch_file: batch_manifest.process_batch_file(
+                        batch_file, process_params, debug_print
+                    ),
+                    debug_print,
+                ):
+                    claimed = True
+                continue
+            if work_queue.claim_and_process(
+                param_file, "params", process_params_file, debug_print
+            ):
+                claimed = True
+
+        if not claimed:
+            # an idle worker looks after the jobs of dead workers before waiting
+            if work_queue.maybe_requeue_expired_leases(
+                "params", debug_print
+            ) + work_queue.maybe_requeue_expired_leases("batch", debug_print):
+                continue
+            # and after the shared layouts of this node that no evaluator is left to take, see shared_positions.py
+            if shared_positions.ENABLED and shared_positions.republish_orphans(debug_print):
+                continue
+            debug_print("No params files could be claimed, waiting for new ones...")
+            watcher.wait()
 
 
 if __name__ == "__main__":
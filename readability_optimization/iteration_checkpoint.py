@@ -0,0 +1,220 @@
+"""
+This module lets a layout with a larger max_iter continue from where a layout of the same scaling_ratio and gravity
+stopped, instead of running the same first iterations again. max_iter is one of the optimized params, so the optimizer
+asks for e.g. (s, g, 500) and later (s, g, 800), whose first 500 iterations are the same.
+
+The layout generators store the positions of a layout at every iteration count of MILESTONES it passes, under
+CACHE_DIRECTORY/<graph name>/<LAYOUT_GENERATOR>/<scaling_ratio>_<gravity>/<iteration>.npz. A layout resumes from the
+largest checkpoint of its scaling_ratio and gravity at or below its max_iter, and only runs the remaining iterations.
+1. The numba generator (force_atlas2.py) also stores the forces and the speed of the run, so a resumed layout comes
+out exactly as the uninterrupted one.
+2. cuGraph and graph-tool can only be given start positions, so they run a layout in segments between the milestones
+that have no checkpoint yet, and a resumed layout starts from the checkpoint positions with a fresh speed. Every
+segment restarts with a fresh speed too, the price of a checkpoint for a later layout, which is why the milestones
+already stored are run through.
+The scaling_ratio and gravity are rounded to KEY_DECIMALS decimals for the lookup, so that nearly equal params share
+their checkpoints too, since the optimizer hardly ever asks for exactly the same floats twice. Only the MAX_KEYS most
+recently used scaling_ratio and gravity pairs keep their checkpoints, the others are removed.
+A layout without a checkpoint is warm-started as before (see warm_start.py). A warm-started layout is not
+checkpointed, since its positions don't follow from its params alone.
+"""
+
+import collections
+import json
+import os
+import shutil
+import numpy as np
+import warm_start
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# the checkpoints of one generator are no use to another, sfdp doesn't even take the same params
+LAYOUT_GENERATOR = CONFIG["optimizer"]["LAYOUT_GENERATOR"]
+
+# Extract configurations for iteration_checkpoint
+CONFIG = CONFIG["iteration_checkpoint"]
+
+ENABLED = CONFIG["ENABLED"]
+CACHE_DIRECTORY = CONFIG["CACHE_DIRECTORY"]
+MILESTONES = sorted(CONFIG["MILESTONES"])
+KEY_DECIMALS = CONFIG["KEY_DECIMALS"]
+MAX_KEYS = CONFIG["MAX_KEYS"]
+
+# where a layout starts: the positions (None for random ones) after start_iter iterations, the rest of the numba
+# state at that point (or None), and the warm start it got instead of a checkpoint (see warm_start.py)
+Start = collections.namedtuple(
+    "Start",
+    ["positions", "start_iter", "state", "warm_start_from", "distance", "max_iter"],
+)
+
+
+def get_checkpoint_directory(scaling_ratio: float, gravity: float) -> str:
+    scaling_ratio, gravity = float(scaling_ratio), float(gravity)
+    if KEY_DECIMALS is not None:
+        scaling_ratio = round(scaling_ratio, KEY_DECIMALS)
+        gravity = round(gravity, KEY_DECIMALS)
+    graph_name = os.path.splitext(os.path.basename(warm_start.GRAPHML_FILE))[0]
+    return os.path.join(
+        CACHE_DIRECTORY, graph_name, LAYOUT_GENERATOR, f"{scaling_ratio!r}_{gravity!r}"
+    )
+
+
+def find(scaling_ratio: float, gravity: float, max_iter: int, inclusive: bool = True) -> tuple:
+    """
+    Return (iteration, positions, state) of the largest checkpoint at or below max_iter (below it, unless inclusive),
+    or (0, None, None) if there is none. state is None for a checkpoint without the numba state.
+    """
+    directory = get_checkpoint_directory(scaling_ratio, gravity)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0, None, None
+    iterations = sorted(
+        (
+            int(name[: -len(".npz")])
+            for name in names
+            if name.endswith(".npz") and name[: -len(".npz")].isdigit()
+        ),
+        reverse=True,
+    )
+    for iteration in iterations:
+        if iteration > max_iter or (iteration == max_iter and not inclusive):
+            continue
+        try:
+            with np.load(os.path.join(directory, f"{iteration}.npz")) as checkpoint:
+                positions = checkpoint["positions"]
+                state = None
+                if "forces" in checkpoint:
+                    state = {
+                        "forces": checkpoint["forces"],
+                        "speed": float(checkpoint["speed"]),
+                        "speed_efficiency": float(checkpoint["speed_efficiency"]),
+                    }
+        except (OSError, ValueError, KeyError):
+            # removed or cut short, try the next one
+            continue
+        try:
+            # the checkpoints of this scaling_ratio and gravity are in use, keep them from being evicted
+            os.utime(directory)
+        except OSError:
+            pass
+        return iteration, positions, state
+    return 0, None, None
+
+
+def has_checkpoint(scaling_ratio: float, gravity: float, iteration: int) -> bool:
+    return os.path.exists(
+        os.path.join(get_checkpoint_directory(scaling_ratio, gravity), f"{iteration}.npz")
+    )
+
+
+def evict(directory: str):
+    """
+    Remove the checkpoints of the least recently used scaling_ratio and gravity pairs beyond MAX_KEYS, but never the
+    ones of the given directory.
+    """
+    if MAX_KEYS is None:
+        return
+    parent = os.path.dirname(directory)
+    keys = []
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        try:
+            keys.append((os.path.getmtime(path), path))
+        except OSError:
+            # removed by another generator meanwhile
+            continue
+    keys.sort()
+    for _, path in keys[: max(len(keys) - MAX_KEYS, 0)]:
+        if path != directory:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def save(
+    scaling_ratio: float,
+    gravity: float,
+    iteration: int,
+    positions: np.ndarray,
+    state: dict = None,
+):
+    directory = get_checkpoint_directory(scaling_ratio, gravity)
+    path = os.path.join(directory, f"{iteration}.npz")
+    if os.path.exists(path):
+        # another layout of the same params got there first
+        return
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        evict(directory)
+    arrays = {"positions": np.asarray(positions, dtype=np.float64)}
+    if state is not None:
+        arrays.update(state)
+    # hidden name first, then an atomic rename, like every other file of the queue
+    temporary_path = os.path.join(directory, f".{iteration}-{os.getpid()}.npz")
+    np.savez(temporary_path, **arrays)
+    os.rename(temporary_path, path)
+
+
+def get_start(params: list, num_vertices: int, inclusive: bool = True) -> Start:
+    """
+    Return where a layout of the given params starts: from its largest checkpoint, or else from the warm start or
+    random positions warm_start.get_initial_positions gives. inclusive allows a checkpoint at max_iter itself, i.e.
+    a layout that needs no iteration at all, which only the numba generator can return as is.
+    """
+    max_iter = int(params[2])
+    if ENABLED:
+        start_iter, positions, state = find(params[0], params[1], max_iter, inclusive)
+        if positions is not None and positions.shape == (num_vertices, 2):
+            return Start(positions, start_iter, state, None, None, max_iter)
+    positions, warm_start_from, distance, max_iter = warm_start.get_initial_positions(
+        params, num_vertices
+    )
+    return Start(positions, 0, None, warm_start_from, distance, max_iter)
+
+
+def get_milestones(start: Start) -> list:
+    # a warm-started layout doesn't follow from its params alone, so it is never checkpointed
+    if not ENABLED or start.warm_start_from is not None:
+        return []
+    return [
+        milestone
+        for milestone in MILESTONES
+        if start.start_iter < milestone <= start.max_iter
+    ]
+
+
+def run_in_segments(params: list, start: Start, run, to_positions, check_iterations=(), check=None) -> tuple:
+    """
+    Run a layout from its start with a generator that only takes start positions, stopping at every milestone to
+    store a checkpoint, unless one is already stored there. run(positions, iterations) runs the given number of
+    iterations from the positions (None for random ones) and returns the layout, and to_positions(layout) returns its
+    (n, 2) positions.
+    The run also stops at the check_iterations, where check(iteration, positions) can end it by returning anything but
+    None. Return (layout, what check returned), or (layout, None) for a layout that ran all its iterations.
+    """
+    positions = start.positions
+    iteration = start.start_iter
+    # every segment restarts with a fresh speed, so a stored milestone is run through
+    milestones = [
+        milestone
+        for milestone in get_milestones(start)
+        if not has_checkpoint(params[0], params[1], milestone)
+    ]
+    check_iterations = [stop for stop in check_iterations if iteration < stop < start.max_iter]
+    layout = None
+    for stop in sorted(set(milestones + check_iterations + [start.max_iter])):
+        layout = run(positions, stop - iteration)
+        iteration = stop
+        if stop == start.max_iter:
+            break
+        positions = to_positions(layout)
+        if stop in milestones:
+            save(params[0], params[1], stop, positions)
+        if stop in check_iterations:
+            result = check(stop, positions)
+            if result is not None:
+                return layout, result
+    if start.max_iter in milestones:
+        save(params[0], params[1], start.max_iter, to_positions(layout))
+    return layout, None
@@ -0,0 +1,319 @@
+"""
+This module hosts the optional job broker of the GraphOptima, an alternative transport to the shared-filesystem queue.
+Instead of exchanging .params, .dot and .result files guarded by file locks, the optimizer, the layout generators and the
+layout evaluators connect to one broker process (asyncio, over TCP or a Unix socket) that keeps the queues in memory:
+
+1. the optimizer puts a param set into the "params" queue, then waits for the result of its layout id
+2. a layout generator claims a param set, computes the layout and puts the DOT text into the "layouts" queue
+3. a layout evaluator claims a layout, runs GLAM on it and publishes the GLAM output as the result of the layout id
+
+A result nobody asks for within RESULT_TTL, e.g. of a straggler whose duplicate won, is dropped.
+A claimed job must be acknowledged once its output is published. If a worker disconnects while still holding a claim,
+e.g. its Slurm job is killed, the broker puts the job back at the front of its queue.
+
+The protocol is one JSON object per line in both directions. The transport is selected by job_broker.TRANSPORT in the
+config; run `python job_broker.py` on the node given in BROKER_ADDRESS before starting the other modules.
+A third transport, "memory", is set by memory_pipeline.py, which serves the same client interface from in-process queues.
+"""
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import threading
+import time
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for job_broker
+CONFIG = CONFIG["job_broker"]
+
+TRANSPORT = CONFIG["TRANSPORT"]
+BROKER_ADDRESS = CONFIG["BROKER_ADDRESS"]
+CLAIM_TIMEOUT = CONFIG["CLAIM_TIMEOUT"]
+RESULT_TTL = CONFIG["RESULT_TTL"]
+
+QUEUE_NAMES = ("params", "layouts")
+
+# a DOT file of a large graph easily exceeds the default 64 KiB line limit of asyncio streams
+STREAM_LIMIT = 1 << 30
+
+
+def parse_address(address: str):
+    """
+    Split "unix:<path>" or "tcp:<host>:<port>" into (family, target).
+    """
+    scheme, _, target = address.partition(":")
+    if scheme == "unix":
+        return "unix", target
+    if scheme == "tcp":
+        host, _, port = target.rpartition(":")
+        return "tcp", (host, int(port))
+    raise ValueError("Invalid broker address: " + address)
+
+
+class JobBroker:
+    def __init__(self):
+        self.queues = {name: collections.deque() for name in QUEUE_NAMES}
+        self.conditions = {name: asyncio.Condition() for name in QUEUE_NAMES}
+        self.results = {}
+        self.result_events = {}
+        # uuid -> when its result was put, oldest first
+        self.result_times = collections.OrderedDict()
+
+    async def put(self, queue: str, uuid: str, payload, front: bool = False):
+        async with self.conditions[queue]:
+            if front:
+                self.queues[queue].appendleft((uuid, payload))
+            else:
+                self.queues[queue].append((uuid, payload))
+            self.conditions[queue].notify()
+
+    async def claim(self, queue: str, timeout: float = None):
+        condition = self.conditions[queue]
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.queues[queue]), timeout
+                )
+            except asyncio.TimeoutError:
+                return None
+            return self.queues[queue].popleft()
+
+    def _result_event(self, uuid: str) -> asyncio.Event:
+        return self.result_events.setdefault(uuid, asyncio.Event())
+
+    def _drop_expired_results(self):
+        # the results whose waiters gave up would otherwise stay in memory for good
+        if RESULT_TTL is None:
+            return
+        now = time.monotonic()
+        while self.result_times:
+            uuid, put_time = next(iter(self.result_times.items()))
+            if now - put_time < RESULT_TTL:
+                return
+            self.result_times.popitem(last=False)
+            self.results.pop(uuid, None)
+            self.result_events.pop(uuid, None)
+
+    async def put_result(self, uuid: str, payload):
+        self._drop_expired_results()
+        self.results[uuid] = payload
+        self.result_times[uuid] = time.monotonic()
+        self.result_times.move_to_end(uuid)
+        self._result_event(uuid).set()
+
+    async def get_result(self, uuid: str, timeout: float = None):
+        if uuid not in self.results:
+            event = self._result_event(uuid)
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                # a waiter that asks again gets a new event, and put_result one that is already set
+                if uuid not in self.results:
+                    self.result_events.pop(uuid, None)
+                return False, None
+            if uuid not in self.results:
+                # dropped as expired right after it was put
+                return False, None
+        # a result is consumed once, like the .result file that is removed after being read
+        self.result_events.pop(uuid, None)
+        self.result_times.pop(uuid, None)
+        return True, self.results.pop(uuid)
+
+    def depth(self) -> dict:
+        depth = {name: len(queue) for name, queue in self.queues.items()}
+        depth["results"] = len(self.results)
+        return depth
+
+    async def handle_request(self, request: dict, claimed: dict) -> dict:
+        op = request["op"]
+        if op == "put":
+            await self.put(request["queue"], request["uuid"], request["payload"])
+            return {"ok": True}
+        if op == "claim":
+            job = await self.claim(request["queue"], request.get("timeout"))
+            if job is None:
+                return {"uuid": None}
+            claimed[(request["queue"], job[0])] = job[1]
+            return {"uuid": job[0], "payload": job[1]}
+        if op == "ack":
+            claimed.pop((request["queue"], request["uuid"]), None)
+            return {"ok": True}
+        if op == "put_result":
+            await self.put_result(request["uuid"], request["payload"])
+            return {"ok": True}
+        if op == "get_result":
+            found, payload = await self.get_result(
+                request["uuid"], request.get("timeout")
+            )
+            return {"found": found, "payload": payload}
+        if op == "depth":
+            return self.depth()
+        raise ValueError("Unknown broker operation: " + str(op))
+
+    async def handle_connection(self, reader, writer):
+        # jobs claimed through this connection and not acknowledged yet, keyed by (queue, uuid)
+        claimed = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line), claimed)
+                except (KeyError, ValueError) as e:
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # the worker is gone without acknowledging, hand its jobs to someone else first
+            for (queue, uuid), payload in claimed.items():
+                print(f"Requeueing {uuid} from a disconnected {queue} worker")
+                await self.put(queue, uuid, payload, front=True)
+            writer.close()
+
+    async def serve(self, address: str = BROKER_ADDRESS, started: threading.Event = None):
+        family, target = parse_address(address)
+        if family == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=target, limit=STREAM_LIMIT
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection, host=target[0], port=target[1], limit=STREAM_LIMIT
+            )
+        print("Job broker listening on " + address)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+
+def start_local_broker(address: str = BROKER_ADDRESS) -> threading.Thread:
+    """
+    Run a broker in a daemon thread of the current process, e.g. for testing the pipeline on one machine.
+    """
+    started = threading.Event()
+    thread = threading.Thread(
+        target=lambda: asyncio.run(JobBroker().serve(address, started)), daemon=True
+    )
+    thread.start()
+    started.wait()
+    return thread
+
+
+class BrokerClient:
+    """
+    Blocking client of the job broker. A client holds one connection and is not thread safe, use get_client() to get
+    the one of the current thread.
+    """
+
+    def __init__(self, address: str = BROKER_ADDRESS):
+        self.address = address
+        self._sock = None
+        self._file = None
+        self._connect()
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        if family == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(target)
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+
+    def _request(self, **request) -> dict:
+        message = json.dumps(request).encode() + b"\n"
+        try:
+            self._file.write(message)
+            self._file.flush()
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("Job broker closed the connection")
+        except OSError:
+            # the broker restarted, reconnect once. Jobs claimed on the old connection have been requeued by then
+            self.close()
+            self._connect()
+            self._file.write(message)
+            self._file.flush()
+            line = self._file.readline()
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError("Job broker error: " + response["error"])
+        return response
+
+    def put(self, queue: str, uuid: str, payload):
+        self._request(op="put", queue=queue, uuid=uuid, payload=payload)
+
+    def claim(self, queue: str, timeout: float = CLAIM_TIMEOUT):
+        """
+        Return a (uuid, payload) pair from the given queue, or None if nothing arrives within the timeout.
+        """
+        response = self._request(op="claim", queue=queue, timeout=timeout)
+        if response["uuid"] is None:
+            return None
+        return response["uuid"], response["payload"]
+
+    def ack(self, queue: str, uuid: str):
+        self._request(op="ack", queue=queue, uuid=uuid)
+
+    def put_result(self, uuid: str, payload):
+        self._request(op="put_result", uuid=uuid, payload=payload)
+
+    def get_result(self, uuid: str, timeout: float = None):
+        response = self._request(op="get_result", uuid=uuid, timeout=timeout)
+        if not response["found"]:
+            raise TimeoutError(
+                f"No readability result for layout {uuid} after {timeout} seconds"
+            )
+        return response["payload"]
+
+    def depth(self) -> dict:
+        return self._request(op="depth")
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+            self._file = None
+
+
+_LOCAL = threading.local()
+
+# set by memory_pipeline.py, which replaces the broker by queues shared between the threads of a single process
+IN_PROCESS_CLIENT = None
+
+
+def get_client() -> BrokerClient:
+    """
+    Return the broker client of the current thread, reconnecting after a fork as the DE and NSGA2 pools do.
+    """
+    if IN_PROCESS_CLIENT is not None:
+        return IN_PROCESS_CLIENT
+    client = getattr(_LOCAL, "client", None)
+    if client is None or _LOCAL.pid != os.getpid():
+        client = BrokerClient()
+        _LOCAL.client = client
+        _LOCAL.pid = os.getpid()
+    return client
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(JobBroker().serve())
+    except KeyboardInterrupt:
+        print("\nJob broker interrupted by user...")
@@ -0,0 +1,163 @@
+"""
+This module defines the binary layout artifact, a compact alternative to rewriting the whole graph to a .dot file for
+every layout. Only the vertex coordinates change from one layout to the next, so a layout is stored as:
+
+1. <uuid>.positions.npy: a float32 array of shape (number of vertices, 2), indexed by vertex, that can be memory-mapped
+2. <uuid>.layout: a small JSON handoff record pointing to the positions and to the cached topology of the graph
+
+The topology (an int32 edge array of shape (number of edges, 2)) is written once per graph under TOPOLOGY_DIRECTORY.
+The .layout record is published last with an atomic rename, so a consumer never sees a half-written artifact.
+GLAM only reads DOT files, so layout_to_dot is the on-demand adapter the layout evaluator uses right before running it.
+"""
+
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
+
+# Extract configurations for layout_artifact
+CONFIG = CONFIG["layout_artifact"]
+
+FORMAT = CONFIG["FORMAT"]
+TOPOLOGY_DIRECTORY = CONFIG["TOPOLOGY_DIRECTORY"]
+
+
+def get_topology_path(graph_file: str = GRAPHML_FILE) -> str:
+    graph_name = os.path.splitext(os.path.basename(graph_file))[0]
+    return os.path.join(TOPOLOGY_DIRECTORY, graph_name + ".edges.npy")
+
+
+def ensure_topology(graph_tool_graph, graph_file: str = GRAPHML_FILE) -> str:
+    """
+    Write the edge array of the graph once, and return its path. Concurrent generators may race to write it, which is
+    harmless as every one of them publishes the same content with an atomic rename.
+    """
+    topology_path = get_topology_path(graph_file)
+    if not os.path.exists(topology_path):
+        os.makedirs(TOPOLOGY_DIRECTORY, exist_ok=True)
+        edges = graph_tool_graph.get_edges()[:, :2].astype(np.int32)
+        temporary_path = topology_path + "." + str(os.getpid()) + ".tmp.npy"
+        np.save(temporary_path, edges)
+        os.rename(temporary_path, topology_path)
+    return topology_path
+
+
+def pos_df_to_positions(
+    pos_df: pd.DataFrame, num_vertices: int, missing: float = 0.0
+) -> np.ndarray:
+    """
+    Turn a ['vertex', 'x', 'y'] position dataframe into a float32 array indexed by vertex.
+    Vertices missing from the dataframe, e.g. the isolated ones cuGraph leaves out, get the missing coordinates: 0.0
+    by default, where pos2dot puts them, so that GLAM evaluates the same layout whichever handoff it goes through.
+    """
+    vertices = pos_df["vertex"]
+    # if the vertex name is a string like n1234, convert it to integer 1234, same as pos2dot
+    if vertices.dtype == object:
+        vertices = vertices.apply(lambda x: int(re.sub("[^0-9]", "", str(x))))
+    positions = np.full((num_vertices, 2), missing, dtype=np.float32)
+    positions[vertices.to_numpy(dtype=np.int64)] = pos_df[["x", "y"]].to_numpy(
+        dtype=np.float32
+    )
+    return positions
+
+
+def write_positions(positions_path: str, positions: np.ndarray):
+    directory, name = os.path.split(positions_path)
+    # np.save only writes .npy files, the hidden name keeps it out of the listings until it is complete
+    temporary_path = os.path.join(directory, "." + name)
+    np.save(temporary_path, np.ascontiguousarray(positions, dtype=np.float32))
+    os.rename(temporary_path, positions_path)
+
+
+def write_layout(
+    layout_id: str, positions: np.ndarray, topology_path: str, directory: str = "."
+) -> str:
+    """
+    Publish a layout artifact in the given directory and return the path of its .layout record.
+    """
+    positions_path = os.path.join(directory, layout_id + ".positions.npy")
+    write_positions(positions_path, positions)
+
+    record = {
+        "layout_id": layout_id,
+        # relative to the working directory, as the record is moved around on its own when claimed
+        "positions": positions_path,
+        "topology": os.path.abspath(topology_path),
+        "num_vertices": int(positions.shape[0]),
+    }
+    layout_path = os.path.join(directory, layout_id + ".layout")
+    temporary_path = os.path.join(directory, "." + layout_id + ".layout_temp")
+    with open(temporary_path, "w") as f:
+        json.dump(record, f)
+    os.rename(temporary_path, layout_path)
+    return layout_path
+
+
+def read_layout_record(layout_file: str) -> dict:
+    with open(layout_file) as f:
+        return json.load(f)
+
+
+def get_positions_path(record: dict, directory: str = ".") -> str:
+    # the positions stay where they were published, even when the record is claimed into an inbox
+    return os.path.join(directory, record["positions"])
+
+
+def load_layout(layout_file: str, directory: str = "."):
+    """
+    Return the (record, positions, edges) of a layout artifact, with the arrays memory-mapped.
+    """
+    record = read_layout_record(layout_file)
+    positions = np.load(get_positions_path(record, directory), mmap_mode="r")
+    edges = np.load(record["topology"], mmap_mode="r")
+    return record, positions, edges
+
+
+def layout_to_pos_df(layout_file: str, directory: str = ".") -> pd.DataFrame:
+    _, positions, _ = load_layout(layout_file, directory)
+    return pd.DataFrame(
+        {
+            "vertex": [str(vertex) for vertex in range(len(positions))],
+            "x": positions[:, 0],
+            "y": positions[:, 1],
+        }
+    )
+
+
+def positions_to_dot(positions: np.ndarray, edges: np.ndarray, dot_path: str):
+    """
+    Write an undirected DOT file with the x and y vertex attributes GLAM reads, like pos2dot does through graph-tool.
+    """
+    with open(dot_path, "w") as f:
+        f.write("graph G {\n")
+        # 9 significant digits round-trip a float32
+        f.writelines(
+            f'{vertex} [x="{x:.9g}", y="{y:.9g}"];\n'
+            for vertex, (x, y) in enumerate(positions.tolist())
+        )
+        f.writelines(f"{source}--{target};\n" for source, target in edges.tolist())
+        f.write("}\n")
+
+
+def layout_to_dot(layout_file: str, dot_path: str, directory: str = "."):
+    _, positions, edges = load_layout(layout_file, directory)
+    positions_to_dot(positions, edges, dot_path)
+
+
+def remove_layout(layout_file: str, directory: str = "."):
+    try:
+        record = read_layout_record(layout_file)
+        os.remove(get_positions_path(record, directory))
+    except FileNotFoundError:
+        pass
+    try:
+        os.remove(layout_file)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,55 @@
+"""
+This module catches the degenerate layouts that extreme params produce, before they go through pos2dot and GLAM, where
+they waste a whole evaluation or even dump core. A layout is degenerate if
+1. any of its coordinates is NaN or infinite
+2. any of its coordinates is beyond MAX_COORDINATE, i.e. the layout exploded
+3. its extent (the larger side of its bounding box) is below MIN_EXTENT, i.e. the layout collapsed to a point
+4. more than MAX_COINCIDENT_FRACTION of its vertices share their position with another vertex, within
+COINCIDENCE_TOLERANCE times the extent
+pos_to_readability_score.publish_layout gives a degenerate layout the penalty right away, without evaluating it. Only
+the vertices in the position dataframe are checked: cuGraph leaves the isolated vertices out, and pos2dot places them at
+0.0.
+"""
+
+import json
+import numpy as np
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for layout_check
+CONFIG = CONFIG["layout_check"]
+
+ENABLED = CONFIG["ENABLED"]
+MAX_COORDINATE = CONFIG["MAX_COORDINATE"]
+MIN_EXTENT = CONFIG["MIN_EXTENT"]
+MAX_COINCIDENT_FRACTION = CONFIG["MAX_COINCIDENT_FRACTION"]
+COINCIDENCE_TOLERANCE = CONFIG["COINCIDENCE_TOLERANCE"]
+
+
+def find_degeneracy(positions: np.ndarray) -> str:
+    """
+    Return why the (n, 2) positions are a degenerate layout, or None if they are fine.
+    """
+    if positions.shape[0] == 0:
+        return None
+    if not np.isfinite(positions).all():
+        return "NaN or infinite coordinates"
+    if np.abs(positions).max() > MAX_COORDINATE:
+        return f"coordinates beyond {MAX_COORDINATE}"
+    if positions.shape[0] == 1:
+        return None
+    extent = float((positions.max(axis=0) - positions.min(axis=0)).max())
+    if extent < MIN_EXTENT:
+        return f"extent {extent} below {MIN_EXTENT}"
+
+    # the positions within the tolerance of each other fall into the same cell
+    cells = np.floor(
+        (positions - positions.min(axis=0)) / (extent * COINCIDENCE_TOLERANCE)
+    ).astype(np.int64)
+    _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    coincident_fraction = float((counts[inverse.ravel()] > 1).mean())
+    if coincident_fraction > MAX_COINCIDENT_FRACTION:
+        return f"{coincident_fraction:.0%} of the vertices coincide"
+    return None
@@ -5,10 +5,17 @@ conda activate base
 
 LAYOUT_GENERATOR=$(python -c "import json; print(json.load(open('config.json'))['optimizer']['LAYOUT_GENERATOR'])")
 
-if [ "$LAYOUT_GENERATOR" = "cuGraph" ]; then
+GENERATOR_HOST=$(python -c "import json; print(json.load(open('config.json'))['generator_host']['ENABLED'])")
+
+# the generator host runs several graph-tool or numba workers on one copy of the graph
+if [ "$GENERATOR_HOST" = "True" ] && [ "$LAYOUT_GENERATOR" != "cuGraph" ]; then
+    python generator_host.py
+elif [ "$LAYOUT_GENERATOR" = "cuGraph" ]; then
     python cuGraph_to_pos_df.py
 elif [ "$LAYOUT_GENERATOR" = "graph-tool" ]; then
     python gt_to_pos_df.py
+elif [ "$LAYOUT_GENERATOR" = "numba" ]; then
+    python fa2_to_pos_df.py
 else
     echo "Invalid layout_generator value: $LAYOUT_GENERATOR"
     exit 1
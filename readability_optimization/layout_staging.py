@@ -0,0 +1,207 @@
+"""
+This module keeps the intermediate layouts of the filesystem transport on node-local storage instead of the shared
+working directory. With staging enabled, a layout generator writes its DOT file (or binary positions, see
+layout_artifact.py) to the scratch directory of its node ($SLURM_TMPDIR, or /dev/shm), and only publishes a small
+<uuid>.staged handoff record to the shared queue.
+
+An evaluator on the same node reads the layout straight from the scratch directory. An evaluator on another node fetches
+it over HTTP from the generator, which serves its scratch directory from a background thread, and deletes it there once
+the result is published. The server only listens on the cluster-internal interface of the node (BIND_ADDRESS), and
+only serves the requests that carry the token of the generator, a random one per run, which is passed to the evaluators
+in the handoff records only. The records are published to the shards of the generator's worker group (see
+work_shards.py), which by default is shared by the workers of the same node, so the co-located evaluators see them
+first.
+"""
+
+import functools
+import hmac
+import json
+import os
+import secrets
+import shutil
+import socket
+import threading
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import work_shards
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for layout_staging
+CONFIG = CONFIG["layout_staging"]
+
+ENABLED = CONFIG["ENABLED"]
+SCRATCH_DIRECTORY = CONFIG["SCRATCH_DIRECTORY"]
+BIND_ADDRESS = CONFIG["BIND_ADDRESS"]
+PORT = CONFIG["PORT"]
+FETCH_TIMEOUT = CONFIG["FETCH_TIMEOUT"]
+
+TOKEN_HEADER = "X-Staging-Token"
+
+_SERVER_URL = None
+_SERVER_TOKEN = None
+_SERVER_LOCK = threading.Lock()
+
+
+def get_scratch_directory() -> str:
+    """
+    Return (and create) the node-local directory holding the staged layouts.
+    """
+    base_directory = (
+        SCRATCH_DIRECTORY or os.environ.get("SLURM_TMPDIR") or "/dev/shm"
+    )
+    directory = os.path.join(base_directory, "graphoptima_staging")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def get_bind_address() -> str:
+    """
+    Return the address the server listens on: BIND_ADDRESS, or else the one the host name of the node resolves to,
+    which is its cluster-internal interface on Slurm.
+    """
+    return BIND_ADDRESS or socket.gethostbyname(socket.gethostname())
+
+
+class StagingRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the layouts of the scratch directory, and let a remote evaluator delete a layout once it is done with it.
+    Every request has to carry the token of the server.
+    """
+
+    def __init__(self, *args, token: str, **kwargs):
+        self.token = token
+        super().__init__(*args, **kwargs)
+
+    def is_authorized(self) -> bool:
+        if hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), self.token):
+            return True
+        self.send_error(403)
+        return False
+
+    def do_GET(self):
+        if self.is_authorized():
+            super().do_GET()
+
+    def do_HEAD(self):
+        if self.is_authorized():
+            super().do_HEAD()
+
+    def list_directory(self, path):
+        # the evaluators only ever ask for the layout of their record
+        self.send_error(404)
+        return None
+
+    def do_DELETE(self):
+        if not self.is_authorized():
+            return
+        # translate_path confines the request to the served directory
+        try:
+            os.remove(self.translate_path(self.path))
+        except FileNotFoundError:
+            pass
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # one line per fetched layout would flood the Slurm output
+        pass
+
+
+def get_server_url() -> str:
+    """
+    Start serving the scratch directory from a daemon thread on the first call, and return its base URL.
+    """
+    global _SERVER_URL
+    global _SERVER_TOKEN
+    with _SERVER_LOCK:
+        if _SERVER_URL is None:
+            _SERVER_TOKEN = secrets.token_urlsafe(32)
+            server = ThreadingHTTPServer(
+                (get_bind_address(), PORT),
+                functools.partial(
+                    StagingRequestHandler,
+                    directory=get_scratch_directory(),
+                    token=_SERVER_TOKEN,
+                ),
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address[:2]
+            _SERVER_URL = f"http://{host}:{port}"
+        return _SERVER_URL
+
+
+def publish_record(layout_id: str, format: str, path: str, topology: str = None) -> str:
+    """
+    Publish the handoff record of a layout staged at the given path of the scratch directory, and return its path.
+    format is "dot" or "binary"; a binary layout also refers to the topology of the graph on the shared filesystem.
+    """
+    record = {
+        "layout_id": layout_id,
+        "format": format,
+        "host": socket.gethostname(),
+        "path": os.path.abspath(path),
+        "url": get_server_url() + "/" + os.path.basename(path),
+        "token": _SERVER_TOKEN,
+        "topology": None if topology is None else os.path.abspath(topology),
+    }
+    directory = work_shards.get_job_directory(
+        "staged", layout_id, group=work_shards.get_worker_group()
+    )
+    record_path = os.path.join(directory, layout_id + ".staged")
+    temporary_path = os.path.join(directory, "." + layout_id + ".staged_temp")
+    # the record holds the token of the server, so only the user running the optimization may read it
+    with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(record, f)
+    os.rename(temporary_path, record_path)
+    return record_path
+
+
+def read_record(record_file: str) -> dict:
+    with open(record_file) as f:
+        return json.load(f)
+
+
+def is_local(record: dict) -> bool:
+    return record["host"] == socket.gethostname() and os.path.exists(record["path"])
+
+
+def get_request(record: dict, method: str = "GET") -> urllib.request.Request:
+    return urllib.request.Request(
+        record["url"], headers={TOKEN_HEADER: record["token"]}, method=method
+    )
+
+
+def fetch(record: dict, directory: str) -> str:
+    """
+    Return a local path of the staged layout: the staged file itself on the same node, otherwise a copy downloaded
+    from the generator into the given directory. Raise OSError if the generator can't be reached.
+    """
+    if is_local(record):
+        return record["path"]
+    path = os.path.join(directory, os.path.basename(record["path"]))
+    with urllib.request.urlopen(get_request(record), timeout=FETCH_TIMEOUT) as response:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(response, f)
+    return path
+
+
+def release(record: dict):
+    """
+    Remove the staged layout from the scratch directory of its generator.
+    """
+    if record["host"] == socket.gethostname():
+        try:
+            os.remove(record["path"])
+        except FileNotFoundError:
+            pass
+        return
+    try:
+        urllib.request.urlopen(
+            get_request(record, method="DELETE"), timeout=FETCH_TIMEOUT
+        ).close()
+    except OSError as e:
+        # the generator is gone, and its scratch directory with it
+        print(f"Could not release staged layout {record['layout_id']}: {e}")
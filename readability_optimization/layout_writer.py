@@ -0,0 +1,114 @@
+"""
+This module publishes the finished layouts of a layout generator from a background thread, so that the generator
+computes the next layout while the previous one goes through pos2dot (or the binary writer) and into the queue.
+
+At most MAX_PENDING_LAYOUTS layouts wait for the writer; a generator that gets that far ahead blocks until the writer
+catches up, which bounds the memory the pending position dataframes take. pos2dot sets the properties of the graph it
+writes, so the writer works on its own copy of the graph-tool graph rather than the one the generator lays out.
+A job of the queue stays claimed, with its lease renewed, until its layouts are published, see
+work_queue.defer_completion. Without a claimed job (the broker and memory transports, or the filelock protocol) a
+layout is published right away, as before.
+"""
+
+import json
+import queue
+import threading
+import traceback
+import layout_artifact
+import pos_to_readability_score
+import work_queue
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for layout_writer
+CONFIG = CONFIG["layout_writer"]
+
+ENABLED = CONFIG["ENABLED"]
+MAX_PENDING_LAYOUTS = CONFIG["MAX_PENDING_LAYOUTS"]
+
+
+class LayoutWriter:
+    def __init__(self, max_pending: int = MAX_PENDING_LAYOUTS):
+        self.queue = queue.Queue(maxsize=max_pending)
+        # id of the graph of the generator -> the copy of the writer
+        self.graphs = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _get_graph(self, graph_tool_graph):
+        graph = self.graphs.get(id(graph_tool_graph))
+        if graph is None:
+            graph = graph_tool_graph.copy()
+            self.graphs[id(graph_tool_graph)] = graph
+        return graph
+
+    def submit(
+        self,
+        pos_df,
+        graph_tool_graph,
+        layout_id: str,
+        on_published=None,
+        graph_file: str = layout_artifact.GRAPHML_FILE,
+    ):
+        """
+        Queue a layout for publication, blocking while MAX_PENDING_LAYOUTS are already queued.
+        on_published(succeeded) is called from the writer thread once it is published.
+        """
+        # copied here, in the thread of the generator, which doesn't change the graph while it is copied
+        graph = self._get_graph(graph_tool_graph)
+        self.queue.put((pos_df, graph, layout_id, on_published, graph_file))
+
+    def _run(self):
+        while True:
+            pos_df, graph, layout_id, on_published, graph_file = self.queue.get()
+            succeeded = False
+            try:
+                pos_to_readability_score.publish_layout(
+                    pos_df=pos_df,
+                    graph_tool_graph=graph,
+                    layout_id=layout_id,
+                    echo=False,
+                    graph_file=graph_file,
+                )
+                succeeded = True
+            except Exception:
+                # the lease of the job runs out, and the job is requeued
+                traceback.print_exc()
+            finally:
+                if on_published is not None:
+                    on_published(succeeded)
+                self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_layout_writer() -> LayoutWriter:
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = LayoutWriter()
+        return _WRITER
+
+
+def submit_layout(pos_df, graph_tool_graph, layout_id: str, graph_file: str = layout_artifact.GRAPHML_FILE):
+    """
+    Publish a generated layout, from the background writer if enabled and the current job can wait for it.
+    """
+    on_published = work_queue.defer_completion() if ENABLED else None
+    if on_published is None:
+        pos_to_readability_score.publish_layout(
+            pos_df=pos_df,
+            graph_tool_graph=graph_tool_graph,
+            layout_id=layout_id,
+            echo=False,
+            graph_file=graph_file,
+        )
+        return
+    get_layout_writer().submit(pos_df, graph_tool_graph, layout_id, on_published, graph_file)
@@ -0,0 +1,172 @@
+"""
+This script runs the whole GraphOptima inside a single process, for a workstation or one fat node.
+The optimizer, NUM_LAYOUT_GENERATOR layout generator threads and NUM_LAYOUT_EVALUATOR layout evaluator threads exchange
+params, positions and readability results through in-memory queues instead of .params, .dot and .result files. The
+queues serve the same client interface as the job broker, so combined_objective_func, DE and NSGA2 run unchanged; the
+DE and NSGA2 populations are evaluated by thread pools instead of process pools, see optimizer.py.
+GLAM is an external program that only reads files, so every evaluator writes the layout it checks to a private
+temporary folder under SCRATCH_DIRECTORY (tmpfs by default) for the duration of the run.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import threading
+import traceback
+import job_broker
+import utils
+import evaluation_record
+import multilevel
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+LAYOUT_GENERATOR = CONFIG["optimizer"]["LAYOUT_GENERATOR"]
+
+# Extract configurations for memory_pipeline
+CONFIG = CONFIG["memory_pipeline"]
+
+NUM_LAYOUT_GENERATOR = CONFIG["NUM_LAYOUT_GENERATOR"]
+NUM_LAYOUT_EVALUATOR = CONFIG["NUM_LAYOUT_EVALUATOR"]
+SCRATCH_DIRECTORY = CONFIG["SCRATCH_DIRECTORY"]
+
+
+class MemoryQueues:
+    """
+    Thread-safe in-process counterpart of job_broker.BrokerClient
+    """
+
+    def __init__(self):
+        self.queues = {name: collections.deque() for name in job_broker.QUEUE_NAMES}
+        self.results = {}
+        self.condition = threading.Condition()
+
+    def put(self, queue: str, uuid: str, payload):
+        with self.condition:
+            self.queues[queue].append((uuid, payload))
+            self.condition.notify_all()
+
+    def claim(self, queue: str, timeout: float = None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queues[queue], timeout):
+                return None
+            return self.queues[queue].popleft()
+
+    def ack(self, queue: str, uuid: str):
+        # a worker thread can't die without its job being reported by the thread itself, nothing to requeue
+        pass
+
+    def put_result(self, uuid: str, payload):
+        with self.condition:
+            self.results[uuid] = payload
+            self.condition.notify_all()
+
+    def get_result(self, uuid: str, timeout: float = None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: uuid in self.results, timeout):
+                raise TimeoutError(
+                    f"No readability result for layout {uuid} after {timeout} seconds"
+                )
+            return self.results.pop(uuid)
+
+    def depth(self) -> dict:
+        with self.condition:
+            depth = {name: len(queue) for name, queue in self.queues.items()}
+            depth["results"] = len(self.results)
+            return depth
+
+
+def import_layout_generator():
+    # the generator modules load the graph when imported
+    if LAYOUT_GENERATOR == "cuGraph":
+        import cuGraph_to_pos_df
+
+        return cuGraph_to_pos_df
+    if LAYOUT_GENERATOR == "graph-tool":
+        import gt_to_pos_df
+
+        return gt_to_pos_df
+    if LAYOUT_GENERATOR == "numba":
+        import fa2_to_pos_df
+
+        return fa2_to_pos_df
+    raise ValueError("Invalid layout_generator value: " + LAYOUT_GENERATOR)
+
+
+def layout_generator_worker(queues: MemoryQueues, layout_generator):
+    while True:
+        layout_id, params = queues.claim("params")
+        try:
+            layout_generator.process_params(layout_id, params)
+        except Exception:
+            # a failed result makes combined_objective_func retry the params, like a core dump of GLAM
+            traceback.print_exc()
+            queues.put_result(
+                layout_id, evaluation_record.pack(evaluation_record.failed_record())
+            )
+
+
+def layout_evaluator_worker(queues: MemoryQueues, graph_tool_graph):
+    import dot_to_readability_score
+    import layout_artifact
+
+    # the topology never changes, only the positions are written for each layout
+    edges = graph_tool_graph.get_edges()[:, :2]
+    num_vertices = graph_tool_graph.num_vertices()
+    while True:
+        layout_id, pos_df = queues.claim("layouts")
+        print(f"{utils.get_timestamp()}: Evaluating layout in memory: " + layout_id)
+        try:
+            with tempfile.TemporaryDirectory(dir=SCRATCH_DIRECTORY) as directory:
+                layout_artifact.positions_to_dot(
+                    positions=layout_artifact.pos_df_to_positions(pos_df, num_vertices),
+                    edges=edges,
+                    dot_path=os.path.join(directory, layout_id + ".dot"),
+                )
+                r = dot_to_readability_score.run_glam(
+                    os.path.join(directory, layout_id + ".dot")
+                )
+        except Exception:
+            traceback.print_exc()
+            r = evaluation_record.failed_record()
+        queues.put_result(layout_id, evaluation_record.pack(r))
+
+
+def main():
+    if multilevel.ENABLED:
+        raise ValueError(
+            "The in-memory evaluators only know the input graph, run the multilevel optimization with the "
+            "filesystem or broker transport instead"
+        )
+    queues = MemoryQueues()
+    # must happen before the optimizer is imported, as it picks its worker pools by transport
+    job_broker.TRANSPORT = "memory"
+    job_broker.IN_PROCESS_CLIENT = queues
+
+    layout_generator = import_layout_generator()
+    import optimizer
+
+    for _ in range(NUM_LAYOUT_GENERATOR):
+        threading.Thread(
+            target=layout_generator_worker,
+            args=(queues, layout_generator),
+            daemon=True,
+        ).start()
+    for _ in range(NUM_LAYOUT_EVALUATOR):
+        threading.Thread(
+            target=layout_evaluator_worker,
+            args=(queues, layout_generator.GRAPH_TOOL_GRAPH),
+            daemon=True,
+        ).start()
+    print(
+        f"{utils.get_timestamp()}: In-memory pipeline started with {NUM_LAYOUT_GENERATOR} layout generators and "
+        f"{NUM_LAYOUT_EVALUATOR} layout evaluators"
+    )
+
+    optimizer.run_optimization()
+
+
+if __name__ == "__main__":
+    main()
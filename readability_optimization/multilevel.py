@@ -0,0 +1,353 @@
+"""
+This module runs the optimization on a hierarchy of coarsened versions of the input graph, so that most param sets are
+screened on a small graph instead of costing a full layout and GLAM run on the input graph.
+
+The hierarchy is built once per graph under LEVEL_DIRECTORY/<graph name>/. Level 0 is the input graph itself, and every
+level after it coarsens the one before to at most COARSENING_FACTOR of its vertices, until NUM_LEVELS levels or
+MIN_VERTICES vertices. The METHOD of the coarsening is either
+1. "matching": heavy-edge matching, repeated until the level is small enough. Every matched pair of vertices becomes one
+vertex, and so does every unmatched leaf with its neighbour, which is what shrinks the trees and stars of scale-free
+graphs.
+2. "blockmodel": the nested stochastic blockmodel of graph-tool, every level being the blocks of a level of the nesting.
+Every level is a GraphML file (level_<k>.graphml) with the membership of the vertices of the finer level
+(level_<k>.membership.npy). hierarchy.json, written last, lists the levels and their sizes.
+
+combined_objective_func.multilevel_objective_func evaluates the params on the coarsest level first. They are promoted
+to the next finer level if they are among the best PROMOTION_FRACTION of the params evaluated on their level so far (or
+if fewer than MIN_EVALUATIONS_PER_LEVEL have been), and so on up to the input graph. The readability of params that
+aren't promoted is projected to the input graph by the ratio of the best readabilities of the two levels, which keeps
+them worse than the best layout of the input graph. The level goes to the layout generators as a 4th param, and every
+row of the database records its fidelity. Only the single-objective optimization (DE) is screened, NSGA2 and the
+verification evaluate every param set on the input graph.
+"""
+
+import argparse
+import json
+import math
+import os
+import numpy as np
+import graph_tool.all as gt
+from filelock import FileLock
+import graph_snapshot
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
+
+# Extract configurations for multilevel
+CONFIG = CONFIG["multilevel"]
+
+ENABLED = CONFIG["ENABLED"]
+METHOD = CONFIG["METHOD"]
+LEVEL_DIRECTORY = CONFIG["LEVEL_DIRECTORY"]
+NUM_LEVELS = CONFIG["NUM_LEVELS"]
+COARSENING_FACTOR = CONFIG["COARSENING_FACTOR"]
+MIN_VERTICES = CONFIG["MIN_VERTICES"]
+PROMOTION_FRACTION = CONFIG["PROMOTION_FRACTION"]
+MIN_EVALUATIONS_PER_LEVEL = CONFIG["MIN_EVALUATIONS_PER_LEVEL"]
+SEED = CONFIG["SEED"]
+
+VERSION = 1
+
+# a matching pass that shrinks the graph by less than this is the end of the hierarchy
+MIN_SHRINKAGE = 0.05
+
+
+def get_hierarchy_directory(graph_file: str = GRAPHML_FILE) -> str:
+    graph_name = os.path.splitext(os.path.basename(graph_file))[0]
+    return os.path.join(LEVEL_DIRECTORY, graph_name)
+
+
+def get_level_graph_file(level: int, graph_file: str = GRAPHML_FILE) -> str:
+    if level == 0:
+        return graph_file
+    return os.path.join(get_hierarchy_directory(graph_file), f"level_{level}.graphml")
+
+
+def contract(edges: np.ndarray, weights: np.ndarray, membership: np.ndarray) -> tuple:
+    """
+    Return the (edges, weights) of the graph with every vertex merged into its block of the membership. The edges
+    inside a block are dropped, and the parallel edges are merged into one with the sum of their weights.
+    """
+    coarse = membership[edges]
+    between = coarse[:, 0] != coarse[:, 1]
+    coarse, weights = coarse[between], weights[between]
+    if coarse.shape[0] == 0:
+        return np.empty((0, 2), dtype=np.int64), np.empty(0)
+    coarse.sort(axis=1)
+    coarse, inverse = np.unique(coarse, axis=0, return_inverse=True)
+    return coarse, np.bincount(inverse.ravel(), weights=weights)
+
+
+def match(edges: np.ndarray, weights: np.ndarray, num_vertices: int, rng) -> np.ndarray:
+    """
+    Return the membership of one heavy-edge matching pass over the graph, numbering the blocks from 0.
+    """
+    # the heaviest edges first, ties in random order
+    order = np.lexsort((rng.random(edges.shape[0]), -weights))
+    mate = [-1] * num_vertices
+    for u, v in edges[order].tolist():
+        if mate[u] < 0 and mate[v] < 0:
+            mate[u] = v
+            mate[v] = u
+    mate = np.array(mate, dtype=np.int64)
+    vertices = np.arange(num_vertices)
+    representative = np.where((mate >= 0) & (mate < vertices), mate, vertices)
+
+    # an unmatched leaf joins the block of its neighbour
+    degrees = np.bincount(edges.ravel(), minlength=num_vertices)
+    leaf_edges = edges[(degrees[edges[:, 0]] == 1) | (degrees[edges[:, 1]] == 1)]
+    for u, v in leaf_edges.tolist():
+        if degrees[u] != 1:
+            u, v = v, u
+        if mate[u] < 0 and degrees[v] != 1:
+            representative[u] = representative[v]
+
+    _, membership = np.unique(representative, return_inverse=True)
+    return membership.ravel()
+
+
+def coarsen_by_matching(edges: np.ndarray, num_vertices: int, target: int, rng) -> np.ndarray:
+    """
+    Return the membership of the graph coarsened by matching passes to at most target vertices, or as far as they go.
+    """
+    membership = np.arange(num_vertices)
+    weights = np.ones(edges.shape[0])
+    num_blocks = num_vertices
+    while num_blocks > target and edges.shape[0]:
+        step = match(edges, weights, num_blocks, rng)
+        num_step_blocks = int(step.max()) + 1
+        if num_step_blocks > num_blocks * (1 - MIN_SHRINKAGE):
+            break
+        edges, weights = contract(edges, weights, step)
+        membership = step[membership]
+        num_blocks = num_step_blocks
+    return membership
+
+
+def get_blockmodel_memberships(graph) -> list:
+    """
+    Return the membership of the vertices of the graph in the blocks of every level of its nested blockmodel.
+    """
+    state = gt.minimize_nested_blockmodel_dl(graph)
+    memberships = []
+    membership = np.arange(graph.num_vertices())
+    for bs in state.get_bs():
+        membership = np.asarray(bs)[membership]
+        _, compact = np.unique(membership, return_inverse=True)
+        memberships.append(compact.ravel())
+        if compact.max() == 0:
+            break
+    return memberships
+
+
+def build_hierarchy(graph_file: str = GRAPHML_FILE) -> dict:
+    directory = get_hierarchy_directory(graph_file)
+    os.makedirs(directory, exist_ok=True)
+    print(f"Building the {METHOD} hierarchy of {graph_file} in {directory} ...")
+    stamp = graph_snapshot.get_source_stamp(graph_file)
+    graph = graph_snapshot.load_graph_tool_graph(graph_file)
+    edges = graph.get_edges()[:, :2].astype(np.int64)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    rng = np.random.default_rng(SEED)
+
+    blockmodel_memberships = None
+    if METHOD == "blockmodel":
+        # from the input graph to the coarsest blocks
+        blockmodel_memberships = get_blockmodel_memberships(graph)
+    elif METHOD != "matching":
+        raise ValueError("Invalid multilevel METHOD value: " + METHOD)
+
+    levels = [
+        {
+            "level": 0,
+            "graph_file": graph_file,
+            "num_vertices": graph.num_vertices(),
+            "num_edges": graph.num_edges(),
+        }
+    ]
+    # the membership of the input vertices in the blocks of the last level
+    input_membership = np.arange(graph.num_vertices())
+    num_vertices = graph.num_vertices()
+    while len(levels) <= NUM_LEVELS and num_vertices > MIN_VERTICES:
+        target = max(int(num_vertices * COARSENING_FACTOR), MIN_VERTICES)
+        if METHOD == "matching":
+            membership = coarsen_by_matching(edges, num_vertices, target, rng)
+        else:
+            # the first nested level small enough, as seen from the last level
+            candidates = [
+                blocks for blocks in blockmodel_memberships if blocks.max() + 1 <= target
+            ]
+            if not candidates:
+                break
+            membership = np.zeros(num_vertices, dtype=np.int64)
+            membership[input_membership] = candidates[0]
+        num_blocks = int(membership.max()) + 1 if num_vertices else 0
+        if num_blocks > num_vertices * (1 - MIN_SHRINKAGE):
+            break
+        edges, _ = contract(edges, np.ones(edges.shape[0]), membership)
+        input_membership = membership[input_membership]
+        num_vertices = num_blocks
+
+        level = len(levels)
+        level_graph = gt.Graph(directed=False)
+        level_graph.add_vertex(num_vertices)
+        level_graph.add_edge_list(edges)
+        level_graph.save(get_level_graph_file(level, graph_file))
+        np.save(os.path.join(directory, f"level_{level}.membership.npy"), membership)
+        levels.append(
+            {
+                "level": level,
+                "graph_file": get_level_graph_file(level, graph_file),
+                "num_vertices": num_vertices,
+                "num_edges": int(edges.shape[0]),
+            }
+        )
+        print(f"Level {level}: {num_vertices} vertices, {edges.shape[0]} edges")
+
+    hierarchy = dict(stamp, version=VERSION, method=METHOD, source=graph_file, levels=levels)
+    # hidden name first, then an atomic rename, so that the hierarchy is complete once hierarchy.json is there
+    temporary_file = os.path.join(directory, ".hierarchy.json." + str(os.getpid()))
+    with open(temporary_file, "w") as f:
+        json.dump(hierarchy, f)
+    os.rename(temporary_file, os.path.join(directory, "hierarchy.json"))
+    return hierarchy
+
+
+def read_hierarchy(graph_file: str = GRAPHML_FILE) -> dict:
+    """
+    Return the hierarchy of the graph, or None if it is missing, incomplete or out of date.
+    """
+    try:
+        with open(os.path.join(get_hierarchy_directory(graph_file), "hierarchy.json")) as f:
+            hierarchy = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if hierarchy.get("version") != VERSION or hierarchy.get("method") != METHOD:
+        return None
+    stamp = graph_snapshot.get_source_stamp(graph_file)
+    if any(hierarchy.get(key) != value for key, value in stamp.items()):
+        return None
+    return hierarchy
+
+
+_HIERARCHY = None
+
+
+def ensure_hierarchy(graph_file: str = GRAPHML_FILE) -> dict:
+    """
+    Build the hierarchy of the graph unless an up-to-date one exists, and return it.
+    """
+    global _HIERARCHY
+    if _HIERARCHY is not None:
+        return _HIERARCHY
+    hierarchy = read_hierarchy(graph_file)
+    if hierarchy is None:
+        os.makedirs(LEVEL_DIRECTORY, exist_ok=True)
+        with FileLock(get_hierarchy_directory(graph_file) + ".lock"):
+            # another process may have built it while this one waited for the lock
+            hierarchy = read_hierarchy(graph_file)
+            if hierarchy is None:
+                hierarchy = build_hierarchy(graph_file)
+    _HIERARCHY = hierarchy
+    return hierarchy
+
+
+def get_screening_levels() -> list:
+    # the coarsest level first
+    return [level["level"] for level in ensure_hierarchy()["levels"][:0:-1]]
+
+
+def get_fidelity(level: int) -> dict:
+    """
+    Return the fidelity label of the database rows of the level.
+    """
+    level = ensure_hierarchy()["levels"][level]
+    return {
+        "level": level["level"],
+        "graph_file_name": os.path.basename(level["graph_file"]),
+        "num_vertices": level["num_vertices"],
+        "num_edges": level["num_edges"],
+    }
+
+
+def with_level(params: list, level: int) -> list:
+    # the params of the input graph stay as they are
+    if not level:
+        return params
+    return list(params) + [level]
+
+
+def get_level(params: list) -> int:
+    return int(params[3]) if len(params) > 3 else 0
+
+
+_LEVEL_GRAPHS = {}
+
+
+def load_level_graph(level: int):
+    """
+    Return the graph-tool graph of a coarse level, loaded once per process.
+    """
+    if level not in _LEVEL_GRAPHS:
+        _LEVEL_GRAPHS[level] = gt.load_graph(ensure_hierarchy()["levels"][level]["graph_file"])
+    return _LEVEL_GRAPHS[level]
+
+
+def get_row_level(metadata) -> int:
+    # the rows from before the multilevel optimization are of the input graph
+    if not isinstance(metadata, dict) or "fidelity" not in metadata:
+        return 0
+    return metadata["fidelity"]["level"]
+
+
+def select_level(database_object, level: int):
+    """
+    Return the rows of the database evaluated on the level.
+    """
+    if database_object.empty:
+        return database_object
+    return database_object[database_object["metadata"].apply(get_row_level) == level]
+
+
+def get_level_readabilities(database_object, level: int) -> list:
+    readabilities = select_level(database_object, level)["readability"]
+    return [
+        float(readability)
+        for readability in readabilities
+        if readability is not None and math.isfinite(float(readability))
+    ]
+
+
+def should_promote(level_readabilities: list, readability: float) -> bool:
+    """
+    Whether params with the readability on a level go on to the next finer level, given the readabilities of the
+    params evaluated on the level before them.
+    """
+    if readability is None or not math.isfinite(readability):
+        return False
+    if len(level_readabilities) < MIN_EVALUATIONS_PER_LEVEL:
+        return True
+    return readability <= np.quantile(level_readabilities, PROMOTION_FRACTION)
+
+
+def project(readability: float, level_readabilities: list, input_readabilities: list) -> float:
+    """
+    Return the readability of params that weren't promoted, projected to the input graph.
+    """
+    if not input_readabilities or not level_readabilities:
+        return readability
+    level_best = min(level_readabilities)
+    if level_best <= 0 or not math.isfinite(readability):
+        return max(input_readabilities)
+    # not promoted, so worse than the best of its level, and the projection worse than the best of the input graph
+    return min(input_readabilities) * max(readability / level_best, 1.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the coarsened hierarchy of a GraphML graph")
+    parser.add_argument("-i", "--input", default=GRAPHML_FILE, help="GraphML file of the graph")
+    args = parser.parse_args()
+    ensure_hierarchy(args.input)
@@ -69,7 +69,9 @@ def open_optimized_connection(database_path: str) -> sqlite3.Connection:
                 continue
 
             print(f"Opening connection to database at {database_path}.")
-            conn = sqlite3.connect(database_path)
+            # the in-memory pipeline shares the connection between threads, the access is serialized by
+            # combined_objective_func.DATABASE_LOCK
+            conn = sqlite3.connect(database_path, check_same_thread=False)
 
             # Enable optimizations
             print("Enabling database optimizations.")
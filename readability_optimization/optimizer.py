@@ -21,6 +21,7 @@ import numpy as np
 import optimization_database
 import reward
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from pymoo.core.problem import ElementwiseProblem
 from pymoo.core.problem import StarmapParallelization
 from pymoo.algorithms.moo.nsga2 import NSGA2
@@ -28,7 +29,12 @@ from pymoo.optimize import minimize
 from verify_optimized_params import verify_optimized_params
 import json
 import external_api
+import job_broker
+import batch_manifest
+import dispatch_scheduler
 import combined_objective_func
+import multilevel
+import early_abort
 import utils
 import time
 import shutil
@@ -116,14 +122,43 @@ class MyProblem(ElementwiseProblem):
         out["F"] = combined_objective_func.combined_objective_func(x)
 
 
+def use_batch_manifests() -> bool:
+    return job_broker.TRANSPORT == "filesystem" and batch_manifest.BATCH_SIZE > 1
+
+
+def get_num_workers(workers: int) -> int:
+    # same as scipy and multiprocessing: -1 or 0 for every core
+    return workers if workers > 0 else os.cpu_count()
+
+
 def get_problem_and_pool():
     pool = None
     # Create a pool of worker processes only when NSGA2 is true
-    if CONFIG["optimizer"]["NSGA2"]:
-        pool = Pool(
-            CONFIG["optimizer"]["multi_objective_optimization_params"]["workers"]
+    if CONFIG["optimizer"]["NSGA2"] and use_batch_manifests():
+        # the whole population is evaluated by threads of this process, so that it shares the same manifests
+        runner = batch_manifest.BatchMap(
+            max_workers=get_num_workers(
+                CONFIG["optimizer"]["multi_objective_optimization_params"]["workers"]
+            )
         )
-        runner = StarmapParallelization(pool.starmap)
+        if dispatch_scheduler.ENABLED:
+            runner = dispatch_scheduler.PriorityMap(runner)
+        problem = MyProblem(elementwise_runner=runner)
+    elif CONFIG["optimizer"]["NSGA2"]:
+        # the in-memory queues only exist in this process, so the population is evaluated by threads
+        pool_class = ThreadPool if job_broker.TRANSPORT == "memory" else Pool
+        pool = pool_class(
+            CONFIG["optimizer"]["multi_objective_optimization_params"]["workers"],
+            initializer=dispatch_scheduler.share_window,
+            initargs=(dispatch_scheduler.WINDOW.slots,),
+        )
+        if dispatch_scheduler.ENABLED:
+            # number the generations, so that the older ones are dispatched first
+            runner = StarmapParallelization(
+                dispatch_scheduler.PriorityMap(pool.starmap, starmap=True)
+            )
+        else:
+            runner = StarmapParallelization(pool.starmap)
         # Create the problem with the created pool
         problem = MyProblem(elementwise_runner=runner)
     else:
@@ -136,17 +171,67 @@ def get_problem_and_pool():
 # Set MULTI_OBJECTIVE_OPTIMIZATION_PROBLEM and pool
 MULTI_OBJECTIVE_OPTIMIZATION_PROBLEM, pool = get_problem_and_pool()
 
+DIFFERENTIAL_EVOLUTION_THREAD_POOL = None
+DIFFERENTIAL_EVOLUTION_POOL = None
+
+
+def get_differential_evolution_workers():
+    workers = get_population_map()
+    if dispatch_scheduler.ENABLED:
+        # number the generations, so that the older ones are dispatched first
+        if isinstance(workers, int):
+            workers = get_differential_evolution_pool_map(workers)
+        return dispatch_scheduler.PriorityMap(workers)
+    return workers
+
+
+def get_differential_evolution_pool_map(workers: int):
+    global DIFFERENTIAL_EVOLUTION_POOL
+    if workers == 1:
+        return map
+    # the pool scipy would create for an int workers, made here so that the calls can be wrapped
+    if DIFFERENTIAL_EVOLUTION_POOL is None:
+        # the pool processes share the in-flight window of this process
+        DIFFERENTIAL_EVOLUTION_POOL = Pool(
+            workers if workers > 0 else os.cpu_count(),
+            initializer=dispatch_scheduler.share_window,
+            initargs=(dispatch_scheduler.WINDOW.slots,),
+        )
+    return DIFFERENTIAL_EVOLUTION_POOL.map
+
+
+def get_population_map():
+    global DIFFERENTIAL_EVOLUTION_THREAD_POOL
+    workers = DIFFERENTIAL_OPTIMIZATION_PARAMS["workers"]
+    if use_batch_manifests():
+        return batch_manifest.BatchMap(max_workers=get_num_workers(workers))
+    if job_broker.TRANSPORT != "memory" or workers == 1:
+        return workers
+    # same as NSGA2: with the in-memory queues, the population must be evaluated by threads of this process
+    if DIFFERENTIAL_EVOLUTION_THREAD_POOL is None:
+        DIFFERENTIAL_EVOLUTION_THREAD_POOL = ThreadPool(
+            workers if workers > 0 else os.cpu_count()
+        )
+    return DIFFERENTIAL_EVOLUTION_THREAD_POOL.map
+
+
+def get_objective_func():
+    # the coarse levels of the graph screen the params before the input graph, see multilevel.py
+    if multilevel.ENABLED:
+        return combined_objective_func.multilevel_objective_func
+    return combined_objective_func.combined_objective_func
+
 
 def optimize_global_cuGraph():
     global_optimization_result = differential_evolution(
-        func=combined_objective_func.combined_objective_func,
+        func=get_objective_func(),
         bounds=BOUNDS,
         strategy=DIFFERENTIAL_OPTIMIZATION_PARAMS["strategy"],
         maxiter=int(OPTIMIZATION_BUDGET),
         disp=DIFFERENTIAL_OPTIMIZATION_PARAMS["disp"],
         x0=INITIAL_GUESS,
         seed=DIFFERENTIAL_OPTIMIZATION_PARAMS["seed"],
-        workers=DIFFERENTIAL_OPTIMIZATION_PARAMS["workers"],
+        workers=get_differential_evolution_workers(),
     )
     return global_optimization_result
 
@@ -211,7 +296,6 @@ def explore_pareto_front_with_weighted_sum_scalarization(weights_list: list):
                     f"results with substitution.\n\n"
                 )
 
-        combined_objective_func.CORE_DUMP = 0
         combined_objective_func.EVAL_COUNTER = 0
         reward.update_weights(
             crosslessness_weight=weights[0],
@@ -272,6 +356,8 @@ def explore_pareto_front_with_weighted_sum_scalarization(weights_list: list):
 
         remove_lock_files()
 
+        remove_retry_counters()
+
         rename_the_optimization_database_to_weighted_database(weights)
 
         combined_objective_func.CONN = optimization_database.open_optimized_connection(
@@ -332,10 +418,20 @@ def multi_objective_optimize_with_NSGA2(problem=MULTI_OBJECTIVE_OPTIMIZATION_PRO
     return res
 
 
-if __name__ == "__main__":
+def run_optimization():
     remove_optimization_completed_indicator_file()
+    if early_abort.ENABLED:
+        # the incumbent of an earlier run would abort the layouts of this one
+        early_abort.remove_incumbent()
+    if multilevel.ENABLED:
+        # built before the worker pools start, so that they all read the same hierarchy
+        multilevel.ensure_hierarchy()
     if CONFIG["optimizer"]["SCALARIZATION"]:
         explore_pareto_front_with_weighted_sum_scalarization(weights_list=WEIGHT_LIST)
     if CONFIG["optimizer"]["NSGA2"]:
         multi_objective_optimize_with_NSGA2()
     write_optimization_completed_indicator_file()
+
+
+if __name__ == "__main__":
+    run_optimization()
@@ -2,11 +2,34 @@ import time
 import pandas as pd
 import os
 import re
+import tempfile
+import threading
+import reward
 from utils import *
+import work_watcher
+import work_queue
+import job_broker
+import layout_artifact
+import work_shards
+import layout_staging
+import shared_positions
+import evaluation_record
+import dispatch_scheduler
+import layout_check
 
+RESULT_TIMEOUT = work_watcher.CONFIG["RESULT_TIMEOUT"]
 
-def pos2dot(pos_df: pd.DataFrame, graph_tool_graph, output_name, echo=False):
+# the uuids whose results were records of aborted layouts, until combined_objective_func asks, see pop_aborted
+_ABORTED_LAYOUTS = set()
+_ABORTED_LAYOUTS_LOCK = threading.Lock()
+
+
+def pos2dot(
+    pos_df: pd.DataFrame, graph_tool_graph, output_name, echo=False, directory="."
+):
     g = graph_tool_graph
+    to_check_path = os.path.join(directory, "to_check_" + output_name)
+    output_path = os.path.join(directory, output_name)
 
     x_pos = g.new_vertex_property("double")
     y_pos = g.new_vertex_property("double")
@@ -36,7 +59,7 @@ def pos2dot(pos_df: pd.DataFrame, graph_tool_graph, output_name, echo=False):
     for p in properties_to_remove:
         del g.edge_properties[p]
 
-    g.save("to_check_" + output_name)
+    g.save(to_check_path)
 
     # convert the last line of the to_check dot file into a string and print it
     # with open("to_check_" + output_name, 'rb+') as f:
@@ -45,7 +68,7 @@ def pos2dot(pos_df: pd.DataFrame, graph_tool_graph, output_name, echo=False):
     #     print(f"The last line of 'to_check_{output_name}' is: {repr(last_line)}")
     #     time.sleep(10)
 
-    with open("to_check_" + output_name, "rb+") as f:
+    with open(to_check_path, "rb+") as f:
         # print("Checking if the last line of 'to_check_" + output_name + "' has a '}'")
         # time.sleep(10)
         f.seek(-1, os.SEEK_END)  # Go to the end of file
@@ -67,13 +90,129 @@ def pos2dot(pos_df: pd.DataFrame, graph_tool_graph, output_name, echo=False):
     # ------------------------------------------------------------------------------------
 
     # remove the "to_check_" prefix
-    os.rename("to_check_" + output_name, output_name)
+    os.rename(to_check_path, output_path)
 
     # copy and rename the file
     # shutil.copyfile("to_check_" + output_name, output_name)
 
     if echo:
-        print("Graph saved to " + output_name)
+        print("Graph saved to " + output_path)
+
+
+def publish_layout(
+    pos_df: pd.DataFrame,
+    graph_tool_graph,
+    layout_id: str,
+    echo=False,
+    graph_file: str = layout_artifact.GRAPHML_FILE,
+):
+    """
+    Hand a generated layout over to the layout evaluators through the configured transport
+    graph_file names the topology of the binary layouts, which is another one for a coarse level, see multilevel.py
+    """
+    if layout_check.ENABLED:
+        # only the vertices of the layout, cuGraph leaves the isolated ones out and pos2dot puts them at 0.0
+        reason = layout_check.find_degeneracy(pos_df[["x", "y"]].to_numpy(dtype=float))
+        if reason is not None:
+            # GLAM would only waste its time on the layout, or dump core
+            print(f"Layout {layout_id} is degenerate ({reason}), publishing the penalty without evaluating it")
+            publish_record(layout_id, evaluation_record.penalty_record())
+            return
+
+    if job_broker.TRANSPORT == "memory":
+        # the evaluator threads of memory_pipeline.py take the positions as they are
+        job_broker.get_client().put("layouts", layout_id, pos_df)
+        return
+
+    if job_broker.TRANSPORT == "broker":
+        # the DOT file only lives in a private temporary folder, its content travels through the broker
+        with tempfile.TemporaryDirectory() as directory:
+            pos2dot(
+                pos_df=pos_df,
+                graph_tool_graph=graph_tool_graph,
+                output_name=layout_id + ".dot",
+                echo=echo,
+                directory=directory,
+            )
+            with open(os.path.join(directory, layout_id + ".dot")) as f:
+                job_broker.get_client().put("layouts", layout_id, f.read())
+        return
+
+    if shared_positions.ENABLED and shared_positions.has_local_evaluator():
+        # an evaluator of this node reads the positions straight from shared memory
+        shared_positions.publish_positions(
+            layout_id=layout_id,
+            positions=layout_artifact.pos_df_to_positions(
+                pos_df, graph_tool_graph.num_vertices()
+            ),
+            topology_path=layout_artifact.ensure_topology(graph_tool_graph, graph_file),
+        )
+        if echo:
+            print("Layout shared in memory: " + layout_id)
+        return
+
+    if layout_staging.ENABLED:
+        # the layout stays on the scratch directory of this node, only its handoff record goes to the shared tree
+        directory = layout_staging.get_scratch_directory()
+        if layout_artifact.FORMAT == "binary":
+            path = os.path.join(directory, layout_id + ".positions.npy")
+            layout_artifact.write_positions(
+                path,
+                layout_artifact.pos_df_to_positions(pos_df, graph_tool_graph.num_vertices()),
+            )
+            topology = layout_artifact.ensure_topology(graph_tool_graph, graph_file)
+        else:
+            pos2dot(
+                pos_df=pos_df,
+                graph_tool_graph=graph_tool_graph,
+                output_name=layout_id + ".dot",
+                echo=echo,
+                directory=directory,
+            )
+            path = os.path.join(directory, layout_id + ".dot")
+            topology = None
+        layout_staging.publish_record(layout_id, layout_artifact.FORMAT, path, topology)
+        return
+
+    if layout_artifact.FORMAT == "binary":
+        # only the coordinates are written, the evaluator turns them into a DOT file for GLAM on demand
+        layout_artifact.write_layout(
+            directory=work_shards.get_job_directory("layout", layout_id),
+            layout_id=layout_id,
+            positions=layout_artifact.pos_df_to_positions(
+                pos_df, graph_tool_graph.num_vertices()
+            ),
+            topology_path=layout_artifact.ensure_topology(graph_tool_graph, graph_file),
+        )
+        if echo:
+            print("Layout saved to " + layout_id + ".layout")
+        return
+
+    pos2dot(
+        pos_df=pos_df,
+        graph_tool_graph=graph_tool_graph,
+        output_name=layout_id + ".dot",
+        echo=echo,
+        directory=work_shards.get_job_directory("dot", layout_id),
+    )
+
+
+def publish_record(layout_id: str, record: evaluation_record.EvaluationRecord):
+    """
+    Hand the result of a layout straight to the optimizer through the configured transport, without evaluating it,
+    e.g. for a layout the generator aborted
+    """
+    # the optimizer waits on the plain uuid, without the priority of the job name
+    uuid = dispatch_scheduler.get_layout_uuid(layout_id)
+    if job_broker.TRANSPORT == "memory":
+        job_broker.get_client().put_result(uuid, evaluation_record.pack(record))
+        return
+
+    if job_broker.TRANSPORT == "broker":
+        job_broker.get_client().put_result(uuid, evaluation_record.to_payload(record))
+        return
+
+    work_queue.publish_result_record(uuid, record)
 
 
 def retrieve_readability_score_and_cleanup(
@@ -81,49 +220,74 @@ def retrieve_readability_score_and_cleanup(
     retrieve_directory: str = os.getcwd() + "/readability_score_results",
     echo: bool = False,
     cleanup: bool = True,
+    timeout: float = RESULT_TIMEOUT,
 ):
-    # logic: keep scanning the target folder until specific uuid is found
-    # Challenge: first in first out - ignore for now
-    result = []
-    while not result:
+    if job_broker.TRANSPORT != "filesystem":
+        # the evaluator publishes the evaluation record straight to the queues, there is no file to clean up
         if echo:
-            # print("Retrieving readability scores for layout " + uuid + ' ......')
-            # time.sleep(1)
-            pass
-        result = retrieve_file_list(
-            retrieve_directory=retrieve_directory,
-            endswith=uuid + ".txt",
-            startswith="",
-            not_startswith=".",
+            print("Retrieving readability scores for layout " + uuid + " ......")
+        payload = job_broker.get_client().get_result(uuid, timeout=timeout)
+        return record_to_readability_metrics(
+            evaluation_record.from_payload(payload), echo=echo, uuid=uuid
         )
 
-    with open(retrieve_directory + "/" + result[0]) as f:
-        content = f.read()
-        # display the content of the file
-        if echo:
-            print("From the txt file: " + content)
-        readability_metrics_string_list = content.split()
+    # logic: block on the shared result waiter of this process until the specific uuid is found. One watcher thread
+    # serves every in-flight layout, so waiting costs no CPU and one directory listing per backoff period
+    if echo:
+        print("Retrieving readability scores for layout " + uuid + " ......")
+    result_path = work_watcher.get_result_waiter(retrieve_directory).wait_for(
+        uuid, timeout=timeout
+    )
+    if result_path is None:
+        # the wait is cancelled, there is no result to return
+        return []
 
-    readability_metrics = []
+    readability_metrics = record_to_readability_metrics(
+        evaluation_record.read_result_file(result_path), echo=echo, uuid=uuid
+    )
 
-    if readability_metrics_string_list:
-        for i in range(5, len(readability_metrics_string_list)):
-            readability_metrics_string = readability_metrics_string_list[i]
-            # find all the numbers in the string
-            readability_metrics_num = re.findall(
-                r"[-+]?(?:\d*\.\d+|\d+)", readability_metrics_string
-            )
-            for n in readability_metrics_num:
-                readability_metrics.append(n)
+    if cleanup:
+        os.remove(result_path)
+    return readability_metrics
 
-    if echo or len(readability_metrics) != 7:
-        print("retrieve_readability_score_and_cleanup: " + str(readability_metrics))
 
-    if cleanup:
-        os.remove(retrieve_directory + "/" + result[0])
+def record_to_readability_metrics(
+    record: evaluation_record.EvaluationRecord, echo: bool = False, uuid: str = None
+) -> list:
+    """
+    Return the list of readability metrics of an evaluation record, see evaluation_record.to_glam_results
+    The uuid of a record of an aborted layout is remembered for pop_aborted.
+    """
+    readability_metrics = evaluation_record.to_glam_results(record)
+    if uuid is not None and record.status == evaluation_record.STATUS_ABORTED:
+        with _ABORTED_LAYOUTS_LOCK:
+            _ABORTED_LAYOUTS.add(uuid)
+
+    if echo or record.status != evaluation_record.STATUS_OK:
+        print(
+            "retrieve_readability_score_and_cleanup: status "
+            + str(record.status)
+            + ", "
+            + str(readability_metrics)
+            + " after "
+            + str(record.seconds)
+            + " seconds of GLAM"
+        )
+
     return readability_metrics
 
 
+def pop_aborted(uuid: str) -> bool:
+    """
+    Return whether the retrieved result of the layout was projected by early_abort.py rather than measured by GLAM.
+    """
+    with _ABORTED_LAYOUTS_LOCK:
+        if uuid in _ABORTED_LAYOUTS:
+            _ABORTED_LAYOUTS.remove(uuid)
+            return True
+    return False
+
+
 # return dataframe from csv
 def csv_to_df(csv_file):
     df = pd.read_csv(csv_file)
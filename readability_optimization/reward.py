@@ -15,6 +15,12 @@ MIN_ANGLE_WEIGHT = CONFIG["reward"]["MIN_ANGLE_WEIGHT"]
 SHAPE_DELAUNAY_WEIGHT = CONFIG["reward"]["SHAPE_DELAUNAY_WEIGHT"]
 SHAPE_GABRIEL_WEIGHT = CONFIG["reward"]["SHAPE_GABRIEL_WEIGHT"]
 
+MAX_VAL = 999999
+
+# the GLAM readability metrics given to a layout that can't be evaluated: no crosslessness, no angular resolution and
+# the largest edge length variations, which is the worst possible reward under any weighting scheme
+PENALTY_GLAM_RESULTS = [0, MAX_VAL, MAX_VAL, MAX_VAL, 0, 0, 0]
+
 
 def update_weights(
     crosslessness_weight=CROSSLESSNESS_WEIGHT,
@@ -40,7 +46,8 @@ def update_weights(
 
 def fix_negative_val_to_sci_notation_from_GLAM(current_glam_results: list):
     negative_index = []
-    # 7 is the number of metrics returned by GLAM
+    # 7 is the number of metrics returned by GLAM. The evaluation records (see evaluation_record.py) always hold exactly
+    # 7 floats, only the glam results of older database rows can still have the exponents split off
     if 7 != len(current_glam_results):
         # 1. scan array to find the negative val
         # 2. check if the vals are after min angle
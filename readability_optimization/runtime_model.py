@@ -0,0 +1,149 @@
+"""
+This module predicts how long a layout job takes from the timings the layout generators and evaluators record, so that
+the dispatch scheduler can start the longest jobs of a generation first (longest processing time first). A generation
+then doesn't end with one long max_iter layout running alone while the other workers sit idle at the barrier.
+
+Every worker appends one JSON line per job to its own file under TIMING_DIRECTORY:
+1. the layout generators record the "layout" stage with the params of the layout
+2. the layout evaluators record the "glam" stage, which is matched to the params through the layout id
+
+The optimizer reads the new lines every REFIT_INTERVAL seconds and fits one least-squares model per stage on
+[1, max_iter, log(1 + scaling_ratio), log(1 + gravity)], over the last HISTORY_SIZE timings of the stage. The
+predicted runtime of a job is the sum of both stages. Until MIN_SAMPLES timings of both stages are available, there is no
+prediction, and the jobs of a generation are dispatched in submission order.
+"""
+
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import numpy as np
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for runtime_model
+CONFIG = CONFIG["runtime_model"]
+
+ENABLED = CONFIG["ENABLED"]
+TIMING_DIRECTORY = CONFIG["TIMING_DIRECTORY"]
+REFIT_INTERVAL = CONFIG["REFIT_INTERVAL"]
+MIN_SAMPLES = CONFIG["MIN_SAMPLES"]
+HISTORY_SIZE = CONFIG["HISTORY_SIZE"]
+
+STAGES = ("layout", "glam")
+
+_RECORD_LOCK = threading.Lock()
+
+
+def record_timing(stage: str, layout_id: str, seconds: float, params: list = None):
+    """
+    Append the runtime of a job of the given stage to the timing file of this worker.
+    """
+    if not ENABLED:
+        return
+    line = json.dumps(
+        {
+            "stage": stage,
+            "layout_id": layout_id,
+            "seconds": seconds,
+            "params": None if params is None else [float(param) for param in params],
+        }
+    )
+    os.makedirs(TIMING_DIRECTORY, exist_ok=True)
+    # one file per worker, so the lines of different processes never interleave
+    timing_file = os.path.join(
+        TIMING_DIRECTORY, socket.gethostname() + "-" + str(os.getpid()) + ".jsonl"
+    )
+    with _RECORD_LOCK:
+        with open(timing_file, "a") as f:
+            f.write(line + "\n")
+
+
+def get_features(params: list) -> np.ndarray:
+    return np.array(
+        [1.0, float(params[2]), np.log1p(max(params[0], 0)), np.log1p(max(params[1], 0))]
+    )
+
+
+class RuntimeModel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # read position in every timing file
+        self.offsets = {}
+        # layout id -> params, from the layout stage, of the latest layouts only
+        self.params = collections.OrderedDict()
+        # stage -> (layout id, seconds) of the last HISTORY_SIZE jobs
+        self.samples = {stage: collections.deque(maxlen=HISTORY_SIZE) for stage in STAGES}
+        self.coefficients = {stage: None for stage in STAGES}
+        self.last_fit = float("-inf")
+
+    def _read_new_timings(self):
+        try:
+            names = os.listdir(TIMING_DIRECTORY)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(TIMING_DIRECTORY, name)
+            with open(path) as f:
+                f.seek(self.offsets.get(path, 0))
+                for line in f:
+                    if not line.endswith("\n"):
+                        # the worker is still writing this line, read it next time
+                        break
+                    self.offsets[path] = self.offsets.get(path, 0) + len(line.encode())
+                    timing = json.loads(line)
+                    if timing["params"] is not None:
+                        self.params[timing["layout_id"]] = timing["params"]
+                        # the glam timing of a layout comes after its layout timing, keep room for both windows
+                        while len(self.params) > 2 * HISTORY_SIZE:
+                            self.params.popitem(last=False)
+                    if timing["stage"] in self.samples:
+                        self.samples[timing["stage"]].append(
+                            (timing["layout_id"], timing["seconds"])
+                        )
+
+    def fit(self):
+        self._read_new_timings()
+        for stage in STAGES:
+            rows = [
+                (get_features(self.params[layout_id]), seconds)
+                for layout_id, seconds in self.samples[stage]
+                if layout_id in self.params
+            ]
+            if len(rows) < MIN_SAMPLES:
+                continue
+            features = np.array([row[0] for row in rows])
+            seconds = np.array([row[1] for row in rows])
+            self.coefficients[stage] = np.linalg.lstsq(features, seconds, rcond=None)[0]
+        self.last_fit = time.monotonic()
+
+    def predict(self, params: list) -> float:
+        """
+        Return the predicted runtime (in seconds) of a layout job, or None before enough timings are recorded.
+        """
+        with self.lock:
+            if time.monotonic() - self.last_fit >= REFIT_INTERVAL:
+                self.fit()
+            features = get_features(params)
+            if any(coefficients is None for coefficients in self.coefficients.values()):
+                # an iteration count would sort apart from the seconds of the fitted predictions
+                return None
+            return float(
+                sum(
+                    max(features @ coefficients, 0.0)
+                    for coefficients in self.coefficients.values()
+                )
+            )
+
+
+_MODEL = RuntimeModel()
+
+
+def predict(params: list) -> float:
+    return _MODEL.predict(params)
@@ -0,0 +1,12 @@
+#!/bin/bash
+#SBATCH --account=def-primath
+#SBATCH --ntasks=1
+#SBATCH --cpus-per-task=48
+#SBATCH --mem=16G
+#SBATCH --time=3:59:59
+#SBATCH --job-name=layout_generator
+
+module load apptainer
+
+# the numba ForceAtlas2 generator only needs CPUs, so it runs on the CPU partitions without --nv
+srun singularity exec -B $SCRATCH $SCRATCH/netviz/readability_optimization/singularity/netviz-graham-v10.sif bash $SCRATCH/netviz/readability_optimization/layout_generator.sh
@@ -0,0 +1,238 @@
+"""
+This module lets a layout generator hand its positions to a layout evaluator on the same node through
+multiprocessing.shared_memory, instead of writing them to a file on the shared filesystem.
+
+The generator copies the position array of a layout into a shared memory segment named after the layout id, and
+publishes a small <uuid>.shm record to HANDOFF_DIRECTORY, a node-local directory. The evaluators of the node watch that
+directory, claim a record by renaming it to <uuid>.shm.claimed-<pid>, and read the positions straight from the segment.
+The generator only does so while a live evaluator is registered on the node, and falls back to the configured
+filesystem handoff otherwise.
+
+A segment belongs to the record, not to a process: neither side lets the resource tracker of Python unlink it at exit.
+The evaluator that finishes a layout unlinks its segment. If that evaluator dies first, its pid is gone, so the next idle
+evaluator of the node puts the record back, and the segment is still there for the next attempt.
+A record has a lease of LEASE seconds. When no live evaluator is left on the node (e.g. the last one reached the time
+limit of its Slurm job), or a record is still unclaimed after its lease, an idle generator of the node takes it back and
+republishes its positions as a binary layout artifact to the shared queue, where any evaluator can claim it, see
+republish_orphans. The records are node-local, so nobody else could.
+"""
+
+import contextlib
+import json
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import layout_artifact
+import work_queue
+import work_shards
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for shared_positions
+CONFIG = CONFIG["shared_positions"]
+
+ENABLED = CONFIG["ENABLED"]
+HANDOFF_DIRECTORY = CONFIG["HANDOFF_DIRECTORY"]
+LEASE = CONFIG["LEASE"]
+
+CLAIMED_SUFFIX = ".claimed-"
+
+
+def get_handoff_directory() -> str:
+    os.makedirs(os.path.join(HANDOFF_DIRECTORY, "evaluators"), exist_ok=True)
+    return HANDOFF_DIRECTORY
+
+
+def get_segment_name(layout_id: str) -> str:
+    return "graphoptima_" + layout_id
+
+
+def _untrack(segment: shared_memory.SharedMemory):
+    # the resource tracker would unlink the segment when this process exits, whoever still needs it
+    resource_tracker.unregister(segment._name, "shared_memory")
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def register_evaluator():
+    """
+    Announce the current process as an evaluator of this node, see has_local_evaluator.
+    """
+    open(os.path.join(get_handoff_directory(), "evaluators", str(os.getpid())), "w").close()
+
+
+def has_local_evaluator() -> bool:
+    evaluator_directory = os.path.join(get_handoff_directory(), "evaluators")
+    found = False
+    for name in os.listdir(evaluator_directory):
+        if _is_alive(int(name)):
+            found = True
+        else:
+            try:
+                os.remove(os.path.join(evaluator_directory, name))
+            except FileNotFoundError:
+                pass
+    return found
+
+
+def publish_positions(layout_id: str, positions: np.ndarray, topology_path: str) -> str:
+    """
+    Copy the positions into a new shared memory segment and publish its record. Return the path of the record.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float32)
+    segment = shared_memory.SharedMemory(
+        name=get_segment_name(layout_id), create=True, size=max(positions.nbytes, 1)
+    )
+    _untrack(segment)
+    np.ndarray(positions.shape, dtype=np.float32, buffer=segment.buf)[:] = positions
+    segment.close()
+
+    record = {
+        "layout_id": layout_id,
+        "segment": get_segment_name(layout_id),
+        "shape": list(positions.shape),
+        "topology": os.path.abspath(topology_path),
+        "published": time.time(),
+    }
+    directory = get_handoff_directory()
+    record_path = os.path.join(directory, layout_id + ".shm")
+    temporary_path = os.path.join(directory, "." + layout_id + ".shm_temp")
+    with open(temporary_path, "w") as f:
+        json.dump(record, f)
+    os.rename(temporary_path, record_path)
+    return record_path
+
+
+def read_record(record_file: str) -> dict:
+    with open(record_file) as f:
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def attach(record: dict):
+    """
+    Yield the positions of a record as an array backed by its segment, without copying them.
+    Raise FileNotFoundError if the segment doesn't exist anymore.
+    """
+    segment = shared_memory.SharedMemory(name=record["segment"])
+    _untrack(segment)
+    try:
+        positions = np.ndarray(tuple(record["shape"]), dtype=np.float32, buffer=segment.buf)
+        yield positions
+        del positions
+    finally:
+        try:
+            segment.close()
+        except BufferError:
+            # the caller still holds a view, the mapping is closed when the segment is garbage collected
+            pass
+
+
+def release(record: dict):
+    try:
+        segment = shared_memory.SharedMemory(name=record["segment"])
+    except FileNotFoundError:
+        return
+    segment.close()
+    # unlink also takes the segment off the resource tracker
+    segment.unlink()
+
+
+def claim_and_process(record_file: str, process, debug_print=print) -> bool:
+    """
+    Claim a record of this node by renaming it, run process(path) on it, then release its segment. Return True if the
+    record was claimed by this process.
+    """
+    claimed_file = record_file + CLAIMED_SUFFIX + str(os.getpid())
+    try:
+        os.rename(record_file, claimed_file)
+    except FileNotFoundError:
+        debug_print(f"File {record_file} is claimed by another worker, skipping...")
+        return False
+    debug_print(f"Claimed: {record_file}")
+    record = read_record(claimed_file)
+    try:
+        process(claimed_file)
+    finally:
+        # the segment and the record go, whether the layout was evaluated or not
+        release(record)
+        os.remove(claimed_file)
+    debug_print(f"Finished processing file: {record_file}")
+    return True
+
+
+def republish_orphans(debug_print=print) -> int:
+    """
+    Take back the records of this node that no evaluator will process: all the unclaimed records and the records of
+    dead evaluators if no live evaluator is left, otherwise the unclaimed records whose lease ran out. Their positions
+    are republished to the shared queue as layout artifacts. Return how many were republished.
+    """
+    directory = get_handoff_directory()
+    no_evaluator = not has_local_evaluator()
+    republished = 0
+    for name in os.listdir(directory):
+        record_name, _, pid = name.rpartition(CLAIMED_SUFFIX)
+        if record_name:
+            # a claim of a live evaluator is its own, requeue_dead_claims puts back the others while one is left
+            if not no_evaluator or _is_alive(int(pid)):
+                continue
+        elif not name.endswith(".shm"):
+            continue
+        path = os.path.join(directory, name)
+        claimed_file = os.path.join(directory, (record_name or name) + CLAIMED_SUFFIX + str(os.getpid()))
+        try:
+            if not no_evaluator and time.time() - read_record(path).get("published", 0) < LEASE:
+                continue
+            os.rename(path, claimed_file)
+        except (FileNotFoundError, ValueError):
+            # claimed meanwhile, or not completely written yet
+            continue
+        record = read_record(claimed_file)
+        debug_print(f"No local evaluator took layout {record['layout_id']}, republishing it to the shared queue")
+        try:
+            with attach(record) as positions:
+                layout_artifact.write_layout(
+                    directory=work_shards.get_job_directory("layout", record["layout_id"]),
+                    layout_id=record["layout_id"],
+                    positions=positions,
+                    topology_path=record["topology"],
+                )
+        except FileNotFoundError:
+            # the segment is gone, e.g. the evaluator died right after removing it, don't let the optimizer wait
+            work_queue.publish_penalty_result(
+                record["layout_id"], "shared memory segment not found"
+            )
+        release(record)
+        os.remove(claimed_file)
+        republished += 1
+    return republished
+
+
+def requeue_dead_claims(debug_print=print) -> int:
+    """
+    Put back the records claimed by evaluators of this node that died. Return how many were requeued.
+    """
+    requeued = 0
+    directory = get_handoff_directory()
+    for name in os.listdir(directory):
+        record_name, _, pid = name.rpartition(CLAIMED_SUFFIX)
+        if not record_name or _is_alive(int(pid)):
+            continue
+        debug_print(f"Evaluator {pid} died while holding {record_name}, requeueing")
+        try:
+            os.rename(os.path.join(directory, name), os.path.join(directory, record_name))
+        except FileNotFoundError:
+            continue
+        requeued += 1
+    return requeued
@@ -0,0 +1,225 @@
+"""
+This module keeps a slow layout from holding up a whole DE or NSGA2 generation. The optimizer records how long every
+evaluation takes from its params until its readability result, and judges the evaluations still running against that
+running latency distribution instead of a fixed timeout. The latencies are kept per fidelity level (see multilevel.py),
+as the layouts of a coarse level take a fraction of the time of the ones of the input graph.
+
+1. An evaluation running longer than STRAGGLER_FACTOR times the median latency is a straggler. With SPECULATE, and as
+long as no params are waiting in the queue (so a layout generator is idle), the same params are submitted once more
+under a new layout id, with the priority of the original. Whichever of both results arrives first is used.
+2. An evaluation running longer than DEADLINE_FACTOR times the median latency gets the penalty GLAM results instead.
+
+The results that arrive after the evaluation is decided are removed in the background. Until MIN_SAMPLES latencies are
+recorded, evaluations are never judged. The decision is returned to combined_objective_func, which records it in the
+metadata of the database row.
+"""
+
+import collections
+import json
+import os
+import statistics
+import threading
+import time
+import evaluation_record
+import job_broker
+import multilevel
+import pos_to_readability_score
+import reward
+import work_watcher
+from utils import generate_layout_id, make_params_file
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for straggler_monitor
+CONFIG = CONFIG["straggler_monitor"]
+
+ENABLED = CONFIG["ENABLED"]
+STRAGGLER_FACTOR = CONFIG["STRAGGLER_FACTOR"]
+SPECULATE = CONFIG["SPECULATE"]
+DEADLINE_FACTOR = CONFIG["DEADLINE_FACTOR"]
+PENALTY_GLAM_RESULTS = CONFIG["PENALTY_GLAM_RESULTS"] or reward.PENALTY_GLAM_RESULTS
+MIN_SAMPLES = CONFIG["MIN_SAMPLES"]
+HISTORY_SIZE = CONFIG["HISTORY_SIZE"]
+CHECK_INTERVAL = CONFIG["CHECK_INTERVAL"]
+
+RESULT_DIRECTORY = os.getcwd() + "/readability_score_results"
+
+# how many CHECK_INTERVAL rounds the results of abandoned layouts are waited for without a RESULT_TIMEOUT
+MAX_DISCARD_ROUNDS = 120
+
+
+class LatencyHistory:
+    """
+    The latencies (in seconds) of the last HISTORY_SIZE evaluations of one fidelity level in this process.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=size)
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def limit(self, factor: float) -> float:
+        """
+        Return factor times the median latency, or None without a factor or before MIN_SAMPLES latencies.
+        """
+        with self.lock:
+            if factor is None or len(self.latencies) < MIN_SAMPLES:
+                return None
+            return factor * statistics.median(self.latencies)
+
+
+# the latency history of every fidelity level, by level
+HISTORIES = collections.defaultdict(LatencyHistory)
+HISTORIES_LOCK = threading.Lock()
+
+
+def get_history(level: int = 0) -> LatencyHistory:
+    with HISTORIES_LOCK:
+        return HISTORIES[level]
+
+
+def has_idle_generator() -> bool:
+    if job_broker.TRANSPORT != "filesystem":
+        return job_broker.get_client().depth().get("params", 0) == 0
+    return (
+        work_watcher.count_jobs(endswith=".params", stage="params") == 0
+        and work_watcher.count_jobs(endswith=".batch", stage="batch") == 0
+    )
+
+
+def _wait_for_any(layout_ids: list, timeout: float) -> tuple:
+    """
+    Return (layout id, evaluation record) of the first of the layouts to finish within the timeout, or (None, None).
+    """
+    if job_broker.TRANSPORT != "filesystem":
+        # the broker waits on one result at a time, so the time is split between the layouts
+        for layout_id in layout_ids:
+            try:
+                return layout_id, evaluation_record.from_payload(
+                    job_broker.get_client().get_result(
+                        layout_id, timeout=timeout / len(layout_ids)
+                    )
+                )
+            except TimeoutError:
+                continue
+        return None, None
+    try:
+        layout_id, result_path = work_watcher.get_result_waiter(
+            RESULT_DIRECTORY
+        ).wait_for_any(layout_ids, timeout=timeout)
+    except TimeoutError:
+        return None, None
+    if result_path is None:
+        return None, None
+    record = evaluation_record.read_result_file(result_path)
+    os.remove(result_path)
+    return layout_id, record
+
+
+def _discard(layout_ids: list):
+    # the results of the abandoned layouts still show up once their workers are done, don't leave them behind
+    # but a result may never come, e.g. for a lost job, so give up after a while
+    timeout = pos_to_readability_score.RESULT_TIMEOUT
+    if timeout is None:
+        timeout = MAX_DISCARD_ROUNDS * CHECK_INTERVAL
+    deadline = time.monotonic() + timeout
+    layout_ids = list(layout_ids)
+    while layout_ids and time.monotonic() < deadline:
+        layout_id, _ = _wait_for_any(
+            layout_ids, timeout=min(CHECK_INTERVAL, max(deadline - time.monotonic(), 0))
+        )
+        if layout_id is not None:
+            layout_ids.remove(layout_id)
+
+
+def discard_later(layout_ids: list):
+    if layout_ids:
+        threading.Thread(target=_discard, args=(layout_ids,), daemon=True).start()
+
+
+def retrieve(layout_id: str, params: list, priority: str = None) -> tuple:
+    """
+    Wait for the readability results of a layout whose params are already submitted, speculating on or penalizing it
+    if it straggles. Return (results, decision), where decision is None for an evaluation that was never judged a
+    straggler, and otherwise a dict describing what was done.
+    """
+    if not ENABLED:
+        results = pos_to_readability_score.retrieve_readability_score_and_cleanup(
+            uuid=layout_id, cleanup=True, echo=True
+        )
+        return results, None
+
+    print("Retrieving readability scores for layout " + layout_id + " ......")
+    history = get_history(multilevel.get_level(params))
+    start_time = time.monotonic()
+    layout_ids = [layout_id]
+    decision = None
+    while True:
+        elapsed = time.monotonic() - start_time
+        straggler_limit = history.limit(STRAGGLER_FACTOR)
+        deadline = history.limit(DEADLINE_FACTOR)
+
+        if (
+            pos_to_readability_score.RESULT_TIMEOUT is not None
+            and elapsed >= pos_to_readability_score.RESULT_TIMEOUT
+        ):
+            discard_later(layout_ids[1:])
+            raise TimeoutError(
+                f"No readability result for layout {layout_id} after {elapsed} seconds"
+            )
+        if deadline is not None and elapsed >= deadline:
+            print(
+                f"Layout {layout_id} is still running after {elapsed:.1f} seconds (deadline {deadline:.1f}), "
+                "returning the penalty"
+            )
+            discard_later(layout_ids)
+            decision = dict(decision or {}, action="penalty", deadline=deadline)
+            decision["latency"] = elapsed
+            return [float(metric) for metric in PENALTY_GLAM_RESULTS], decision
+
+        if (
+            SPECULATE
+            and straggler_limit is not None
+            and elapsed >= straggler_limit
+            and len(layout_ids) == 1
+            and has_idle_generator()
+        ):
+            duplicate_id = generate_layout_id()
+            print(
+                f"Layout {layout_id} is a straggler after {elapsed:.1f} seconds (limit {straggler_limit:.1f}), "
+                f"speculating with {duplicate_id}"
+            )
+            make_params_file(uuid=duplicate_id, params=list(params), priority=priority)
+            layout_ids.append(duplicate_id)
+            decision = {
+                "action": "speculated",
+                "duplicate": duplicate_id,
+                "straggler_limit": straggler_limit,
+                "speculated_after": elapsed,
+            }
+
+        # wake up at the next point where the evaluation has to be judged again
+        timeout = CHECK_INTERVAL
+        for limit in (straggler_limit, deadline, pos_to_readability_score.RESULT_TIMEOUT):
+            if limit is not None and limit > elapsed:
+                timeout = min(timeout, limit - elapsed)
+        finished_id, record = _wait_for_any(layout_ids, timeout=timeout)
+        if finished_id is None:
+            continue
+
+        latency = time.monotonic() - start_time
+        history.record(latency)
+        layout_ids.remove(finished_id)
+        discard_later(layout_ids)
+        if decision is not None:
+            decision["winner"] = "original" if finished_id == layout_id else "duplicate"
+            decision["latency"] = latency
+        results = pos_to_readability_score.record_to_readability_metrics(
+            record, echo=True, uuid=finished_id
+        )
+        return results, decision
@@ -7,11 +7,18 @@ import matplotlib.pyplot as plt
 from pymoo.visualization.scatter import Scatter
 import json
 import pandas as pd
+import job_broker
+import batch_manifest
+import work_shards
+import dispatch_scheduler
+import evaluation_record
 
 # Load configuration from JSON file
 with open("config.json") as f:
     CONFIG = json.load(f)
 
+INBOX_DIRECTORY = CONFIG["work_queue"]["INBOX_DIRECTORY"]
+
 # Extract configurations for external_api
 CONFIG = CONFIG["external_api"]
 
@@ -29,29 +36,44 @@ def generate_layout_id() -> str:
     return layout_id
 
 
-def make_params_file(uuid: str, params: list):
+def make_params_file(uuid: str, params: list, priority: str = None) -> str:
     """
     make a .params file with the given params
     the .params file will be caught and locked by the layout generators, thus achieving async multiprocessing
+    with the broker or memory transport, the params are put into the params queue instead of a file
+    with batch_manifest.BATCH_SIZE above 1, the params are collected into .batch manifests instead
+    with a priority from dispatch_scheduler, the file name starts with it, and the name of the layout job is returned
     """
     # if param2 is not int, turn it into int
     if type(params[2]) is not int:
         params[2] = int(params[2])
 
+    if job_broker.TRANSPORT != "filesystem":
+        job_broker.get_client().put(
+            "params", uuid, [float(param) for param in params]
+        )
+        return uuid
+
+    job_name = dispatch_scheduler.make_job_name(uuid, priority)
+
+    if batch_manifest.BATCH_SIZE > 1:
+        batch_manifest.get_collector().add(
+            job_name, [float(param) for param in params], priority
+        )
+        return job_name
+
+    # the params file goes to the shard of its layout job, which is the working directory without sharding
+    params_file = os.path.join(work_shards.get_job_directory("params", job_name), job_name)
+
     # save the params into a comma seperated .params_temp file
     # this is to ensure that the params file won't be caught before the writing is finished
-    with open(uuid + ".params_temp", "w") as f:
-        # loop through the params
-        for param in params:
-            # check, if the current param is the last one, don't add the comma
-            if param == params[-1]:
-                f.write(str(param))
-                break
-            # write the params into the file
-            f.write(str(param) + ",")
+    with open(params_file + ".params_temp", "w") as f:
+        # by position rather than by value, as a param may be equal to the last one, e.g. the multilevel level
+        f.write(",".join(str(param) for param in params))
 
     # rename the .params_temp file to .params using **atomic operation**
-    os.rename(uuid + ".params_temp", uuid + ".params")
+    os.rename(params_file + ".params_temp", params_file + ".params")
+    return job_name
 
 
 def make_new_metadata(
@@ -119,39 +141,54 @@ def remove_core_dump_files():
                 pass
 
 
-# remove all the txt files under the readability_score_results folder of the current directory
+# remove all the result files under the readability_score_results folder of the current directory, and its shards
 def remove_readability_score_results():
     # get the current working directory
     current_dir = os.getcwd()
     # get all the files under the readability_score_results folder
     current_dir = os.path.join(current_dir, "readability_score_results/")
-    files = os.listdir(current_dir)
-    # loop through the files
-    for file in files:
-        # check if the file is a core dump file
-        if file.endswith(".txt"):
-            # remove the file
-            try:
-                os.remove(file)
-            except FileNotFoundError:
-                pass
-
-
-# remove all the .lock files under the current directory
+    for directory in work_shards.get_result_directories(current_dir):
+        # loop through the files
+        for file in os.listdir(directory):
+            # check if the file is a result file
+            if file.endswith(evaluation_record.RESULT_EXTENSION):
+                # remove the file
+                try:
+                    os.remove(os.path.join(directory, file))
+                except FileNotFoundError:
+                    pass
+
+
+# remove all the .lock files under the current directory, and the shards of the queue
 def remove_lock_files():
-    # get the current working directory
-    current_dir = os.getcwd()
-    # get all the files in the current directory
-    files = os.listdir(current_dir)
-    # loop through the files
-    for file in files:
-        # check if the file is a lock file
-        if file.endswith(".lock"):
-            # remove the file
-            try:
-                os.remove(file)
-            except FileNotFoundError:
-                pass
+    # the lock files sit next to the job files they lock
+    directories = [os.getcwd()]
+    for stage in ("params", "batch", "dot", "layout", "staged"):
+        for directory in work_shards.get_stage_directories(stage):
+            if directory != ".":
+                directories.append(directory)
+    for directory in directories:
+        # loop through the files
+        for file in os.listdir(directory):
+            # check if the file is a lock file
+            if file.endswith(".lock"):
+                # remove the file
+                try:
+                    os.remove(os.path.join(directory, file))
+                except FileNotFoundError:
+                    pass
+
+
+# remove the requeue counters of the layouts, see work_queue.requeue_expired_leases
+def remove_retry_counters():
+    retry_directory = os.path.join(os.getcwd(), INBOX_DIRECTORY, "retries")
+    if not os.path.isdir(retry_directory):
+        return
+    for file in os.listdir(retry_directory):
+        try:
+            os.remove(os.path.join(retry_directory, file))
+        except FileNotFoundError:
+            pass
 
 
 # write an optimization completed indicator file to the current directory
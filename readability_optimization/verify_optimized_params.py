@@ -7,6 +7,11 @@ import pygraphviz as pgv
 import pandas as pd
 import uuid
 import json
+import job_broker
+import layout_artifact
+import work_shards
+import dispatch_scheduler
+import graph_snapshot
 from utils import *
 import graph_tool.all as gt
 
@@ -15,7 +20,7 @@ with open("config.json") as f:
     CONFIG = json.load(f)
 
 GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
-GRAPH_TOOL_GRAPH = gt.load_graph(GRAPHML_FILE)
+GRAPH_TOOL_GRAPH = graph_snapshot.load_graph_tool_graph(GRAPHML_FILE)
 REPEAT_EVAL_TIMES = CONFIG["verify_optimized_params"]["REPEAT_EVAL_TIMES"]
 
 logging.basicConfig(
@@ -124,9 +129,38 @@ def display_average_improvement(
     logging.info("Improvement: " + str(improvement_percentage) + "%")
 
 
+# load a binary layout artifact into a position dataframe
+def layout_to_pos_df(layout_file: str):
+    # if the file doesn't exist, keep trying
+    while not os.path.exists(layout_file):
+        time.sleep(1)
+    df = layout_artifact.layout_to_pos_df(layout_file)
+
+    # remove the layout artifact
+    layout_artifact.remove_layout(layout_file)
+
+    return df
+
+
 def make_params_file_and_retrieve_pos_df(uuid, param0, param1, param2):
-    make_params_file(uuid=uuid, params=[param0, param1, param2])
-    return dot_to_pos_df(dot_file=uuid + ".dot")
+    priority = None
+    if dispatch_scheduler.ENABLED:
+        # the plotted layouts are verification runs too
+        with dispatch_scheduler.verification():
+            priority = dispatch_scheduler.make_priority()
+    # the layout files are named after the job, which carries the priority
+    job_name = make_params_file(uuid=uuid, params=[param0, param1, param2], priority=priority)
+    if layout_artifact.FORMAT == "binary":
+        return layout_to_pos_df(
+            layout_file=os.path.join(
+                work_shards.get_job_directory("layout", job_name), job_name + ".layout"
+            )
+        )
+    return dot_to_pos_df(
+        dot_file=os.path.join(
+            work_shards.get_job_directory("dot", job_name), job_name + ".dot"
+        )
+    )
 
 
 def plot_initial_and_optimized_layout(
@@ -136,6 +170,15 @@ def plot_initial_and_optimized_layout(
     initial_layout_plot_name="initial_layout",
     optimized_layout_plot_name="optimized_layout",
 ):
+    if job_broker.TRANSPORT != "filesystem":
+        # the layouts are only exchanged as .dot files in the working directory with the filesystem transport
+        logging.info(
+            "Skipping the layout plots, they are not supported with the "
+            + job_broker.TRANSPORT
+            + " transport"
+        )
+        return
+
     initial_pos_df = make_params_file_and_retrieve_pos_df(
         uuid=str(uuid.uuid4()),
         param0=initial_params[0],
@@ -173,15 +216,17 @@ def verify_optimized_params(
     weight2=1,
     weight3=1,
 ):
-    best_readability_array, generated_readability_array, initial_readability_array = (
-        make_correlation_array(
-            n=REPEAT_EVAL_TIMES,
-            optimal_params_from_optimizer=best_params,
-            best_readability_from_optimizer=best_readability,
-            initial_guess_params=initial_guess_params,
-            func=func,
+    # the verification runs jump ahead of the optimization runs still queued
+    with dispatch_scheduler.verification():
+        best_readability_array, generated_readability_array, initial_readability_array = (
+            make_correlation_array(
+                n=REPEAT_EVAL_TIMES,
+                optimal_params_from_optimizer=best_params,
+                best_readability_from_optimizer=best_readability,
+                initial_guess_params=initial_guess_params,
+                func=func,
+            )
         )
-    )
 
     average_optimized_readability, average_initial_readability = (
         get_average_initial_and_optimized_readability(
@@ -0,0 +1,231 @@
+"""
+This module lets the layout generators start a layout from the archived layout whose params are nearest, instead of
+from random positions. Nearby param vectors converge to similar layouts, so a warm-started layout needs fewer
+iterations to settle.
+
+The cache lives under CACHE_DIRECTORY/<graph name>/, so the layouts of different graphs never mix:
+1. <layout id>.npy holds the (n, 2) float32 positions of an archived layout
+2. every generator appends one JSON line per layout to its own index file, <host>-<pid>.jsonl, with the params of the
+layout, the layout it was warm-started from, and whether its positions are archived
+
+The distance between two param vectors is measured with every param scaled by the width of its optimizer BOUNDS. A
+layout is warm-started from the nearest archived one within MAX_DISTANCE, and runs WARM_ITERATION_FRACTION of its
+max_iter from there. A layout is only archived if no archived one lies within ARCHIVE_SPACING, which bounds the size of
+the cache by how densely the optimizer covers the param space.
+A vertex without finite positions is archived at 0.0, where pos2dot and layout_artifact.pos_df_to_positions put the
+isolated vertices cuGraph leaves out of its layouts.
+The optimizer reads the index as well, to record the warm-start status of every layout in the database.
+"""
+
+import json
+import os
+import socket
+import threading
+import numpy as np
+import dispatch_scheduler
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+GRAPHML_FILE = CONFIG["layout_generator"]["GRAPHML_FILE"]
+BOUNDS = CONFIG["optimizer"]["BOUNDS"]
+
+# Extract configurations for warm_start
+CONFIG = CONFIG["warm_start"]
+
+ENABLED = CONFIG["ENABLED"]
+CACHE_DIRECTORY = CONFIG["CACHE_DIRECTORY"]
+MAX_DISTANCE = CONFIG["MAX_DISTANCE"]
+ARCHIVE_SPACING = CONFIG["ARCHIVE_SPACING"]
+WARM_ITERATION_FRACTION = CONFIG["WARM_ITERATION_FRACTION"]
+
+
+def get_cache_directory(graph_file: str = GRAPHML_FILE) -> str:
+    graph_name = os.path.splitext(os.path.basename(graph_file))[0]
+    directory = os.path.join(CACHE_DIRECTORY, graph_name)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def normalize(params: list) -> np.ndarray:
+    return np.array(
+        [
+            (float(param) - low) / ((high - low) or 1.0)
+            for param, (low, high) in zip(params, BOUNDS)
+        ]
+    )
+
+
+def fill_missing(positions: np.ndarray) -> np.ndarray:
+    """
+    Return the positions with the NaN vertices at 0.0, or None for a layout without a single finite vertex.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    missing = np.isnan(positions).any(axis=1)
+    if missing.all():
+        return None
+    positions = positions.copy()
+    positions[missing] = 0.0
+    return positions
+
+
+class WarmStartCache:
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # read position in every index file
+        self.offsets = {}
+        # layout id -> index entry
+        self.entries = {}
+        # ids and normalized params of the archived layouts
+        self.archived_ids = []
+        self.archived_params = []
+
+    def _get_directory(self) -> str:
+        if self.directory is None:
+            self.directory = get_cache_directory()
+        return self.directory
+
+    def _read_new_entries(self):
+        directory = self._get_directory()
+        for name in os.listdir(directory):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(directory, name)
+            with open(path) as f:
+                f.seek(self.offsets.get(path, 0))
+                for line in f:
+                    if not line.endswith("\n"):
+                        # the generator is still writing this line, read it next time
+                        break
+                    self.offsets[path] = self.offsets.get(path, 0) + len(line.encode())
+                    entry = json.loads(line)
+                    self.entries[entry["layout_id"]] = entry
+                    if entry["archived"]:
+                        self.archived_ids.append(entry["layout_id"])
+                        self.archived_params.append(normalize(entry["params"]))
+
+    def find_nearest(self, params: list) -> tuple:
+        """
+        Return (layout id, distance) of the archived layout nearest to the params, or (None, inf) if there is none.
+        """
+        with self.lock:
+            self._read_new_entries()
+            if not self.archived_ids:
+                return None, float("inf")
+            distances = np.linalg.norm(
+                np.array(self.archived_params) - normalize(params), axis=1
+            )
+            nearest = int(np.argmin(distances))
+            return self.archived_ids[nearest], float(distances[nearest])
+
+    def get_status(self, layout_id: str) -> dict:
+        with self.lock:
+            self._read_new_entries()
+            entry = self.entries.get(dispatch_scheduler.get_layout_uuid(layout_id))
+        if entry is None:
+            return None
+        return {
+            key: entry[key] for key in ("warm_start_from", "distance", "iterations")
+        }
+
+    def load_positions(self, layout_id: str, num_vertices: int) -> np.ndarray:
+        """
+        Return the archived positions of a layout, or None if they are gone or don't fit the graph.
+        """
+        try:
+            positions = np.load(os.path.join(self._get_directory(), layout_id + ".npy"))
+        except (FileNotFoundError, ValueError):
+            return None
+        if positions.shape != (num_vertices, 2):
+            return None
+        positions = fill_missing(positions)
+        if positions is None or not np.isfinite(positions).all():
+            return None
+        return positions
+
+    def archive(
+        self,
+        layout_id: str,
+        params: list,
+        positions: np.ndarray,
+        warm_start_from: str = None,
+        distance: float = None,
+        iterations: int = None,
+    ):
+        """
+        Record a generated layout in the index of this worker, and archive its positions unless an archived layout is
+        within ARCHIVE_SPACING of its params.
+        """
+        layout_id = dispatch_scheduler.get_layout_uuid(layout_id)
+        directory = self._get_directory()
+        _, nearest_distance = self.find_nearest(params)
+        positions = fill_missing(positions)
+        archived = (
+            nearest_distance > ARCHIVE_SPACING
+            and positions is not None
+            and np.isfinite(positions).all()
+        )
+        if archived:
+            # hidden name first, then an atomic rename, like every other file of the queue
+            temporary_path = os.path.join(directory, "." + layout_id + ".npy")
+            np.save(temporary_path, np.asarray(positions, dtype=np.float32))
+            os.rename(temporary_path, os.path.join(directory, layout_id + ".npy"))
+        line = json.dumps(
+            {
+                "layout_id": layout_id,
+                "params": [float(param) for param in params],
+                "archived": bool(archived),
+                "warm_start_from": warm_start_from,
+                "distance": distance,
+                "iterations": iterations,
+            }
+        )
+        # one file per worker, so the lines of different processes never interleave
+        index_file = os.path.join(
+            directory, socket.gethostname() + "-" + str(os.getpid()) + ".jsonl"
+        )
+        with self.lock:
+            with open(index_file, "a") as f:
+                f.write(line + "\n")
+
+
+_CACHE = WarmStartCache()
+
+
+def get_initial_positions(params: list, num_vertices: int) -> tuple:
+    """
+    Return (positions, source layout id, distance, max_iter) for a layout of the given params: the archived positions
+    to start from and the reduced max_iter, or (None, None, None, max_iter) for a cold start.
+    """
+    max_iter = int(params[2])
+    if not ENABLED:
+        return None, None, None, max_iter
+    layout_id, distance = _CACHE.find_nearest(params)
+    if layout_id is None or distance > MAX_DISTANCE:
+        return None, None, None, max_iter
+    positions = _CACHE.load_positions(layout_id, num_vertices)
+    if positions is None:
+        return None, None, None, max_iter
+    return positions, layout_id, distance, max(1, int(round(max_iter * WARM_ITERATION_FRACTION)))
+
+
+def archive(
+    layout_id: str,
+    params: list,
+    positions: np.ndarray,
+    warm_start_from: str = None,
+    distance: float = None,
+    iterations: int = None,
+):
+    if ENABLED:
+        _CACHE.archive(layout_id, params, positions, warm_start_from, distance, iterations)
+
+
+def get_status(layout_id: str) -> dict:
+    """
+    Return the warm-start status of a generated layout: the layout it started from (None for a cold start), the
+    normalized param distance to it and the iterations it ran, or None if the layout isn't in the index.
+    """
+    return _CACHE.get_status(layout_id)
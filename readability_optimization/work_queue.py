@@ -0,0 +1,368 @@
+"""
+This module implements how the layout generators and the layout evaluator claim the job files (.params, .dot, ...) of the
+shared-filesystem queue. Two claim protocols are available:
+
+1. "rename": a worker takes a job with a single os.rename into its own inbox directory. Only the first rename of a
+file can succeed, so no lock file is needed, and a job can never be half-claimed. Finishing the job is one unlink.
+2. "filelock": the original protocol, which locks <file>.lock, processes the file, renames it to <file>_processed,
+unlocks and finally deletes both files.
+
+The inboxes live under INBOX_DIRECTORY/<stage>/<worker id>, which must be on the same filesystem as the working
+directory for the rename to be atomic.
+
+A job claimed by rename holds a lease: the worker touches the claimed file every HEARTBEAT_INTERVAL seconds while it
+works on it, so a file whose mtime is older than LEASE_DURATION belongs to a dead worker (e.g. killed by Slurm on walltime
+or OOM). Any idle worker, and the GraphOptima.py supervisor, moves such files back to the queue. A layout
+is requeued at most MAX_REQUEUE times; after that a penalty result is published so that the optimizer doesn't wait
+forever on it.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from filelock import FileLock, Timeout
+import layout_artifact
+import work_shards
+import dispatch_scheduler
+import evaluation_record
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for work_queue
+CONFIG = CONFIG["work_queue"]
+
+CLAIM_PROTOCOL = CONFIG["CLAIM_PROTOCOL"]
+INBOX_DIRECTORY = CONFIG["INBOX_DIRECTORY"]
+LEASE_DURATION = CONFIG["LEASE_DURATION"]
+HEARTBEAT_INTERVAL = CONFIG["HEARTBEAT_INTERVAL"]
+MAX_REQUEUE = CONFIG["MAX_REQUEUE"]
+
+# number of times each layout has been requeued, one small file per layout id
+RETRY_DIRECTORY = os.path.join(INBOX_DIRECTORY, "retries")
+RESULT_DIRECTORY = "readability_score_results"
+
+# the job file extension of each stage
+STAGES = {
+    "params": ".params",
+    "batch": ".batch",
+    "dot": ".dot",
+    "layout": ".layout",
+    "staged": ".staged",
+}
+INBOXES = {}
+LAST_LEASE_CHECK = {}
+
+
+def get_worker_id() -> str:
+    # unique across the nodes of a cluster and across the restarts of a worker on the same node
+    return socket.gethostname() + "-" + str(os.getpid())
+
+
+def get_inbox(stage: str) -> str:
+    """
+    Return (and create) the inbox directory of the current worker for the given stage, e.g. "params" or "dot".
+    """
+    inbox = INBOXES.get(stage)
+    if inbox is None:
+        inbox = os.path.join(INBOX_DIRECTORY, stage, get_worker_id())
+        os.makedirs(inbox, exist_ok=True)
+        INBOXES[stage] = inbox
+    return inbox
+
+
+def claim(job_file: str, inbox: str):
+    """
+    Move the job file into the inbox. Return the new path of the file, or None if another worker got it first.
+    """
+    claimed_file = os.path.join(inbox, os.path.basename(job_file))
+    try:
+        os.rename(job_file, claimed_file)
+    except FileNotFoundError:
+        if os.path.isdir(inbox):
+            return None
+        # the inbox was cleaned up while this worker looked dead, recreate it and try again
+        os.makedirs(inbox, exist_ok=True)
+        try:
+            os.rename(job_file, claimed_file)
+        except FileNotFoundError:
+            return None
+    # the rename keeps the mtime the producer gave the file, start the lease now
+    os.utime(claimed_file)
+    return claimed_file
+
+
+class Heartbeat:
+    """
+    Keep renewing the lease of a claimed file from a background thread for as long as the with block runs.
+    """
+
+    def __init__(self, claimed_file: str, interval: float = HEARTBEAT_INTERVAL):
+        self.claimed_file = claimed_file
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.claimed_file)
+            except FileNotFoundError:
+                # the lease has expired and the job was requeued, nothing left to renew
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def publish_penalty_result(uuid: str, reason: str):
+    """
+    Publish a result for a layout that can't be evaluated, which the optimizer turns into the maximum penalty.
+    """
+    # the record has no room for the reason, it only shows up in the output of the worker
+    print(f"Publishing a penalty result for layout {dispatch_scheduler.get_layout_uuid(uuid)}: {reason}")
+    publish_result_record(uuid, evaluation_record.penalty_record())
+
+
+def publish_result_record(uuid: str, record: evaluation_record.EvaluationRecord):
+    """
+    Publish the result of a layout that isn't evaluated by GLAM, e.g. a penalty or an aborted layout.
+    """
+    # the optimizer waits on the plain uuid, without the priority of the job name
+    uuid = dispatch_scheduler.get_layout_uuid(uuid)
+    result_directory = work_shards.get_result_directory(uuid, RESULT_DIRECTORY)
+    temporary_file = os.path.join(result_directory, "." + uuid + ".record")
+    evaluation_record.write_result_file(temporary_file, record)
+    os.rename(
+        temporary_file,
+        os.path.join(result_directory, uuid + evaluation_record.RESULT_EXTENSION),
+    )
+
+
+def _count_requeue(uuid: str) -> int:
+    # only the worker whose rename to its own .expired-<worker id> name succeeded gets here, see requeue_expired_leases,
+    # so the read-modify-write doesn't race
+    os.makedirs(RETRY_DIRECTORY, exist_ok=True)
+    retry_file = os.path.join(RETRY_DIRECTORY, uuid)
+    try:
+        with open(retry_file) as f:
+            count = int(f.read() or 0)
+    except FileNotFoundError:
+        count = 0
+    count += 1
+    with open(retry_file, "w") as f:
+        f.write(str(count))
+    return count
+
+
+def requeue_expired_leases(stage: str, debug_print=print) -> int:
+    """
+    Move the jobs of the given stage held by dead workers back to the queue. Return how many were requeued.
+    """
+    stage_directory = os.path.join(INBOX_DIRECTORY, stage)
+    if not os.path.isdir(stage_directory):
+        return 0
+    requeued = 0
+    now = time.time()
+    for worker_id in os.listdir(stage_directory):
+        inbox = os.path.join(stage_directory, worker_id)
+        try:
+            claimed_files = os.listdir(inbox)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        dead_inbox = False
+        for name in claimed_files:
+            claimed_file = os.path.join(inbox, name)
+            # a requeuing worker that died halfway leaves a .expired-<worker id> file behind, which is picked up again
+            # here once its lease runs out too
+            name = name.split(".expired", 1)[0]
+            expired_file = os.path.join(inbox, name + ".expired-" + get_worker_id())
+            try:
+                if now - os.stat(claimed_file).st_mtime < LEASE_DURATION:
+                    continue
+                # the name is unique to this worker, so the rename only succeeds for one requeuing worker
+                os.rename(claimed_file, expired_file)
+                # and the other workers leave the file alone while this one requeues it
+                os.utime(expired_file)
+            except FileNotFoundError:
+                continue
+            dead_inbox = True
+            uuid = name[: -len(STAGES[stage])]
+            count = _count_requeue(uuid)
+            if count > MAX_REQUEUE:
+                debug_print(
+                    f"Lease of {name} held by {worker_id} expired {count} times, publishing a penalty result"
+                )
+                reason = f"the {stage} job was requeued more than {MAX_REQUEUE} times"
+                if stage == "batch":
+                    # a batch manifest is named after its batch id, the layouts are its items
+                    with open(expired_file) as f:
+                        for item in json.load(f)["items"]:
+                            publish_penalty_result(item["uuid"], reason)
+                else:
+                    publish_penalty_result(uuid, reason)
+                if stage == "layout":
+                    # the positions of a binary layout sit next to the queue, not in the inbox
+                    layout_artifact.remove_layout(expired_file)
+                complete(expired_file)
+                continue
+            debug_print(
+                f"Lease of {name} held by {worker_id} expired, requeueing ({count}/{MAX_REQUEUE})"
+            )
+            try:
+                os.rename(
+                    expired_file,
+                    os.path.join(work_shards.get_job_directory(stage, uuid), name),
+                )
+            except FileNotFoundError:
+                # the file is gone, there is nothing left to requeue
+                continue
+            requeued += 1
+        if dead_inbox:
+            try:
+                # the inbox of a dead worker is empty now, unless the worker is alive after all
+                os.rmdir(inbox)
+            except OSError:
+                pass
+    return requeued
+
+
+def maybe_requeue_expired_leases(stage: str, debug_print=print) -> int:
+    """
+    Same as requeue_expired_leases, but scan the inboxes at most once per HEARTBEAT_INTERVAL in this process.
+    """
+    if CLAIM_PROTOCOL != "rename":
+        return 0
+    now = time.monotonic()
+    if now - LAST_LEASE_CHECK.get(stage, float("-inf")) < HEARTBEAT_INTERVAL:
+        return 0
+    LAST_LEASE_CHECK[stage] = now
+    return requeue_expired_leases(stage, debug_print)
+
+
+def complete(claimed_file: str):
+    try:
+        os.remove(claimed_file)
+    except FileNotFoundError:
+        pass
+
+
+class ClaimedJob:
+    """
+    A job claimed by rename whose output may still be published after process() returns, see defer_completion. The
+    job is completed, and its lease released, once process() and every deferred publication are done, or left to
+    expire if any of them failed.
+    """
+
+    def __init__(self, claimed_file: str, heartbeat: Heartbeat):
+        self.claimed_file = claimed_file
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        # process() itself holds the first reference
+        self.pending = 1
+        self.failed = False
+
+    def defer(self):
+        with self.lock:
+            self.pending += 1
+        return self.release
+
+    def release(self, succeeded: bool = True):
+        with self.lock:
+            self.pending -= 1
+            self.failed = self.failed or not succeeded
+            if self.pending:
+                return
+        self.heartbeat.__exit__()
+        if not self.failed:
+            complete(self.claimed_file)
+
+
+_CURRENT_JOB = threading.local()
+
+
+def defer_completion():
+    """
+    Called from the process() of claim_and_process, to publish part of the output of the job after process() returns.
+    Return the function to call with whether the publication succeeded, or None if the job can't be deferred (the
+    filelock protocol, or no job claimed by this thread), in which case the output has to be published right away.
+    """
+    job = getattr(_CURRENT_JOB, "job", None)
+    if job is None:
+        return None
+    return job.defer()
+
+
+def _handle_failed_process(job_file: str, stage: str, debug_print=print):
+    # a job process() gave up on, e.g. unparsable params, is done with: the optimizer gets a penalty instead of waiting
+    debug_print(f"Failed to process {stage} file: {job_file}")
+    publish_penalty_result(
+        os.path.splitext(os.path.basename(job_file))[0],
+        f"the {stage} file can't be processed",
+    )
+
+
+def claim_and_process(job_file: str, stage: str, process, debug_print=print) -> bool:
+    """
+    Try to claim the job file with the configured protocol and run process(path) on it, where path is where the claimed
+    file can be read. Return True if the job was claimed by this worker, False if another worker holds it.
+    A process() returning False failed on the job, which then gets a penalty result.
+    """
+    if CLAIM_PROTOCOL == "rename":
+        claimed_file = claim(job_file, get_inbox(stage))
+        if claimed_file is None:
+            debug_print(f"File {job_file} is claimed by another worker, skipping...")
+            return False
+        debug_print(f"Claimed: {job_file}")
+        job = ClaimedJob(claimed_file, Heartbeat(claimed_file).__enter__())
+        _CURRENT_JOB.job = job
+        succeeded = False
+        try:
+            if process(claimed_file) is False:
+                _handle_failed_process(job_file, stage, debug_print)
+            succeeded = True
+        finally:
+            _CURRENT_JOB.job = None
+            job.release(succeeded)
+        debug_print(f"Finished processing file: {job_file}")
+        return True
+
+    lock = FileLock(job_file + ".lock")
+    try:
+        lock.acquire(timeout=0)  # try to lock the file
+    except Timeout:
+        # If the file is locked and cannot be opened immediately, we skip it for this round
+        debug_print(f"File {job_file} is locked, skipping for this file...")
+        return False
+    try:
+        debug_print(f"Trying to open and lock: {job_file}")
+        if process(job_file) is False:
+            _handle_failed_process(job_file, stage, debug_print)
+        debug_print(f"Finished processing file: {job_file}")
+        debug_print(f"Releasing lock for: {job_file}")
+
+        # Temporarily rename the file to a _processed extension through atomic operation
+        processed_file = job_file + "." + stage + "_processed"
+        os.rename(job_file, processed_file)
+
+        # Now we can safely release the lock
+        lock.release()
+
+        # And finally delete the _processed file and the lock file
+        os.remove(processed_file)
+        debug_print(f"Removed file: {processed_file}")
+        os.remove(job_file + ".lock")
+    except FileNotFoundError:
+        # another worker finished the file between the listing and the lock
+        debug_print(f"File {job_file} not found, skipping for this file...")
+        lock.release()
+        return False
+    return True
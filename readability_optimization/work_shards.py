@@ -0,0 +1,122 @@
+"""
+This module lays out the shared-filesystem queue over hash-sharded subdirectories, so that a worker never has to list
+one huge directory. With NUM_SHARDS and NUM_WORKER_GROUPS both set to 1, every job file stays in the working directory
+and every result in readability_score_results/, as before.
+
+Otherwise, a job file lives in QUEUE_DIRECTORY/<stage>/<worker group>/<shard>/, where the worker group and the shard
+both come from a hash of the layout (or batch) id, and a result lives in readability_score_results/<shard>/.
+A worker scans the shards of its own group one at a time in round-robin order, and only falls back to the shards of the
+other groups when its own group has nothing left, so a group without workers can't strand its jobs.
+The group of a worker is WORKER_GROUP, or the GRAPHOPTIMA_WORKER_GROUP environment variable, or a hash of its host name,
+which keeps the workers of one node on the same shards.
+"""
+
+import json
+import os
+import socket
+import zlib
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for work_shards
+CONFIG = CONFIG["work_shards"]
+
+NUM_SHARDS = CONFIG["NUM_SHARDS"]
+NUM_WORKER_GROUPS = CONFIG["NUM_WORKER_GROUPS"]
+QUEUE_DIRECTORY = CONFIG["QUEUE_DIRECTORY"]
+WORKER_GROUP = CONFIG["WORKER_GROUP"]
+
+# the directories created so far by this process
+_CREATED_DIRECTORIES = set()
+
+
+def is_sharded() -> bool:
+    return NUM_SHARDS * NUM_WORKER_GROUPS > 1
+
+
+def _hash(key: str) -> int:
+    # crc32 is stable across processes and nodes, unlike hash()
+    return zlib.crc32(key.encode())
+
+
+def _ensure_directory(directory: str) -> str:
+    if directory not in _CREATED_DIRECTORIES:
+        os.makedirs(directory, exist_ok=True)
+        _CREATED_DIRECTORIES.add(directory)
+    return directory
+
+
+def get_shard_directory(stage: str, group: int, shard: int) -> str:
+    return os.path.join(QUEUE_DIRECTORY, stage, str(group), str(shard))
+
+
+def get_job_directory(stage: str, key: str, group: int = None) -> str:
+    """
+    Return (and create) the directory the job file of the given stage and layout or batch id goes to. The worker group
+    is picked by the hash as well, unless one is given.
+    """
+    if not is_sharded():
+        return "."
+    bucket = _hash(key) % (NUM_SHARDS * NUM_WORKER_GROUPS)
+    if group is None:
+        group = bucket // NUM_SHARDS
+    return _ensure_directory(get_shard_directory(stage, group, bucket % NUM_SHARDS))
+
+
+def get_stage_directories(stage: str, group: int = None) -> list:
+    """
+    Return the shard directories of a stage, for one worker group or for all of them.
+    """
+    if not is_sharded():
+        return ["."]
+    groups = range(NUM_WORKER_GROUPS) if group is None else [group]
+    return [
+        _ensure_directory(get_shard_directory(stage, g, shard))
+        for g in groups
+        for shard in range(NUM_SHARDS)
+    ]
+
+
+def get_worker_group() -> int:
+    group = WORKER_GROUP
+    if group is None:
+        group = os.environ.get("GRAPHOPTIMA_WORKER_GROUP")
+    if group is None:
+        return _hash(socket.gethostname()) % NUM_WORKER_GROUPS
+    return int(group) % NUM_WORKER_GROUPS
+
+
+def get_scan_directories(stages) -> tuple:
+    """
+    Return the shard directories a worker of the given stages scans: (those of its own group, those of the others).
+    """
+    own_group = get_worker_group()
+    own, others = [], []
+    for group in range(NUM_WORKER_GROUPS):
+        for stage in stages:
+            for directory in get_stage_directories(stage, group):
+                target = own if group == own_group else others
+                # without sharding every stage maps to the working directory
+                if directory not in own and directory not in others:
+                    target.append(directory)
+    return own, others
+
+
+def get_result_directory(key: str, base_directory: str) -> str:
+    """
+    Return (and create) the directory the result of the given layout or batch id goes to.
+    """
+    if NUM_SHARDS <= 1:
+        return base_directory
+    return _ensure_directory(os.path.join(base_directory, str(_hash(key) % NUM_SHARDS)))
+
+
+def get_result_directories(base_directory: str) -> list:
+    if NUM_SHARDS <= 1:
+        return [base_directory]
+    return [
+        _ensure_directory(os.path.join(base_directory, str(shard)))
+        for shard in range(NUM_SHARDS)
+    ]
@@ -0,0 +1,429 @@
+"""
+This module provides the event-driven work pickup used by the layout generators and the layout evaluator.
+Instead of scanning the working directory and sleeping for a second whenever nothing is found, a worker blocks on a
+DirectoryWatcher until a new job file lands in the directory through its atomic rename. On Linux the watcher uses inotify
+(through ctypes, so no extra dependency is needed); on other platforms, or when inotify can't be initialized, it falls
+back to polling.
+The same watcher backs the ResultWaiter, which lets the optimizer block on the readability results of many layouts with a
+single background thread instead of spinning on the results folder.
+Note: inotify only sees the renames done by the kernel of the current node. On a shared filesystem such as Lustre, the
+files produced on other nodes are picked up by the periodic rescan, which is why the wait always has a timeout.
+A watcher can also cover the shard directories of work_shards.py, in which case it lists one shard at a time.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import threading
+import time
+from utils import retrieve_file_list
+import work_shards
+import evaluation_record
+
+# Load configuration from JSON file
+with open("config.json") as f:
+    CONFIG = json.load(f)
+
+# Extract configurations for work_watcher
+CONFIG = CONFIG["work_watcher"]
+
+MODE = CONFIG["MODE"]
+RESCAN_INTERVAL = CONFIG["RESCAN_INTERVAL"]
+RESULT_MIN_BACKOFF = CONFIG["RESULT_MIN_BACKOFF"]
+RESULT_MAX_BACKOFF = CONFIG["RESULT_MAX_BACKOFF"]
+
+# inotify constants, see <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _init_inotify(directories: list):
+    """
+    Return an (inotify fd, watch descriptors) pair watching the given directories, or (None, None) if inotify is not
+    available on this platform.
+    """
+    library = ctypes.util.find_library("c")
+    if library is None:
+        return None, None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None, None
+    if fd < 0:
+        return None, None
+    wds = []
+    for directory in directories:
+        wd = libc.inotify_add_watch(
+            fd, os.fsencode(directory), IN_MOVED_TO | IN_CLOSE_WRITE | IN_CREATE
+        )
+        if wd < 0:
+            # most likely the user's inotify watch limit is reached
+            os.close(fd)
+            return None, None
+        wds.append(wd)
+    return fd, wds
+
+
+class DirectoryWatcher:
+    """
+    Watch a directory for job files matching the same startswith/not_startswith/endswith filter as
+    utils.retrieve_file_list.
+    With several directories (the shards of work_shards.py), list_jobs returns the jobs of the next non-empty one in
+    round-robin order, and only looks at the fallback directories when all the others are empty.
+    """
+
+    def __init__(
+        self,
+        directory: str = ".",
+        startswith: str = "",
+        not_startswith: str = ".",
+        endswith: str = "",
+        mode: str = MODE,
+        rescan_interval: float = RESCAN_INTERVAL,
+        directories: list = None,
+        fallback_directories: list = None,
+    ):
+        self.directory = directory
+        self.directories = directories or [directory]
+        self.fallback_directories = fallback_directories or []
+        self.startswith = startswith
+        self.not_startswith = not_startswith
+        self.endswith = endswith
+        self.rescan_interval = rescan_interval
+        # spread the workers over the shards instead of having them all start at the first one
+        self._cursor = hash(os.getpid()) % len(self.directories)
+        self._fallback_cursor = 0
+        # number of directories listed by the last list_jobs call, and since the last blocking wait
+        self._listed = 0
+        self._listed_unclaimed = 0
+        self.fd = None
+        if mode == "inotify":
+            self.fd, _ = _init_inotify(self.directories)
+        # self-pipe, so that another thread can cut a blocking wait short, see wake
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        # the mode actually in use, which can differ from the configured one after falling back to polling
+        self.mode = "inotify" if self.fd is not None else "polling"
+
+    def _matches(self, name: str) -> bool:
+        return (
+            name.startswith(self.startswith)
+            and not name.startswith(self.not_startswith)
+            and name.endswith(self.endswith)
+        )
+
+    def _list_directory(self, directory: str) -> list:
+        try:
+            names = retrieve_file_list(
+                startswith=self.startswith,
+                not_startswith=self.not_startswith,
+                endswith=self.endswith,
+                retrieve_directory=directory,
+            )
+        except FileNotFoundError:
+            return []
+        # the working directory keeps bare file names, as it always did
+        if directory == ".":
+            return sorted(names)
+        return sorted(os.path.join(directory, name) for name in names)
+
+    def list_jobs(self) -> list:
+        """
+        Return the matching job files, sorted so that every worker walks the queue in the same order.
+        """
+        if self._listed:
+            # the jobs of the previous call were claimed, as the caller didn't wait in between
+            self._listed_unclaimed = 0
+        self._listed = 0
+        for directories, cursor in (
+            (self.directories, "_cursor"),
+            (self.fallback_directories, "_fallback_cursor"),
+        ):
+            for _ in range(len(directories)):
+                index = getattr(self, cursor) % len(directories)
+                setattr(self, cursor, index + 1)
+                self._listed += 1
+                jobs = self._list_directory(directories[index])
+                if jobs:
+                    return jobs
+        return []
+
+    def queue_depth(self) -> int:
+        """
+        Return the number of job files currently waiting in the watched directories.
+        """
+        return sum(
+            len(self._list_directory(directory))
+            for directory in self.directories + self.fallback_directories
+        )
+
+    def _drain_events(self) -> bool:
+        # read all pending events and report whether any of them is a matching job file
+        found = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return found
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                name = buffer[offset : offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if self._matches(os.fsdecode(name)):
+                    found = True
+
+    def wake(self):
+        """
+        Return from the current (or next) wait right away, e.g. from another thread that has something new to look for.
+        """
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            # the pipe is full, so the wait is woken up already
+            pass
+
+    def _drain_wake(self):
+        while True:
+            try:
+                if not os.read(self._wake_read, 4096):
+                    return
+            except BlockingIOError:
+                return
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until a new matching job file shows up, wake is called, or the timeout (default: RESCAN_INTERVAL) expires.
+        Return True if a new job file was observed or the wait was woken up, False on timeout. In polling mode the call
+        simply sleeps unless woken up, and the caller is expected to rescan the directory afterwards either way.
+        """
+        if timeout is None:
+            timeout = self.rescan_interval
+        # the jobs listed last were all taken by other workers, but some shards haven't been looked at since the
+        # last wait, so go and check them first
+        self._listed_unclaimed += self._listed
+        self._listed = 0
+        if 0 < self._listed_unclaimed < len(self.directories) + len(
+            self.fallback_directories
+        ):
+            return True
+        self._listed_unclaimed = 0
+        fds = [self._wake_read] if self.fd is None else [self._wake_read, self.fd]
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select(fds, [], [], remaining)
+            if self._wake_read in readable:
+                self._drain_wake()
+                return True
+            if self.fd in readable and self._drain_events():
+                return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self._wake_read is not None:
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._wake_read = self._wake_write = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def count_jobs(
+    directory: str = ".", endswith: str = "", not_startswith: str = ".", stage: str = None
+) -> int:
+    """
+    One-shot queue depth of a directory, or of all the shards of a stage, used by the monitoring dashboard.
+    """
+    if stage is not None:
+        return sum(
+            count_jobs(directory=shard_directory, endswith=endswith, not_startswith=not_startswith)
+            for shard_directory in work_shards.get_stage_directories(stage)
+        )
+    try:
+        return len(
+            retrieve_file_list(
+                startswith="",
+                not_startswith=not_startswith,
+                endswith=endswith,
+                retrieve_directory=directory,
+            )
+        )
+    except FileNotFoundError:
+        return 0
+
+
+class ResultWaiter:
+    """
+    Wait on the result files (<uuid>.result) of many layouts at once. A single daemon thread watches the results folder
+    and wakes up the callers whose result has arrived. Between two rescans the thread backs off exponentially from
+    RESULT_MIN_BACKOFF to RESULT_MAX_BACKOFF, and goes back to the minimum as soon as a new file is noticed or a new
+    layout is waited on, which also cuts its current backoff short.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        endswith: str = evaluation_record.RESULT_EXTENSION,
+        min_backoff: float = RESULT_MIN_BACKOFF,
+        max_backoff: float = RESULT_MAX_BACKOFF,
+    ):
+        self.directory = directory
+        self.endswith = endswith
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        # the waiter can't be shared across a fork, see get_result_waiter
+        self.pid = os.getpid()
+        self._condition = threading.Condition()
+        # uuid -> one [threading.Event, result file path or None, cancelled flag] entry per caller waiting on it
+        self._pending = {}
+        self._watcher = DirectoryWatcher(
+            directories=work_shards.get_result_directories(directory),
+            endswith=endswith,
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _scan(self) -> bool:
+        # one listing of a results folder (or shard) serves every pending uuid in it
+        with self._condition:
+            waiting = [
+                uuid
+                for uuid, entries in self._pending.items()
+                if any(entry[1] is None for entry in entries)
+            ]
+        uuids_by_directory = {}
+        for uuid in waiting:
+            uuids_by_directory.setdefault(
+                work_shards.get_result_directory(uuid, self.directory), []
+            ).append(uuid)
+        found = False
+        for directory, uuids in uuids_by_directory.items():
+            try:
+                names = set(os.listdir(directory))
+            except FileNotFoundError:
+                continue
+            with self._condition:
+                for uuid in uuids:
+                    name = uuid + self.endswith
+                    if name not in names:
+                        continue
+                    for entry in self._pending.get(uuid, []):
+                        if entry[1] is None:
+                            entry[1] = os.path.join(directory, name)
+                            entry[0].set()
+                            found = True
+        return found
+
+    def _run(self):
+        backoff = self.min_backoff
+        while True:
+            with self._condition:
+                # nothing to wait for, so don't touch the filesystem at all
+                while not self._pending:
+                    self._condition.wait()
+            if self._scan():
+                backoff = self.min_backoff
+                continue
+            if self._watcher.wait(timeout=backoff):
+                backoff = self.min_backoff
+            else:
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def wait_for(self, uuid: str, timeout: float = None) -> str:
+        """
+        Block until the result file of the given layout exists and return its path.
+        Raise TimeoutError if it doesn't show up within the timeout (None waits forever), and return None if the wait
+        is cancelled through cancel().
+        """
+        return self.wait_for_any([uuid], timeout=timeout)[1]
+
+    def wait_for_any(self, uuids: list, timeout: float = None) -> tuple:
+        """
+        Block until the result file of one of the given layouts exists and return (uuid, path), e.g. for the original
+        and the speculative duplicate of a straggler. Raise TimeoutError as wait_for, and return (uuid, None) if the
+        wait on one of them is cancelled.
+        Every call has entries of its own, so that several callers can wait on the same layout.
+        """
+        event = threading.Event()
+        with self._condition:
+            entries = {}
+            for uuid in uuids:
+                entries[uuid] = [event, None, False]
+                self._pending.setdefault(uuid, []).append(entries[uuid])
+            self._condition.notify()
+        # the watcher thread may be backing off, look for the new layouts right away
+        self._watcher.wake()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if not event.wait(remaining):
+                    raise TimeoutError(
+                        f"No readability result for layout {', '.join(uuids)} after {timeout} seconds"
+                    )
+                with self._condition:
+                    for uuid, entry in entries.items():
+                        if entry[2]:
+                            return uuid, None
+                        if entry[1] is not None:
+                            return uuid, entry[1]
+                    # the event is only set together with a result or a cancellation, but never return without one
+                    event.clear()
+        finally:
+            with self._condition:
+                for uuid, entry in entries.items():
+                    waiters = [
+                        waiter for waiter in self._pending.get(uuid, []) if waiter is not entry
+                    ]
+                    if waiters:
+                        self._pending[uuid] = waiters
+                    else:
+                        self._pending.pop(uuid, None)
+
+    def cancel(self, uuid: str):
+        """
+        Wake up the caller waiting on the given layout, which then gets None instead of a result path.
+        """
+        with self._condition:
+            for entry in self._pending.get(uuid, []):
+                entry[2] = True
+                entry[0].set()
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+
+_RESULT_WAITERS = {}
+
+
+def get_result_waiter(directory: str) -> ResultWaiter:
+    """
+    Return the ResultWaiter of the given folder for the current process. The DE and NSGA2 pools fork the optimizer, and
+    a watcher thread doesn't survive a fork, so every process lazily starts its own.
+    """
+    waiter = _RESULT_WAITERS.get(directory)
+    if waiter is None or waiter.pid != os.getpid():
+        waiter = ResultWaiter(directory=directory)
+        _RESULT_WAITERS[directory] = waiter
+    return waiter